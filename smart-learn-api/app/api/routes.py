@@ -1,21 +1,30 @@
-from fastapi import APIRouter, UploadFile, File, BackgroundTasks, HTTPException, Response
+from fastapi import APIRouter, UploadFile, File, HTTPException, Response, Header, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+import os
+import json
+import asyncio
 import uuid
 import time
 from async_lru import alru_cache
-import httpx
-
-from app.core.ingestion import extract_text, chunk_text, extract_text_from_url
-from app.core.embedding import get_embeddings, get_embedding
-from app.core.database import add_documents, query_documents, list_documents, delete_document, delete_knowledge_base, set_kb_metadata, get_kb_metadata, list_knowledge_bases, get_collection
-from app.core.llm import generate_response
+from typing import NamedTuple
+
+from app.core.answer_cache import get_answer_cache, is_cacheable
+from app.core.http_clients import get_kb_client
+from app.core.metrics import QUERY_STAGE_SECONDS, observe_stages, register_collector
+from app.core.ingestion import extract_text, extract_text_from_url, iter_pdf_pages, Chunk, get_chunker
+from app.core.embedding import get_embeddings, get_embedding, batcher
+from app.core.data_access import add_documents, query_documents, list_documents, delete_document, delete_knowledge_base, set_kb_metadata, list_knowledge_bases, get_collection, get_document_chunks, replace_document, search_lexical, get_compiled_prompt, list_document_records, get_conversation_history, append_conversation, clear_conversations
+from app.core.lexical import reciprocal_rank_fusion
+from app.core.llm import generate_response, generate_response_stream, LLMStreamError, ERROR_PREFIX
+from app.core.jobs import get_queue, register_handler, report_stage, report_progress
+from app.core import crawler
+from app.core.api_keys import hash_key
 from app.config import settings
+from app.utils.hashing import text_hash, file_hash, chunk_id
 
 router = APIRouter()
 
-# Global conversation history: {kb_id: [ {"role": "user/assistant", "content": "...", "timestamp": ...} ]}
-chat_histories = {}
-
 class CreateKBRequest(BaseModel):
     name: str
 
@@ -43,7 +52,7 @@ async def get_all_knowledge_bases():
     """
     List all available knowledge bases.
     """
-    return list_knowledge_bases()
+    return await list_knowledge_bases()
 
 @router.post("/kbs", response_model=KBResponse)
 async def create_knowledge_base(request: CreateKBRequest):
@@ -52,9 +61,9 @@ async def create_knowledge_base(request: CreateKBRequest):
     """
     kb_id = str(uuid.uuid4())[:8] # Short ID
     # Set default metadata with empty custom fields
-    set_kb_metadata(kb_id, request.name, assistant_name="", instruction="", custom_instruction=False, conversation_types=[])
+    await set_kb_metadata(kb_id, request.name, assistant_name="", instruction="", custom_instruction=False, conversation_types=[])
     # Ensure collection exists
-    get_collection(kb_id)
+    await get_collection(kb_id)
     return KBResponse(
         id=kb_id, 
         name=request.name,
@@ -66,11 +75,32 @@ async def create_knowledge_base(request: CreateKBRequest):
 
 class QueryRequest(BaseModel):
     query: str
+    session_id: str | None = None  # Device/session whose conversation continues; also accepted as X-Session-Id
+
+def resolve_session_id(request: QueryRequest, header_session_id: str | None, http_request: Request | None = None) -> str:
+    """
+    Conversation session of a query. Clients that send none get one per device: derived from the
+    API key they authenticate with (Authorization: Bearer or X-API-Key), else from their address.
+    Only requests with neither share the KB's "default" session.
+    """
+    session_id = request.session_id or header_session_id
+    if session_id:
+        return session_id
+    if http_request is not None:
+        authorization = http_request.headers.get("Authorization", "")
+        api_key = authorization[7:].strip() if authorization[:7].lower() == "bearer " else http_request.headers.get("X-API-Key")
+        if api_key:
+            return f"key:{hash_key(api_key)[:16]}"
+        if http_request.client is not None and http_request.client.host:
+            return f"addr:{http_request.client.host}"
+    return "default"
 
 class QueryResponse(BaseModel):
     answer: str
     context: list[str]
     latency: float
+    cached: bool = False  # Served from the answer cache
+    timings: dict[str, float] | None = None  # Per-stage seconds, with ?timings=true
 
 class KBMetadataRequest(BaseModel):
     name: str
@@ -84,7 +114,7 @@ async def set_knowledge_base_metadata(kb_id: str, request: KBMetadataRequest):
     """
     Set metadata (e.g., name, assistant_name, instruction, custom_instruction, conversation_types) for a knowledge base.
     """
-    set_kb_metadata(
+    await set_kb_metadata(
         kb_id, 
         request.name, 
         assistant_name=request.assistant_name,
@@ -96,281 +126,722 @@ async def set_knowledge_base_metadata(kb_id: str, request: KBMetadataRequest):
 
 # ... (existing endpoints) ...
 
-@router.post("/kb/{kb_id}/query", response_model=QueryResponse)
-async def query_knowledge_base(kb_id: str, request: QueryRequest):
+async def query_external_kb(query: str) -> dict:
     """
-    Query the specific knowledge base and get an answer from the LLM.
+    Forward a query to the external knowledge base configured through KB_URL.
     """
-    if settings.KB_URL:
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    settings.KB_URL,
-                    json={"query": request.query},
-                    timeout=60.0
-                )
-                response.raise_for_status()
-                return QueryResponse(**response.json())
-        except Exception as e:
-            print(f"Error querying external KB: {e}")
-            raise HTTPException(status_code=500, detail=f"External KB Error: {str(e)}")
-
-    start_time = time.time()
-    
-    query_vec = await cached_query_embedding(request.query)
-    
-    results = query_documents(kb_id, query_vec, n_results=5)
-    
-    # Fetch KB metadata for system prompt
-    metadata = get_kb_metadata(kb_id)
-    kb_name = metadata.get("name", "Knowledge Base")
-    assistant_name = metadata.get("assistant_name", kb_name)
-    
-    # Robust boolean check (handles bool, int 0/1, or string "true"/"false")
-    raw_enabled = metadata.get("custom_instruction", False)
-    custom_instruction_enabled = str(raw_enabled).lower() in ["true", "1", "t", "yes", "y"] if not isinstance(raw_enabled, bool) else raw_enabled
-    custom_instruction_text = metadata.get("instruction", "")
-    
-    if not results['documents'] or not results['documents'][0]:
-        retrieved_chunks = []
+    try:
+        response = await get_kb_client().post(settings.KB_URL, json={"query": query})
+        response.raise_for_status()
+        return response.json()
+    except Exception as e:
+        print(f"Error querying external KB: {e}")
+        raise HTTPException(status_code=500, detail=f"External KB Error: {str(e)}")
+
+def _documents(results: dict) -> list[str]:
+    if not results.get('documents') or not results['documents'][0]:
+        return []
+    return results['documents'][0]
+
+class Retrieval(NamedTuple):
+    chunks: list[str]
+    query_vec: list[float] | None = None  # None when no embedding was used (lexical mode or fallback)
+    cached: dict | None = None  # Answer cache hit, see answer_cache.AnswerCache.lookup
+
+def _cached_answer(kb_id: str, query: str, query_vec: list[float], timings: dict) -> Retrieval | None:
+    if not is_cacheable(query):
+        return None
+    stage_start = time.perf_counter()
+    hit = get_answer_cache().lookup(kb_id, query_vec)
+    timings["answer_cache"] = time.perf_counter() - stage_start
+    return Retrieval(hit["context"], query_vec, hit) if hit else None
+
+async def retrieve_chunks(kb_id: str, query: str, timings: dict, n_results: int = 5) -> Retrieval:
+    """
+    Retrieve the context chunks for a query according to RETRIEVAL_MODE.
+    In hybrid mode BM25 runs while the query is embedded and both rankings are fused with reciprocal
+    rank fusion; if the embedding fails or takes longer than LEXICAL_FALLBACK_TIMEOUT, BM25 answers alone.
+    As soon as the query embedding is available the answer cache is checked, and a hit skips retrieval.
+    """
+    mode = settings.RETRIEVAL_MODE
+    timings["embedding"] = 0.0
+    if mode == "vector":
+        stage_start = time.perf_counter()
+        query_vec = await cached_query_embedding(query)
+        timings["embedding"] = time.perf_counter() - stage_start
+        if cached := _cached_answer(kb_id, query, query_vec, timings):
+            return cached
+        stage_start = time.perf_counter()
+        results = await query_documents(kb_id, query_vec, n_results=n_results)
+        timings["retrieval"] = time.perf_counter() - stage_start
+        return Retrieval(_documents(results), query_vec)
+
+    stage_start = time.perf_counter()
+    lexical_task = asyncio.create_task(search_lexical(kb_id, query, settings.RETRIEVAL_CANDIDATES))
+    if mode == "lexical":
+        lexical_chunks = _documents(await lexical_task)
+        timings["retrieval"] = timings["lexical"] = time.perf_counter() - stage_start
+        return Retrieval(lexical_chunks[:n_results])
+
+    embedding_task = asyncio.create_task(cached_query_embedding(query))
+    # Don't leave an exception unretrieved if a task finishes after we stopped waiting for it
+    for task in (embedding_task, lexical_task):
+        task.add_done_callback(lambda task: task.cancelled() or task.exception())
+    done, _ = await asyncio.wait({embedding_task}, timeout=settings.LEXICAL_FALLBACK_TIMEOUT or None)
+    timings["embedding"] = time.perf_counter() - stage_start
+    query_vec = embedding_task.result() if embedding_task in done and embedding_task.exception() is None else None
+    if query_vec is not None and (cached := _cached_answer(kb_id, query, query_vec, timings)):
+        return cached
+    lexical_chunks = _documents(await lexical_task)
+    timings["lexical"] = time.perf_counter() - stage_start
+
+    stage_start = time.perf_counter()
+    if query_vec is not None:
+        results = await query_documents(kb_id, query_vec, n_results=settings.RETRIEVAL_CANDIDATES)
+        retrieved_chunks = reciprocal_rank_fusion([_documents(results), lexical_chunks], k=settings.RRF_K, limit=n_results)
     else:
-        retrieved_chunks = results['documents'][0]
-    
+        reason = embedding_task.exception() if embedding_task in done else "timed out"
+        print(f"Query embedding unavailable for KB {kb_id} ({reason}); answering from BM25 only")
+        retrieved_chunks = lexical_chunks[:n_results]
+    timings["retrieval"] = time.perf_counter() - stage_start
+    return Retrieval(retrieved_chunks, query_vec)
+
+async def prepare_query(kb_id: str, query: str, session_id: str = "default") -> dict:
+    """
+    Retrieve context for a query and build the system instruction and conversation history for the LLM.
+    Returns the pieces needed by generate_response plus per-stage timings in seconds.
+    On an answer cache hit "cached_answer" is set and no prompt is built.
+    """
+    timings = {}
+    answer_cache = get_answer_cache()
+    if is_cacheable(query) and answer_cache.refresh_due(kb_id):
+        # Picks up invalidations made by other workers
+        await asyncio.to_thread(answer_cache.refresh, kb_id)
+    cache_generation = answer_cache.generation(kb_id)
+    retrieval = await retrieve_chunks(kb_id, query, timings)
+    retrieved_chunks = retrieval.chunks
+    prepared = {
+        "retrieved_chunks": retrieved_chunks,
+        "query_vec": retrieval.query_vec,
+        "cache_generation": cache_generation,
+        "cached_answer": retrieval.cached["answer"] if retrieval.cached else None,
+        "asked_at": time.time(),
+        "timings": timings,
+    }
+    if retrieval.cached:
+        return prepared
+
+    stage_start = time.perf_counter()
     context = "\n\n".join(retrieved_chunks) if retrieved_chunks else ""
     
-    # Check if the KB has ANY documents at all
-    from app.core.database import has_documents
-    kb_has_data = has_documents(kb_id)
-
-    # Fetch and clean document names for identity/intro summary
-    raw_docs = list_documents(kb_id)
-    cleaned_docs = []
-    for d in raw_docs:
-        # 1. Handle URLs (specifically Wikipedia)
-        if d.startswith("http"):
-            # Take last part of path, replace underscores/dashes with spaces, title case
-            clean_name = d.split("/")[-1].replace("_", " ").replace("-", " ")
-        else:
-            # 2. Handle filenames (remove extensions)
-            clean_name = d.rsplit(".", 1)[0] if "." in d else d
-        
-        if clean_name.strip():
-            cleaned_docs.append(clean_name.strip())
+    # The static system prompt is compiled once per KB profile; only the context-dependent variant is picked here
+    system_instruction = (await get_compiled_prompt(kb_id)).render(has_context=bool(context.strip()))
 
-    if len(cleaned_docs) > 1:
-        doc_summary = ", ".join(cleaned_docs[:-1]) + " and " + cleaned_docs[-1]
-    elif len(cleaned_docs) == 1:
-        doc_summary = cleaned_docs[0]
-    else:
-        doc_summary = "general topics"
-
-    # Determine system instruction
-    if custom_instruction_enabled and custom_instruction_text.strip():
-        # Replace placeholders like {assistant_name} and {kb_name} to make instructions dynamic
-        system_instruction = custom_instruction_text.replace("{assistant_name}", assistant_name).replace("{kb_name}", kb_name)
-        
-        # Grounding Logic:
-        # 1. If KB has data: Enforce strict grounding (use context or decline)
-        # 2. If KB is empty: Let the AI speak freely based on the custom instruction personality
-        if kb_has_data:
-            if context.strip():
-                system_instruction += f"\n\nIMPORTANT: Use the provided context from the '{kb_name}' knowledge base to answer. Avoid using outside knowledge. If the answer is not in the context, politely say you don't have that specific information."
-            else:
-                system_instruction += f"\n\nIMPORTANT: The user is asking about a topic not found in the '{kb_name}' knowledge base. Politely explain that you can only answer questions based on the provided documents ({doc_summary}) and suggest what topics YOU CAN help with."
-    else:
-        # Default instruction
-        if not kb_has_data:
-            # KB is empty - allow free-roaming helpful assistant
-            system_instruction = f"""You are {assistant_name}, a helpful, polite, and friendly AI assistant.
-            Your tone should be warm, professional, and conversational.
-            If asked who you are, introduce yourself as {assistant_name} and mention you are ready to help once documents are added to the '{kb_name}'.
-            """
-        else:
-            # KB has data - enforce grounding and identity
-            system_instruction = f"""You are {assistant_name}, the {kb_name} assistant. 
-            I have specific knowledge about: {doc_summary}.
-            
-            IDENTITY GUIDELINES:
-            If the user asks "Who are you?" or "What is your name?", always respond naturally:
-            "I am {assistant_name}, your {kb_name} assistant. I have knowledge about {doc_summary}."
-            
-            Your tone should be warm, professional, and conversational.
-            
-            GROUNDING RULES:
-            1. Answer questions ONLY using the information provided in the context from the '{kb_name}'.
-            2. If context is provided, give a clear, concise answer based strictly on that context.
-            3. If context is NOT relevant, politely explain that your current knowledge is limited to {doc_summary} and suggest those topics.
-
-            NEVER use outside knowledge to answer if documents have been provided.
-            """
-
-    # Append conversation-type-specific behavior from KB metadata
-    ct = metadata.get("conversation_types") or []
-    extras = []
-    if "Q&A" in ct:
-        extras.append("Answer in a direct, concise Q&A style. Prioritize clarity and brevity.")
-    if "Follow-up Question" in ct:
-        extras.append("Support follow-up questions (e.g. 'Can you elaborate?', 'What about X?'). Keep conversation context in mind and welcome follow-ups.")
-    if "Revision Mode" in ct:
-        extras.append("If the user requests a revision, rephrasing, or says 'Actually I meant...', provide an updated answer willingly and without repeating the old one at length.")
-    if extras:
-        system_instruction = (system_instruction.rstrip() + "\n\nConversation behavior:\n" + "\n".join("- " + e for e in extras) + "\n")
-
-    # Final constraint: brevity (for small device screens)
-    system_instruction += "\n\nIMPORTANT: Keep your response extremely short and concise (less than 200 characters)."
+    timings["prompt"] = time.perf_counter() - stage_start
 
     # --- Conversation History Logic ---
-    now = time.time()
-    if kb_id not in chat_histories:
-        chat_histories[kb_id] = []
-    
-    # Clear history if more than 5 minutes have passed since the last interaction
-    if chat_histories[kb_id] and (now - chat_histories[kb_id][-1]["timestamp"] > 300):
-        chat_histories[kb_id] = []
-    
-    # Extract the last 6 messages (3 User-Assistant exchanges) for the LLM context
+    # The store forgets sessions idle for CONVERSATION_TTL; the last few messages go to the LLM
     # We only pass 'role' and 'content' to generate_response
+    now = time.time()
     llm_history = [
-        {"role": m["role"], "content": m["content"]} 
-        for m in chat_histories[kb_id][-6:]
+        {"role": m["role"], "content": m["content"]}
+        for m in await get_conversation_history(kb_id, session_id, limit=settings.CONVERSATION_HISTORY_MESSAGES)
     ]
 
-    answer = await generate_response(context, request.query, system_instruction, history=llm_history)
+    prepared.update(context=context, system_instruction=system_instruction, history=llm_history, asked_at=now)
+    return prepared
+
+def cache_answer(kb_id: str, query: str, answer: str, prepared: dict):
+    """
+    Store a freshly generated answer in the answer cache (not error messages, not BM25-only answers).
+    """
+    if prepared["query_vec"] is None or not is_cacheable(query) or answer.startswith(ERROR_PREFIX):
+        return
+    get_answer_cache().store(kb_id, query, prepared["query_vec"], answer, prepared["retrieved_chunks"], generation=prepared["cache_generation"])
+
+async def record_exchange(kb_id: str, session_id: str, query: str, answer: str, asked_at: float):
+    """
+    Store a completed user/assistant exchange in the session's conversation history.
+    """
+    await append_conversation(kb_id, session_id, [
+        {"role": "user", "content": query, "timestamp": asked_at},
+        {"role": "assistant", "content": answer, "timestamp": time.time()},
+    ])
+
+@router.post("/kb/{kb_id}/query", response_model=QueryResponse)
+async def query_knowledge_base(kb_id: str, request: QueryRequest, http_request: Request, timings: bool = False, x_session_id: str | None = Header(None)):
+    """
+    Query the specific knowledge base and get an answer from the LLM.
+    With timings=true the response includes the per-stage breakdown in seconds.
+    """
+    if settings.KB_URL:
+        return QueryResponse(**await query_external_kb(request.query))
+
+    start_time = time.time()
+    session_id = resolve_session_id(request, x_session_id, http_request)
     
-    # Store current interaction in history
-    chat_histories[kb_id].append({"role": "user", "content": request.query, "timestamp": now})
-    chat_histories[kb_id].append({"role": "assistant", "content": answer, "timestamp": time.time()})
+    prepared = await prepare_query(kb_id, request.query, session_id)
+
+    stage_timings = prepared["timings"]
+    if prepared["cached_answer"] is not None:
+        answer = prepared["cached_answer"]
+    else:
+        llm_start = time.perf_counter()
+        answer = await generate_response(prepared["context"], request.query, prepared["system_instruction"], history=prepared["history"], cache_key=f"kb-{kb_id}")
+        stage_timings["llm"] = time.perf_counter() - llm_start
+        cache_answer(kb_id, request.query, answer, prepared)
     
-    # Optional: Keep the internal history list small (last 20 messages)
-    chat_histories[kb_id] = chat_histories[kb_id][-20:]
+    # Failed generations are returned to the client but kept out of the conversation
+    if not answer.startswith(ERROR_PREFIX):
+        await record_exchange(kb_id, session_id, request.query, answer, prepared["asked_at"])
 
     latency = time.time() - start_time
+    stage_timings["total"] = latency
+    observe_stages(QUERY_STAGE_SECONDS, stage_timings, kb_id=kb_id)
     
     return QueryResponse(
         answer=answer,
-        context=retrieved_chunks,
-        latency=latency
+        context=prepared["retrieved_chunks"],
+        latency=latency,
+        cached=prepared["cached_answer"] is not None,
+        timings=stage_timings if timings else None,
     )
 
-async def process_file(kb_id: str, file_content: bytes, filename: str, filename_override: str = None):
+def _encode_stream_frame(event: str, data: dict, stream_format: str) -> str:
+    if stream_format == "ndjson":
+        return json.dumps({"type": event, **data}) + "\n"
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.post("/kb/{kb_id}/query/stream")
+async def stream_query_knowledge_base(kb_id: str, request: QueryRequest, http_request: Request, format: str = "sse", x_session_id: str | None = Header(None)):
+    """
+    Query the specific knowledge base and stream the answer as it is generated.
+    format=sse sends Server-Sent Events, format=ndjson sends one JSON object per line.
+    Token frames carry {"token"}; the final "done" frame carries the full answer, the retrieved
+    context, total latency, time_to_first_token and the per-stage timings (all in seconds), and
+    whether the answer came from the answer cache (sent as a single token frame).
+    If generation fails midway the stream ends with an "error" frame ({"error", "partial_answer"}) instead of "done".
+    """
+    if format not in ("sse", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be 'sse' or 'ndjson'")
+
+    start_time = time.time()
+
+    if settings.KB_URL:
+        external = await query_external_kb(request.query)
+
+        async def external_frames():
+            latency = time.time() - start_time
+            yield _encode_stream_frame("token", {"token": external.get("answer", "")}, format)
+            yield _encode_stream_frame("done", {
+                "answer": external.get("answer", ""),
+                "context": external.get("context", []),
+                "latency": latency,
+                "time_to_first_token": latency,
+                "timings": {},
+            }, format)
+
+        frames = external_frames()
+    else:
+        # Retrieval runs before the response starts so its errors still map to HTTP status codes
+        session_id = resolve_session_id(request, x_session_id, http_request)
+        prepared = await prepare_query(kb_id, request.query, session_id)
+
+        async def llm_frames():
+            llm_start = time.time()
+            first_token_at = None
+            parts = []
+            if prepared["cached_answer"] is not None:
+                first_token_at = time.time()
+                parts.append(prepared["cached_answer"])
+                yield _encode_stream_frame("token", {"token": prepared["cached_answer"]}, format)
+            else:
+                try:
+                    async for token in generate_response_stream(prepared["context"], request.query, prepared["system_instruction"], history=prepared["history"], cache_key=f"kb-{kb_id}"):
+                        if first_token_at is None:
+                            first_token_at = time.time()
+                        parts.append(token)
+                        yield _encode_stream_frame("token", {"token": token}, format)
+                except LLMStreamError as e:
+                    # The tokens sent so far are an incomplete answer: neither cached nor kept in the conversation
+                    print(f"LLM stream failed for KB {kb_id} after {len(parts)} tokens: {e}")
+                    yield _encode_stream_frame("error", {"error": str(e), "partial_answer": "".join(parts)}, format)
+                    return
+
+            answer = "".join(parts)
+            if prepared["cached_answer"] is None:
+                cache_answer(kb_id, request.query, answer, prepared)
+            await record_exchange(kb_id, session_id, request.query, answer, prepared["asked_at"])
+
+            end_time = time.time()
+            timings = dict(prepared["timings"], llm=end_time - llm_start)
+            observe_stages(QUERY_STAGE_SECONDS, dict(timings, total=end_time - start_time), kb_id=kb_id)
+            yield _encode_stream_frame("done", {
+                "answer": answer,
+                "context": prepared["retrieved_chunks"],
+                "latency": end_time - start_time,
+                "time_to_first_token": (first_token_at or end_time) - start_time,
+                "timings": timings,
+                "cached": prepared["cached_answer"] is not None,
+            }, format)
+
+        frames = llm_frames()
+
+    media_type = "application/x-ndjson" if format == "ndjson" else "text/event-stream"
+    # X-Accel-Buffering stops reverse proxies (nginx) from holding back tokens
+    return StreamingResponse(frames, media_type=media_type, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+class ChunkBatch:
+    """
+    Embeds and stores the pending chunks of one or more documents of a KB together, INGEST_FLUSH_SIZE at a time.
+    Writers closed while sharing the batch are finalized once their last chunks are stored.
+    """
+
+    def __init__(self, kb_id: str):
+        self.kb_id = kb_id
+        self._pending = []  # [(id, text, metadata)] waiting to be embedded
+        self._closing = []  # writers to finalize after the next flush
+
+    async def add(self, chunk_id: str, text: str, metadata: dict):
+        self._pending.append((chunk_id, text, metadata))
+        if len(self._pending) >= settings.INGEST_FLUSH_SIZE:
+            await self.flush()
+
+    async def flush(self):
+        if self._pending:
+            ids = [chunk_id for chunk_id, _, _ in self._pending]
+            texts = [text for _, text, _ in self._pending]
+            metadatas = [metadata for _, _, metadata in self._pending]
+            self._pending = []
+
+            report_stage("embed")
+            embeddings = await get_embeddings(texts)
+            report_stage("store")
+            await add_documents(self.kb_id, ids=ids, documents=texts, embeddings=embeddings, metadatas=metadatas)
+        closing, self._closing = self._closing, []
+        for writer in closing:
+            await writer.finalize()
+
+    def close_after_flush(self, writer: "DocumentWriter"):
+        self._closing.append(writer)
+
+class DocumentWriter:
+    """
+    Streams the chunks of one document into the store, embedding and flushing INGEST_FLUSH_SIZE chunks at a time.
+    With incremental=True, chunks already stored for the source (same chunk hash) are kept instead of re-embedded,
+    and close() drops what is left of the previous version in one swap (see replace_document).
+    Writers given a shared ChunkBatch embed their chunks together with the other documents of the batch.
+    Chunk IDs derive from (source, content hash, chunk index), so a retried job overwrites the chunks
+    an earlier attempt already flushed instead of duplicating them.
+    """
+
+    def __init__(self, kb_id: str, source: str, content_hash: str, incremental: bool = False, batch: ChunkBatch | None = None):
+        self.kb_id = kb_id
+        self.source = source
+        self.content_hash = content_hash
+        self.chunk_count = 0
+        self.byte_size = 0
+        self.new_chunks = 0
+        self._batch = batch or ChunkBatch(kb_id)
+        self._shared = batch is not None
+        self._available = None  # {chunk_hash: [ids]} of the stored version, incremental mode only
+        self._retained_ids, self._retained_metadatas = [], []
+        self._incremental = incremental
+
+    async def open(self):
+        """
+        Load the chunk hashes of the stored version (incremental mode); call before the first write().
+        """
+        if self._incremental:
+            self._available = {}
+            for chunk in await get_document_chunks(self.kb_id, self.source):
+                self._available.setdefault(chunk["chunk_hash"], []).append(chunk["id"])
+
+    async def write(self, chunk: Chunk):
+        chunk_hash = text_hash(chunk.text)
+        own_id = chunk_id(self.source, self.content_hash, self.chunk_count)
+        metadata = {"source": self.source, "chunk_index": self.chunk_count, "content_hash": self.content_hash, "chunk_hash": chunk_hash}
+        if chunk.page_start is not None:
+            metadata["page_start"] = chunk.page_start
+            metadata["page_end"] = chunk.page_end
+        self.chunk_count += 1
+        self.byte_size += len(chunk.text.encode("utf-8"))
+
+        available = self._available.get(chunk_hash) if self._available else None
+        if available:
+            # Prefer the chunk's own ID (flushed by an earlier attempt), so no later chunk is stored over a retained one
+            retained = own_id if own_id in available else available[-1]
+            available.remove(retained)
+            self._retained_ids.append(retained)
+            self._retained_metadatas.append(metadata)
+            return
+
+        self.new_chunks += 1
+        await self._batch.add(own_id, chunk.text, metadata)
+
+    async def flush(self):
+        await self._batch.flush()
+
+    async def close(self):
+        """
+        Store the remaining chunks and finalize the document. With a shared batch both happen at its next flush.
+        """
+        if self._shared:
+            self._batch.close_after_flush(self)
+            return
+        await self._batch.flush()
+        await self.finalize()
+
+    async def finalize(self):
+        if self._available is None:
+            return
+        stale_ids = [stale_id for ids in self._available.values() for stale_id in ids]
+        report_stage("store")
+        await replace_document(
+            self.kb_id, self.source,
+            retained_ids=self._retained_ids, retained_metadatas=self._retained_metadatas,
+            stale_ids=stale_ids,
+            chunk_count=self.chunk_count, byte_size=self.byte_size, content_hash=self.content_hash,
+        )
+        print(f"Updated {self.source} in KB {self.kb_id}: {self.new_chunks} new, {len(self._retained_ids)} unchanged, {len(stale_ids)} removed chunks")
+
+class StoredUpload:
+    """
+    UploadFile-like handle to an upload kept on disk; extraction workers read it by path.
+    """
+    def __init__(self, path: str, filename: str):
+        self.path = path
+        self.filename = filename
+
+    async def read(self) -> bytes:
+        with open(self.path, "rb") as f:
+            return f.read()
+
+async def iter_upload_units(upload: StoredUpload):
+    """
+    Yield (text, page_number) units of an upload: page by page for PDFs, a single unit for other formats.
+    """
+    if upload.filename.lower().endswith(".pdf"):
+        async for page_number, text in iter_pdf_pages(upload.path):
+            yield text, page_number
+    else:
+        yield await extract_text(upload), None
+
+async def process_file(kb_id: str, file_path: str, filename: str, filename_override: str = None, incremental: bool = False):
     """
-    Background task to process uploaded file: extract, chunk, embed, store.
+    Ingestion job to process uploaded file: extract, chunk, embed, store.
+    Runs as a stream (page by page for PDFs, flushing in fixed-size batches) so memory stays flat for large documents.
+    With incremental=True the stored version of the document is updated in place instead of appended to.
+    Errors are re-raised so the job queue can retry the job.
     """
     try:
-        # Create a temporary UploadFile-like object from bytes
-        from io import BytesIO
-        
-        class TempUploadFile:
-            def __init__(self, content: bytes, filename: str):
-                self.file = BytesIO(content)
-                self.filename = filename
-            
-            async def read(self):
-                return self.file.read()
-        
-        temp_file = TempUploadFile(file_content, filename)
-        text = await extract_text(temp_file)
-        chunks = chunk_text(text, chunk_size=settings.CHUNK_SIZE, overlap=settings.CHUNK_OVERLAP)
+        target_filename = filename_override if filename_override else filename
+        writer = DocumentWriter(kb_id, target_filename, file_hash(file_path), incremental=incremental)
+        await writer.open()
+        chunker = get_chunker()
+
+        report_stage("extract")
+        async for text, page in iter_upload_units(StoredUpload(file_path, filename)):
+            report_stage("chunk")
+            for chunk in chunker.feed(text, page):
+                await writer.write(chunk)
+            report_stage("extract")
+        report_stage("chunk")
+        for chunk in chunker.finish():
+            await writer.write(chunk)
         
-        if not chunks:
+        if not writer.chunk_count:
             print(f"No text extracted from {filename}")
             return
 
-        embeddings = await get_embeddings(chunks)
-        ids = [str(uuid.uuid4()) for _ in chunks]
-        
-        target_filename = filename_override if filename_override else filename
-        metadatas = [{"source": target_filename, "chunk_index": i} for i in range(len(chunks))]
-        
-        add_documents(kb_id, ids=ids, documents=chunks, embeddings=embeddings, metadatas=metadatas)
+        await writer.close()
         print(f"Successfully processed {filename} for KB {kb_id}")
         
     except Exception as e:
         print(f"Error processing file {filename} for KB {kb_id}: {e}")
+        raise
+
+async def run_file_job(kb_id: str, payload: dict):
+    await process_file(kb_id, payload["upload_path"], payload["filename"], payload.get("filename_override"), incremental=payload.get("incremental", False))
+
+def _copy_upload(source, path: str, max_bytes: int) -> int:
+    """
+    Copy an upload to `path` UPLOAD_COPY_CHUNK_KB at a time. Returns the size, or -1 (and removes the
+    partial copy) once it exceeds max_bytes.
+    """
+    chunk_size = settings.UPLOAD_COPY_CHUNK_KB * 1024
+    size = 0
+    source.seek(0)
+    with open(path, "wb") as f:
+        while chunk := source.read(chunk_size):
+            size += len(chunk)
+            if size > max_bytes:
+                break
+            f.write(chunk)
+    if size > max_bytes:
+        os.remove(path)
+        return -1
+    return size
+
+async def enqueue_upload(kb_id: str, file: UploadFile, filename_override: str = None, incremental: bool = False) -> str:
+    """
+    Persist an uploaded file next to the job queue and enqueue its ingestion.
+    The multipart parser already spools the upload to a temporary file; it is copied to the job's
+    upload path in chunks (in a thread, off the event loop), so the upload is never held in memory whole.
+    """
+    max_bytes = int(settings.MAX_UPLOAD_MB * 1024 * 1024)
+    if file.size is not None and file.size > max_bytes:
+        raise HTTPException(status_code=413, detail=f"File too large (limit {settings.MAX_UPLOAD_MB:g} MB)")
+    queue = get_queue()
+    job_id = queue.new_job_id()
+    upload_path = queue.upload_path(job_id)
+    # Copy before enqueueing (the file handle will be closed after the endpoint returns)
+    if await asyncio.to_thread(_copy_upload, file.file, upload_path, max_bytes) < 0:
+        raise HTTPException(status_code=413, detail=f"File too large (limit {settings.MAX_UPLOAD_MB:g} MB)")
+    payload = {"upload_path": upload_path, "filename": file.filename, "filename_override": filename_override, "incremental": incremental}
+    return await asyncio.to_thread(queue.enqueue, "file", kb_id, payload, source=filename_override or file.filename, job_id=job_id)
 
 @router.post("/kb/{kb_id}/ingest")
-async def ingest_document(kb_id: str, background_tasks: BackgroundTasks, file: UploadFile = File(...)):
+async def ingest_document(kb_id: str, file: UploadFile = File(...)):
     """
     Upload a document (PDF, CSV, TXT) for background ingestion into a specific KB.
+    Track progress with GET /jobs/{job_id}.
     """
-    # Read file content before passing to background task (file handle will be closed after this endpoint returns)
-    file_content = await file.read()
-    background_tasks.add_task(process_file, kb_id, file_content, file.filename)
-    return {"message": f"File upload accepted for KB {kb_id}. Processing in background."}
+    job_id = await enqueue_upload(kb_id, file)
+    return {"message": f"File upload accepted for KB {kb_id}. Processing in background.", "job_id": job_id}
 
 class UrlRequest(BaseModel):
     url: str
 
 async def process_url(kb_id: str, url: str):
     """
-    Background task to process URL: scrape, chunk, embed, store.
+    Ingestion job to process URL: scrape, chunk, embed, store.
+    Errors are re-raised so the job queue can retry the job.
     """
     try:
+        report_stage("extract")
         text = await extract_text_from_url(url)
         
-        chunks = chunk_text(text, chunk_size=settings.CHUNK_SIZE, overlap=settings.CHUNK_OVERLAP)
+        report_stage("chunk")
+        writer = DocumentWriter(kb_id, url, text_hash(text))
+        chunker = get_chunker()
+        for chunk in chunker.feed(text) + chunker.finish():
+            await writer.write(chunk)
         
-        if not chunks:
+        if not writer.chunk_count:
             print(f"No text extracted from URL {url}")
             return
 
-        embeddings = await get_embeddings(chunks)
-        ids = [str(uuid.uuid4()) for _ in chunks]
-        
-        metadatas = [{"source": url, "chunk_index": i} for i in range(len(chunks))]
-        
-        add_documents(kb_id, ids=ids, documents=chunks, embeddings=embeddings, metadatas=metadatas)
+        await writer.close()
         print(f"Successfully processed URL {url} for KB {kb_id}")
         
     except Exception as e:
         print(f"Error processing URL {url} for KB {kb_id}: {e}")
+        raise
+
+async def run_url_job(kb_id: str, payload: dict):
+    await process_url(kb_id, payload["url"])
+
+class CrawlRequest(BaseModel):
+    urls: list[str] = []  # Pages to ingest
+    sitemap: str | None = None  # Sitemap (or sitemap index) listing pages to ingest
+    seed: str | None = None  # Start page whose links are followed up to max_depth hops
+    max_depth: int = 1
+    max_pages: int = 100  # Capped by CRAWL_MAX_PAGES
+    same_domain: bool = True  # Only follow links to the hosts of the start pages
+
+async def process_crawl(kb_id: str, payload: dict):
+    """
+    Ingestion job for many URLs: fetch the pages concurrently (see app.core.crawler), skip pages that are
+    unchanged or duplicate the content of another page, and embed and store the rest through one shared ChunkBatch.
+    Failed pages are logged and skipped; the job only fails when no page could be fetched.
+    """
+    max_pages = max(1, min(payload.get("max_pages") or settings.CRAWL_MAX_PAGES, settings.CRAWL_MAX_PAGES))
+    urls = list(payload.get("urls") or [])
+    report_stage("extract")
+    if payload.get("sitemap"):
+        urls += await crawler.fetch_sitemap(payload["sitemap"], max_pages)
+    max_depth = max(0, payload.get("max_depth", 1)) if payload.get("seed") else 0
+
+    stored = {record["source"]: record["content_hash"] for record in await list_document_records(kb_id)}
+    known_hashes = {content_hash: source for source, content_hash in stored.items() if content_hash}
+    # Conditional requests only for pages still in the KB, so deleted pages are fetched again.
+    # Validators are recorded once a crawl has stored all of its pages, so their content hash (unlike the
+    # registry's, which is set by the first stored batch) marks a page as completely stored.
+    validators = {url: v for url, v in crawler.get_validators(kb_id).items() if url in stored}
+    completed = {url: v["content_hash"] for url, v in validators.items()}
+    crawl = crawler.Crawler(urls, max_pages, max_depth, payload.get("same_domain", True), validators, seed=payload.get("seed"))
+    batch = ChunkBatch(kb_id)
+    fetched, counts, done = [], {"stored": 0, "unchanged": 0, "duplicate": 0, "failed": 0}, 0
+
+    async for page in crawl.crawl():
+        done += 1
+        report_progress(done, crawl.discovered)
+        if page.error:
+            print(f"Error crawling {page.url} for KB {kb_id}: {page.error}")
+            counts["failed"] += 1
+            continue
+        if page.not_modified:
+            counts["unchanged"] += 1
+            fetched.append((page, completed.get(page.url)))
+            continue
+
+        content_hash = text_hash(page.text)
+        fetched.append((page, content_hash))
+        if known_hashes.get(content_hash, page.url) != page.url:
+            counts["duplicate"] += 1
+            continue
+        known_hashes[content_hash] = page.url
+        if completed.get(page.url) == content_hash:
+            counts["unchanged"] += 1
+            continue
+
+        report_stage("chunk")
+        writer = DocumentWriter(kb_id, page.url, content_hash, incremental=page.url in stored, batch=batch)
+        await writer.open()
+        chunker = get_chunker()
+        for chunk in chunker.feed(page.text) + chunker.finish():
+            await writer.write(chunk)
+        if writer.chunk_count:
+            await writer.close()
+            counts["stored"] += 1
+        report_stage("extract")
+
+    await batch.flush()
+    # Validators are recorded once the pages are stored, so an interrupted crawl re-fetches them
+    for page, content_hash in fetched:
+        crawler.record_page(kb_id, page.url, page.etag, page.last_modified, content_hash)
+
+    print(f"Crawled {done} pages for KB {kb_id}: " + ", ".join(f"{count} {name}" for name, count in counts.items()))
+    if done and counts["failed"] == done:
+        raise RuntimeError(f"None of the {done} pages could be fetched")
+
+async def run_crawl_job(kb_id: str, payload: dict):
+    await process_crawl(kb_id, payload)
+
+register_handler("file", run_file_job)
+register_handler("url", run_url_job)
+register_handler("crawl", run_crawl_job)
 
 @router.post("/kb/{kb_id}/ingest/url")
-async def ingest_url(kb_id: str, background_tasks: BackgroundTasks, request: UrlRequest):
+async def ingest_url(kb_id: str, request: UrlRequest):
     """
     Ingest content from a URL into a specific KB.
+    Track progress with GET /jobs/{job_id}.
     """
-    background_tasks.add_task(process_url, kb_id, request.url)
-    return {"message": f"URL ingestion accepted for KB {kb_id}. Processing in background."}
+    job_id = await asyncio.to_thread(get_queue().enqueue, "url", kb_id, {"url": request.url}, source=request.url)
+    return {"message": f"URL ingestion accepted for KB {kb_id}. Processing in background.", "job_id": job_id}
+
+@router.post("/kb/{kb_id}/ingest/urls")
+async def ingest_urls(kb_id: str, request: CrawlRequest):
+    """
+    Ingest many web pages in one background job: a list of URLs, a sitemap, and/or a seed URL whose links are crawled.
+    Re-running a crawl only re-embeds pages that changed. Track progress with GET /jobs/{job_id}.
+    """
+    if not (request.urls or request.sitemap or request.seed):
+        raise HTTPException(status_code=400, detail="Provide urls, a sitemap or a seed URL")
+    source = request.seed or request.sitemap or (request.urls[0] if len(request.urls) == 1 else f"{len(request.urls)} URLs")
+    job_id = await asyncio.to_thread(get_queue().enqueue, "crawl", kb_id, request.model_dump(), source=source)
+    return {"message": f"Bulk URL ingestion accepted for KB {kb_id}. Processing in background.", "job_id": job_id}
+
+class JobResponse(BaseModel):
+    id: str
+    kb_id: str
+    kind: str
+    source: str | None = None
+    status: str
+    stage: str | None = None
+    progress: float = 0.0
+    attempts: int = 0
+    max_attempts: int = 0
+    error: str | None = None
+    stage_timings: dict[str, float] = {}
+    created_at: float
+    started_at: float | None = None
+    finished_at: float | None = None
+
+@router.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_ingestion_job(job_id: str):
+    """
+    Get status, current stage (extract/chunk/embed/store), progress and stage timings of an ingestion job.
+    """
+    job = await asyncio.to_thread(get_queue().get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return JobResponse(**job)
+
+@router.get("/kb/{kb_id}/jobs", response_model=list[JobResponse])
+async def list_ingestion_jobs(kb_id: str, limit: int = 50):
+    """
+    List the most recent ingestion jobs of a knowledge base, newest first.
+    """
+    return [JobResponse(**job) for job in await asyncio.to_thread(get_queue().list_jobs, kb_id, limit=limit)]
 
 @router.get("/kb/{kb_id}/documents", response_model=list[str])
 async def list_knowledge_base_documents(kb_id: str):
     """
     List all documents currently in the specific knowledge base.
     """
-    return list_documents(kb_id)
+    return await list_documents(kb_id)
 
 @router.delete("/kb/{kb_id}/documents")
 async def delete_knowledge_base_document(kb_id: str, filename: str):
     """
     Delete a document from the specific knowledge base by filename.
     """
-    delete_document(kb_id, filename)
+    await delete_document(kb_id, filename)
     return {"message": f"Document {filename} deleted successfully from KB {kb_id}."}
 
 @router.put("/kb/{kb_id}/documents")
-async def update_knowledge_base_document(kb_id: str, filename: str, background_tasks: BackgroundTasks, file: UploadFile = File(...)):
+async def update_knowledge_base_document(kb_id: str, filename: str, file: UploadFile = File(...)):
     """
     Update a document in the specific knowledge base.
+    Only changed chunks are re-embedded and the old version stays queryable until the new one is stored.
     """
-    delete_document(kb_id, filename)
-    # Read file content before passing to background task
-    file_content = await file.read()
-    background_tasks.add_task(process_file, kb_id, file_content, file.filename, filename)
-    return {"message": f"Document {filename} update started in background for KB {kb_id}."}
+    job_id = await enqueue_upload(kb_id, file, filename_override=filename, incremental=True)
+    return {"message": f"Document {filename} update started in background for KB {kb_id}.", "job_id": job_id}
 
 @router.delete("/kb/{kb_id}")
 async def delete_knowledge_base_endpoint(kb_id: str):
     """
     Delete an entire knowledge base.
     """
-    delete_knowledge_base(kb_id)
+    await delete_knowledge_base(kb_id)
+    await clear_conversations(kb_id)
     return {"message": f"Knowledge base {kb_id} deleted successfully."}
 
+@router.get("/cache/stats")
+async def get_answer_cache_stats():
+    """
+    Answer cache hit/miss counts and hit rates, overall and per knowledge base.
+    """
+    return get_answer_cache().stats()
+
 @alru_cache(maxsize=100)
 async def cached_query_embedding(query: str):
     return await get_embedding(query)
 
+def collect_cache_metrics():
+    info = cached_query_embedding.cache_info()
+    return [
+        ("smart_learn_query_embedding_memo_requests_total", "counter", "In-process query embedding memo lookups by result.",
+         [({"result": "hit"}, info.hits), ({"result": "miss"}, info.misses)]),
+        ("smart_learn_answer_cache_entries", "gauge", "Answers held in the answer cache.", [({}, get_answer_cache().stats()["entries"])]),
+    ]
+
+def collect_embedding_batch_metrics():
+    stats = batcher.snapshot()
+    return [
+        ("smart_learn_embedding_batch_requests_total", "counter", "Single-text embedding requests submitted to the batcher.", [({}, stats["requests"])]),
+        ("smart_learn_embedding_batches_total", "counter", "Embeddings requests sent by the batcher.", [({}, stats["batches"])]),
+        ("smart_learn_embedding_batch_fill", "gauge", "Average batch size as a fraction of EMBEDDING_BATCH_MAX_SIZE.", [({}, stats["avg_batch_fill"])]),
+        ("smart_learn_embedding_queue_delay_seconds", "gauge", "Time requests waited in the batcher before their batch was sent.",
+         [({"stat": "avg"}, stats["avg_queue_delay"]), ({"stat": "max"}, stats["max_queue_delay"])]),
+    ]
+
+register_collector(collect_cache_metrics)
+register_collector(collect_embedding_batch_metrics)
+
 @router.post("/iot/generate-nvs")
 async def generate_nvs_endpoint(request: NvsConfigRequest):
     """
@@ -6,12 +6,89 @@ class Settings(BaseSettings):
     CHROMA_DB_PATH: str = "./chroma_db"
     EMBEDDING_MODEL: str = "text-embedding-3-small"
     LLM_MODEL: str = "gpt-4o-mini"
-    CHUNK_SIZE: int = 1000
+    EMBEDDING_BATCH_MAX_SIZE: int = 64  # Max queries coalesced into one embeddings request
+    EMBEDDING_BATCH_WAIT_MS: float = 5.0  # Window for coalescing concurrent queries; 0 disables batching
+    EMBEDDING_MAX_BATCH_ITEMS: int = 512  # Inputs per embeddings request (provider limit is 2048)
+    EMBEDDING_MAX_BATCH_TOKENS: int = 200_000  # Estimated tokens per request (provider limit is 300k; the gap absorbs estimation error)
+    EMBEDDING_CONCURRENCY: int = 4  # Batches of one get_embeddings call in flight at once
+    EMBEDDING_MAX_RETRIES: int = 3
+    EMBEDDING_RETRY_BACKOFF: float = 0.5  # Seconds before the first retry, doubled per attempt
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_PATH: str | None = None  # Defaults to embedding_cache.sqlite3 inside CHROMA_DB_PATH
+    EMBEDDING_CACHE_MAX_MB: int = 512  # Least recently used vectors are evicted beyond this size
+    EMBEDDING_CACHE_TOUCH_SECONDS: float = 60.0  # How often the recency of cache hits is written to disk
+    INGEST_WORKERS: int = 2  # Concurrent ingestion jobs per process; 0 disables workers in this process
+    INGEST_MAX_ATTEMPTS: int = 3
+    INGEST_RETRY_BACKOFF: float = 5.0  # Seconds before the first retry, doubled per attempt
+    INGEST_JOB_LEASE: float = 60.0  # Running jobs without a heartbeat for this long are requeued
+    INGEST_POLL_INTERVAL: float = 1.0
+    JOBS_DB_PATH: str | None = None  # Defaults to jobs.sqlite3 inside CHROMA_DB_PATH
+    UPLOADS_DIR: str | None = None  # Defaults to uploads/ inside CHROMA_DB_PATH
+    EXTRACT_WORKERS: int = 2  # Processes for PDF/DOCX/CSV/HTML extraction; 0 runs extraction in a thread
+    EXTRACT_TIMEOUT: float = 300.0  # Seconds before a single extraction is abandoned
+    MAX_UPLOAD_MB: float = 200  # Larger uploads are rejected with 413
+    UPLOAD_COPY_CHUNK_KB: int = 1024  # Uploads are copied to UPLOADS_DIR in pieces of this size
+    PDF_PAGE_BATCH: int = 8  # PDF pages extracted per worker call during streaming ingestion
+    INGEST_FLUSH_SIZE: int = 128  # Chunks embedded and stored per batch
+    VECTOR_STORE: str = "chroma"  # "chroma" or "local" (memory-mapped matrices with brute-force/HNSW search)
+    LOCAL_VECTOR_PATH: str | None = None  # Defaults to vectors/ inside CHROMA_DB_PATH
+    LOCAL_VECTOR_DTYPE: str = "float32"  # float32, float16 or int8 storage for the local vector store
+    LOCAL_VECTOR_DIMS: int | None = None  # Keep only the first N dimensions (Matryoshka truncation); None keeps all
+    LOCAL_RERANK_CANDIDATES: int = 50  # Candidates re-scored at full precision for float16/int8/truncated KBs; 0 disables
+    LOCAL_HNSW_THRESHOLD: int = 50_000  # Chunks from which a KB is searched with HNSW (needs hnswlib) instead of brute force
+    LOCAL_HNSW_EF: int = 64  # HNSW search breadth; higher is more accurate and slower
+    RETRIEVAL_MODE: str = "hybrid"  # "hybrid" (BM25 + vector, fused), "vector" or "lexical"
+    RETRIEVAL_CANDIDATES: int = 10  # Results taken from each retriever before fusion
+    RRF_K: int = 60  # Reciprocal rank fusion constant
+    LEXICAL_FALLBACK_TIMEOUT: float = 2.0  # Seconds to wait for the query embedding before answering from BM25 alone; 0 waits indefinitely
+    STORE_WORKERS: int = 8  # Threads running blocking vector store / index calls off the event loop
+    STORE_WRITE_CONCURRENCY: int = 2  # Store writes in flight at once, leaving the other threads to queries
+    STORE_WRITE_BATCH: int = 32  # Chunks per store write; queries of the KB run between batches
+    ANSWER_CACHE_ENABLED: bool = True  # Serve answers to near-identical questions from a per-KB semantic cache
+    ANSWER_CACHE_THRESHOLD: float = 0.95  # Cosine similarity between question embeddings needed for a cache hit
+    ANSWER_CACHE_TTL: float = 3600.0  # Seconds a cached answer is served
+    ANSWER_CACHE_RECHECK_SECONDS: float = 1.0  # How often a worker checks for KB changes made by other workers (bounds how long a stale answer is served)
+    ANSWER_CACHE_MAX_ENTRIES: int = 2048  # Least recently used answers are evicted beyond this count (all KBs)
+    ANSWER_CACHE_MIN_WORDS: int = 3  # Shorter questions (usually follow-ups that depend on history) are never cached
+    CONVERSATION_STORE: str = "memory"  # "memory" (per process), "sqlite" or "redis" (shared across workers)
+    CONVERSATION_DB_PATH: str | None = None  # Defaults to conversations.sqlite3 inside CHROMA_DB_PATH
+    CONVERSATION_REDIS_URL: str = "redis://localhost:6379/0"
+    CONVERSATION_TTL: float = 300.0  # Seconds of inactivity after which a session's history is forgotten
+    CONVERSATION_MAX_MESSAGES: int = 20  # Messages kept per session (ring buffer)
+    CONVERSATION_HISTORY_MESSAGES: int = 6  # Most recent messages sent to the LLM
+    CONVERSATION_MAX_MB: int = 64  # Memory backend: least recently active sessions are evicted beyond this size
+    # Device API keys
+    API_KEYS_DB_PATH: str | None = None  # Defaults to api_keys.sqlite3 inside CHROMA_DB_PATH; keys are stored as SHA-256 digests
+    API_KEYS_RECHECK_SECONDS: float = 1.0  # How often a worker checks for keys changed by other workers (bounds how long a revoked key keeps working)
+    # Outbound HTTP: pooled keep-alive clients for KB_URL proxying and URL ingestion
+    HTTP_MAX_CONNECTIONS: int = 100  # Per client
+    HTTP_MAX_KEEPALIVE: int = 20  # Idle connections kept open per client
+    HTTP_KEEPALIVE_EXPIRY: float = 30.0  # Seconds an idle connection is kept open
+    HTTP_CONNECT_TIMEOUT: float = 10.0
+    HTTP2: bool = False  # Requires the http2 extra (pip install -e ".[http2]")
+    KB_URL_TIMEOUT: float = 60.0  # Seconds to wait for the external KB at KB_URL
+    URL_FETCH_TIMEOUT: float = 30.0  # Seconds to wait for a page fetched for ingestion
+    # Bulk URL ingestion (POST /kb/{kb_id}/ingest/urls)
+    CRAWL_CONCURRENCY: int = 8  # Pages fetched at once per crawl
+    CRAWL_PER_HOST: int = 2  # Requests in flight to one host
+    CRAWL_HOST_DELAY: float = 0.25  # Minimum seconds between requests to one host
+    CRAWL_MAX_PAGES: int = 500  # Upper bound for the pages of one crawl
+    CRAWL_DB_PATH: str | None = None  # Defaults to crawl.sqlite3 inside CHROMA_DB_PATH (ETag / Last-Modified per page)
+    # HTML extraction for URL ingestion
+    HTML_ENGINE: str = "auto"  # "auto" (lxml, then selectolax, then bs4), "lxml", "selectolax" or "bs4" (pure Python)
+    HTML_MAIN_CONTENT: bool = True  # Keep only the main content; drop navigation, footers, references and similar boilerplate
+    CHUNKER: str = "structured"  # "structured" (sentence/heading aware, token budget) or "fixed" (character windows)
+    CHUNK_MAX_TOKENS: int = 250  # Token budget per chunk for the structured chunker (~1000 characters)
+    CHUNK_OVERLAP_TOKENS: int = 0  # Trailing sentences (up to this many tokens) repeated in the next chunk
+    CHUNK_SIZE: int = 1000  # Characters per chunk for the fixed chunker
     CHUNK_OVERLAP: int = 200
     PROJECT_NAME: str = "Smart Learn API"
     VERSION: str = "0.1.0"
     DESCRIPTION: str = "Smart Learn Avatar API application using FastAPI and ChromaDB"
     KB_URL: str | None = None
+    REGISTRY_DB_PATH: str | None = None  # Defaults to registry.sqlite3 inside CHROMA_DB_PATH
+    LEXICAL_DB_PATH: str | None = None  # Defaults to lexical.sqlite3 inside CHROMA_DB_PATH
+    KB_PROFILE_TTL: float = 300.0  # Seconds a cached KB profile is trusted (bounds staleness across workers)
 
     class Config:
         env_file = ".env"
@@ -0,0 +1,183 @@
+"""
+Semantic answer cache.
+
+Answers are cached per KB together with the embedding of the question that produced them. A new
+question whose embedding is within ANSWER_CACHE_THRESHOLD cosine similarity of a cached one is
+answered from the cache, skipping retrieval and the LLM call. Entries expire after ANSWER_CACHE_TTL,
+the least recently used are evicted beyond ANSWER_CACHE_MAX_ENTRIES, and every change to a KB's
+documents or metadata drops that KB's entries (see database.invalidate_kb_profile).
+
+The cache lives in each process. Changes also bump the KB's generation in the shared registry
+(registry.bump_generation); before answering from the cache a worker re-checks it, at most every
+ANSWER_CACHE_RECHECK_SECONDS per KB, so answers invalidated by another worker stop being served
+within that interval.
+"""
+import time
+import itertools
+import threading
+from collections import Counter, OrderedDict
+import numpy as np
+from app.config import settings
+from app.core import registry
+from app.core.metrics import CACHE_REQUESTS
+
+class AnswerCache:
+    def __init__(self, threshold: float, ttl: float, max_entries: int, recheck: float = 1.0, shared_generation=None):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.recheck = recheck
+        self.shared_generation = shared_generation  # kb_id -> generation shared across workers, or None
+        self._shared = {}  # {kb_id: (shared generation the entries belong to, monotonic time it was checked)}
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._entries = OrderedDict()  # {entry_id: entry}, least recently used first
+        self._by_kb = {}  # {kb_id: {entry_id: entry}}
+        self._matrices = {}  # {kb_id: (entry_ids, normalized vectors)}, rebuilt after the KB's entries change
+        self._generations = Counter()  # {kb_id: invalidation count}
+        self._hits = Counter()
+        self._misses = Counter()
+
+    def _matrix(self, kb_id: str):
+        if kb_id not in self._matrices:
+            entries = self._by_kb.get(kb_id, {})
+            ids = list(entries)
+            vectors = np.stack([entries[i]["vector"] for i in ids]) if ids else np.empty((0, 0), dtype=np.float32)
+            self._matrices[kb_id] = (ids, vectors)
+        return self._matrices[kb_id]
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        self._by_kb[entry["kb_id"]].pop(entry_id, None)
+        self._matrices.pop(entry["kb_id"], None)
+
+    def _nearest(self, kb_id: str, vector: np.ndarray):
+        ids, vectors = self._matrix(kb_id)
+        if not ids or vectors.shape[1] != vector.shape[0]:
+            return None, 0.0
+        scores = vectors @ vector
+        best = int(np.argmax(scores))
+        return ids[best], float(scores[best])
+
+    def lookup(self, kb_id: str, embedding: list[float]) -> dict | None:
+        """
+        Cached {"query", "answer", "context", "similarity"} for a question close enough to this one, or None.
+        """
+        vector = _normalize(embedding)
+        with self._lock:
+            entry_id, similarity = self._nearest(kb_id, vector)
+            if entry_id is not None and time.time() - self._entries[entry_id]["created_at"] > self.ttl:
+                self._remove(entry_id)
+                entry_id, similarity = self._nearest(kb_id, vector)
+            if entry_id is None or similarity < self.threshold:
+                self._misses[kb_id] += 1
+                CACHE_REQUESTS.inc(cache="answer", result="miss")
+                return None
+            self._hits[kb_id] += 1
+            CACHE_REQUESTS.inc(cache="answer", result="hit")
+            self._entries.move_to_end(entry_id)
+            entry = self._entries[entry_id]
+            return {"query": entry["query"], "answer": entry["answer"], "context": entry["context"], "similarity": similarity}
+
+    def generation(self, kb_id: str) -> int:
+        """
+        Invalidation count of a KB; pass it to store() to drop answers computed before an invalidation.
+        """
+        with self._lock:
+            return self._generations[kb_id]
+
+    def store(self, kb_id: str, query: str, embedding: list[float], answer: str, context: list[str], generation: int | None = None):
+        vector = _normalize(embedding)
+        with self._lock:
+            if generation is not None and generation != self._generations[kb_id]:
+                return
+            # A near-duplicate question replaces the older entry instead of piling up
+            entry_id, similarity = self._nearest(kb_id, vector)
+            if entry_id is not None and similarity >= self.threshold:
+                self._remove(entry_id)
+            entry_id = next(self._ids)
+            entry = {"kb_id": kb_id, "query": query, "vector": vector, "answer": answer, "context": list(context), "created_at": time.time()}
+            self._entries[entry_id] = entry
+            self._by_kb.setdefault(kb_id, {})[entry_id] = entry
+            self._matrices.pop(kb_id, None)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, kb_id: str, shared_generation: int | None = None):
+        """
+        Drop every cached answer of a KB; shared_generation is the KB's generation after the change.
+        """
+        with self._lock:
+            self._drop(kb_id)
+            if shared_generation is not None:
+                self._shared[kb_id] = (shared_generation, time.monotonic())
+
+    def _drop(self, kb_id: str):
+        self._generations[kb_id] += 1
+        for entry_id in list(self._by_kb.pop(kb_id, {})):
+            self._entries.pop(entry_id, None)
+        self._matrices.pop(kb_id, None)
+
+    def refresh_due(self, kb_id: str) -> bool:
+        """
+        Whether the KB's shared generation should be re-checked (see refresh) before the cache is used.
+        """
+        if self.shared_generation is None:
+            return False
+        checked = self._shared.get(kb_id)
+        return checked is None or time.monotonic() - checked[1] >= self.recheck
+
+    def refresh(self, kb_id: str):
+        """
+        Drop the KB's entries if another worker changed the KB since they were cached. Reads shared state; call it off the event loop.
+        """
+        generation = self.shared_generation(kb_id)
+        with self._lock:
+            checked = self._shared.get(kb_id)
+            if checked is not None and checked[0] != generation:
+                self._drop(kb_id)
+            self._shared[kb_id] = (generation, time.monotonic())
+
+    def stats(self) -> dict:
+        """
+        Hit/miss counts and hit rate, overall and per KB.
+        """
+        with self._lock:
+            kb_ids = sorted(set(self._hits) | set(self._misses) | set(self._by_kb))
+            per_kb = {
+                kb_id: _rates(self._hits[kb_id], self._misses[kb_id], len(self._by_kb.get(kb_id, {})))
+                for kb_id in kb_ids
+            }
+            return {**_rates(sum(self._hits.values()), sum(self._misses.values()), len(self._entries)), "kbs": per_kb}
+
+def _normalize(embedding) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+def _rates(hits: int, misses: int, entries: int) -> dict:
+    lookups = hits + misses
+    return {"hits": hits, "misses": misses, "hit_rate": hits / lookups if lookups else 0.0, "entries": entries}
+
+_cache = None
+
+def get_answer_cache() -> AnswerCache:
+    """
+    Get the process-wide answer cache.
+    """
+    global _cache
+    if _cache is None:
+        _cache = AnswerCache(
+            settings.ANSWER_CACHE_THRESHOLD,
+            settings.ANSWER_CACHE_TTL,
+            settings.ANSWER_CACHE_MAX_ENTRIES,
+            settings.ANSWER_CACHE_RECHECK_SECONDS,
+            registry.get_generation,
+        )
+    return _cache
+
+def is_cacheable(query: str) -> bool:
+    """
+    Whether a question may be served from / stored in the cache. Very short questions ("why?", "more")
+    usually depend on the conversation so far and are always answered fresh.
+    """
+    return settings.ANSWER_CACHE_ENABLED and len(query.split()) >= settings.ANSWER_CACHE_MIN_WORDS
@@ -0,0 +1,140 @@
+"""
+Device API key -> KB lookup table.
+
+Keys are stored only as SHA-256 digests in SQLite and served from an in-memory dict loaded at
+startup, so authenticating a device costs one hash and one dict lookup. Writes go through to SQLite
+before the dict is updated, and bump a generation counter. A key missing from the dict is looked up
+in SQLite once, so keys added by another worker are picked up without a restart; every
+API_KEYS_RECHECK_SECONDS a worker compares the generation and reloads the dict when it changed, so
+keys revoked by another worker (or with a deleted KB) stop working within that interval.
+
+Mappings kept by older versions in the iot_api_keys ChromaDB collection are moved here (and the
+collection dropped) at startup by database.migrate_api_keys.
+"""
+import time
+import hashlib
+import threading
+from app.config import settings
+from app.utils.sqlite import connect, default_path
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS api_keys (
+    key_hash TEXT PRIMARY KEY,
+    kb_id TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_api_keys_kb ON api_keys (kb_id);
+CREATE TABLE IF NOT EXISTS key_generation (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    generation INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO key_generation (id, generation) VALUES (0, 0);
+"""
+
+_lock = threading.Lock()
+_conn = None
+_keys = None  # {key_hash: kb_id}
+_generation = None  # generation the dict was loaded at
+_checked_at = 0.0
+
+def _get_conn():
+    global _conn
+    if _conn is None:
+        _conn = connect(settings.API_KEYS_DB_PATH or default_path("api_keys.sqlite3"))
+        _conn.executescript(_SCHEMA)
+    return _conn
+
+def hash_key(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+def _read_generation(conn) -> int:
+    return conn.execute("SELECT generation FROM key_generation WHERE id = 0").fetchone()["generation"]
+
+def _bump_generation(conn):
+    conn.execute("UPDATE key_generation SET generation = generation + 1 WHERE id = 0")
+
+def load() -> int:
+    """
+    (Re)load every mapping into memory. Returns the number of keys.
+    """
+    global _keys, _generation, _checked_at
+    with _lock:
+        conn = _get_conn()
+        with conn:  # one transaction, so the generation matches the rows read
+            generation = _read_generation(conn)
+            rows = conn.execute("SELECT key_hash, kb_id FROM api_keys").fetchall()
+        _keys = {row["key_hash"]: row["kb_id"] for row in rows}
+        _generation, _checked_at = generation, time.monotonic()
+        return len(_keys)
+
+def _loaded() -> dict:
+    global _checked_at
+    if _keys is None:
+        load()
+    elif time.monotonic() - _checked_at >= settings.API_KEYS_RECHECK_SECONDS:
+        with _lock:
+            generation = _read_generation(_get_conn())
+            _checked_at = time.monotonic()
+        if generation != _generation:
+            load()
+    return _keys
+
+def set_key(api_key: str, kb_id: str):
+    """
+    Map a device API key to a KB, replacing any previous mapping of the key.
+    """
+    set_key_hashes({hash_key(api_key): kb_id})
+
+def set_key_hashes(mapping: dict[str, str]):
+    """
+    Store already hashed keys ({key_hash: kb_id}), e.g. when migrating.
+    """
+    keys = _loaded()
+    now = time.time()
+    with _lock:
+        conn = _get_conn()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO api_keys (key_hash, kb_id, created_at) VALUES (?, ?, ?)",
+                [(key_hash, kb_id, now) for key_hash, kb_id in mapping.items()],
+            )
+            _bump_generation(conn)
+        keys.update(mapping)
+
+def lookup(api_key: str) -> str | None:
+    """
+    KB ID of a device API key, or None for unknown keys.
+    """
+    key_hash = hash_key(api_key)
+    kb_id = _loaded().get(key_hash)
+    if kb_id is not None:
+        return kb_id
+    with _lock:
+        row = _get_conn().execute("SELECT kb_id FROM api_keys WHERE key_hash = ?", (key_hash,)).fetchone()
+        if row is None:
+            return None
+        _keys[key_hash] = row["kb_id"]
+        return row["kb_id"]
+
+def revoke(api_key: str):
+    key_hash = hash_key(api_key)
+    keys = _loaded()
+    with _lock:
+        conn = _get_conn()
+        with conn:
+            conn.execute("DELETE FROM api_keys WHERE key_hash = ?", (key_hash,))
+            _bump_generation(conn)
+        keys.pop(key_hash, None)
+
+def drop_knowledge_base(kb_id: str):
+    """
+    Revoke every key of a deleted knowledge base.
+    """
+    keys = _loaded()
+    with _lock:
+        conn = _get_conn()
+        with conn:
+            conn.execute("DELETE FROM api_keys WHERE kb_id = ?", (kb_id,))
+            _bump_generation(conn)
+        for key_hash in [h for h, owner in keys.items() if owner == kb_id]:
+            del keys[key_hash]
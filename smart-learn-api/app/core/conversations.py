@@ -0,0 +1,290 @@
+"""
+Conversation history per (KB, session).
+
+Each device or browser session on a KB has its own conversation, kept as a ring buffer of the last
+CONVERSATION_MAX_MESSAGES messages and forgotten after CONVERSATION_TTL seconds without activity.
+CONVERSATION_STORE selects the backend:
+- memory: in-process, least recently active sessions are evicted beyond CONVERSATION_MAX_MB
+- sqlite: shared by all workers on the host through conversations.sqlite3
+- redis: shared through a Redis-compatible server at CONVERSATION_REDIS_URL (needs the redis package);
+  TTLs are native and the memory cap is the server's maxmemory policy
+
+The sqlite and redis backends block on disk or network I/O, so request handlers go through the async
+helpers in app.core.data_access, which run them in the store pool.
+"""
+import json
+import time
+import threading
+from urllib.parse import quote
+from collections import OrderedDict, deque
+from app.config import settings
+from app.utils.sqlite import connect, default_path
+
+try:
+    import redis
+except ImportError:  # optional: pip install redis
+    redis = None
+
+# Approximate per-message overhead (tuple, strings, float) used for the memory cap
+_MESSAGE_OVERHEAD = 120
+
+class ConversationStore:
+    """
+    Interface of the conversation backends. Messages are {"role", "content", "timestamp"} dicts.
+    """
+    blocking = True  # Whether calls do I/O and must stay off the event loop
+
+    def history(self, kb_id: str, session_id: str, limit: int | None = None) -> list[dict]:
+        """
+        The last `limit` messages of a session, oldest first; empty once the session has expired.
+        """
+        raise NotImplementedError
+
+    def append(self, kb_id: str, session_id: str, messages: list[dict]):
+        raise NotImplementedError
+
+    def clear(self, kb_id: str, session_id: str | None = None):
+        """
+        Forget one session, or every session of a KB.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class MemoryConversationStore(ConversationStore):
+    blocking = False
+
+    def __init__(self, max_messages: int, ttl: float, max_bytes: int):
+        self.max_messages = max_messages
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # {(kb_id, session_id): [ring buffer of (role, content, timestamp), last_active, size]}, least recently active first
+        self._sessions = OrderedDict()
+        self._bytes = 0
+
+    def _evict(self, now: float, keep=None):
+        # Sessions are ordered by last activity, so expired sessions and cap victims are at the front
+        while self._sessions:
+            key, (_, last_active, size) = next(iter(self._sessions.items()))
+            if key == keep or (now - last_active <= self.ttl and self._bytes <= self.max_bytes):
+                break
+            del self._sessions[key]
+            self._bytes -= size
+
+    def history(self, kb_id: str, session_id: str, limit: int | None = None) -> list[dict]:
+        with self._lock:
+            self._evict(time.time())
+            session = self._sessions.get((kb_id, session_id))
+            messages = list(session[0]) if session else []
+        if limit is not None:
+            messages = messages[len(messages) - limit:] if limit < len(messages) else messages
+        return [{"role": role, "content": content, "timestamp": timestamp} for role, content, timestamp in messages]
+
+    def append(self, kb_id: str, session_id: str, messages: list[dict]):
+        now = time.time()
+        key = (kb_id, session_id)
+        with self._lock:
+            self._evict(now)
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._sessions[key] = [deque(maxlen=self.max_messages), now, 0]
+            buffer = session[0]
+            for message in messages:
+                if len(buffer) == buffer.maxlen:
+                    freed = len(buffer[0][1]) + _MESSAGE_OVERHEAD
+                    session[2] -= freed
+                    self._bytes -= freed
+                buffer.append((message["role"], message["content"], message.get("timestamp", now)))
+                added = len(message["content"]) + _MESSAGE_OVERHEAD
+                session[2] += added
+                self._bytes += added
+            session[1] = now
+            self._sessions.move_to_end(key)
+            self._evict(now, keep=key)
+
+    def clear(self, kb_id: str, session_id: str | None = None):
+        with self._lock:
+            keys = [(kb_id, session_id)] if session_id is not None else [key for key in self._sessions if key[0] == kb_id]
+            for key in keys:
+                if key in self._sessions:
+                    self._bytes -= self._sessions.pop(key)[2]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"sessions": len(self._sessions), "bytes": self._bytes}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    kb_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    last_active REAL NOT NULL,
+    PRIMARY KEY (kb_id, session_id)
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_last_active ON sessions (last_active);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kb_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (kb_id, session_id, id);
+"""
+
+# Seconds between sweeps of expired sessions out of the SQLite store
+_SWEEP_INTERVAL = 60.0
+
+class SqliteConversationStore(ConversationStore):
+    def __init__(self, path: str, max_messages: int, ttl: float):
+        self.max_messages = max_messages
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = connect(path)
+        self._conn.executescript(_SCHEMA)
+        self._swept_at = 0.0
+
+    def _sweep(self, now: float):
+        if now - self._swept_at < _SWEEP_INTERVAL:
+            return
+        self._swept_at = now
+        cutoff = now - self.ttl
+        with self._conn:
+            self._conn.execute(
+                "DELETE FROM messages WHERE (kb_id, session_id) IN (SELECT kb_id, session_id FROM sessions WHERE last_active < ?)", (cutoff,)
+            )
+            self._conn.execute("DELETE FROM sessions WHERE last_active < ?", (cutoff,))
+
+    def history(self, kb_id: str, session_id: str, limit: int | None = None) -> list[dict]:
+        limit = self.max_messages if limit is None else min(limit, self.max_messages)
+        with self._lock:
+            row = self._conn.execute("SELECT last_active FROM sessions WHERE kb_id = ? AND session_id = ?", (kb_id, session_id)).fetchone()
+            if row is None or time.time() - row["last_active"] > self.ttl or limit <= 0:
+                return []
+            rows = self._conn.execute(
+                "SELECT role, content, created_at FROM messages WHERE kb_id = ? AND session_id = ? ORDER BY id DESC LIMIT ?",
+                (kb_id, session_id, limit),
+            ).fetchall()
+        return [{"role": r["role"], "content": r["content"], "timestamp": r["created_at"]} for r in reversed(rows)]
+
+    def append(self, kb_id: str, session_id: str, messages: list[dict]):
+        now = time.time()
+        with self._lock:
+            self._sweep(now)
+            with self._conn:
+                row = self._conn.execute("SELECT last_active FROM sessions WHERE kb_id = ? AND session_id = ?", (kb_id, session_id)).fetchone()
+                if row is not None and now - row["last_active"] > self.ttl:
+                    # Expired but not swept yet: start over
+                    self._conn.execute("DELETE FROM messages WHERE kb_id = ? AND session_id = ?", (kb_id, session_id))
+                self._conn.execute(
+                    "INSERT INTO sessions (kb_id, session_id, last_active) VALUES (?, ?, ?) "
+                    "ON CONFLICT (kb_id, session_id) DO UPDATE SET last_active = excluded.last_active",
+                    (kb_id, session_id, now),
+                )
+                self._conn.executemany(
+                    "INSERT INTO messages (kb_id, session_id, role, content, created_at) VALUES (?, ?, ?, ?, ?)",
+                    [(kb_id, session_id, m["role"], m["content"], m.get("timestamp", now)) for m in messages],
+                )
+                # Ring buffer: keep only the newest max_messages
+                self._conn.execute(
+                    """
+                    DELETE FROM messages WHERE kb_id = ? AND session_id = ? AND id <= (
+                        SELECT id FROM messages WHERE kb_id = ? AND session_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?
+                    )
+                    """,
+                    (kb_id, session_id, kb_id, session_id, self.max_messages),
+                )
+
+    def clear(self, kb_id: str, session_id: str | None = None):
+        where, params = ("kb_id = ? AND session_id = ?", (kb_id, session_id)) if session_id is not None else ("kb_id = ?", (kb_id,))
+        with self._lock:
+            with self._conn:
+                self._conn.execute(f"DELETE FROM messages WHERE {where}", params)
+                self._conn.execute(f"DELETE FROM sessions WHERE {where}", params)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class RedisConversationStore(ConversationStore):
+    def __init__(self, url: str, max_messages: int, ttl: float):
+        if redis is None:
+            raise RuntimeError('CONVERSATION_STORE=redis needs the redis package (pip install -e ".[redis]")')
+        self.max_messages = max_messages
+        self.ttl = max(int(ttl), 1)
+        self._client = redis.Redis.from_url(url)
+
+    # IDs are percent-encoded so a ':' (or a glob character) in one can never make two keys collide
+    @staticmethod
+    def _key(kb_id: str, session_id: str) -> str:
+        return f"conversation:{quote(kb_id, safe='')}:{quote(session_id, safe='')}"
+
+    @staticmethod
+    def _sessions_key(kb_id: str) -> str:
+        # Set of the session keys of a KB, so clearing a KB never has to pattern-match the keyspace
+        return f"conversation-sessions:{quote(kb_id, safe='')}"
+
+    def history(self, kb_id: str, session_id: str, limit: int | None = None) -> list[dict]:
+        limit = self.max_messages if limit is None else min(limit, self.max_messages)
+        if limit <= 0:
+            return []
+        messages = [json.loads(item) for item in self._client.lrange(self._key(kb_id, session_id), -limit, -1)]
+        return [{"role": role, "content": content, "timestamp": timestamp} for role, content, timestamp in messages]
+
+    def append(self, kb_id: str, session_id: str, messages: list[dict]):
+        now = time.time()
+        key = self._key(kb_id, session_id)
+        pipe = self._client.pipeline()
+        pipe.rpush(key, *[json.dumps([m["role"], m["content"], m.get("timestamp", now)]) for m in messages])
+        pipe.ltrim(key, -self.max_messages, -1)
+        pipe.expire(key, self.ttl)
+        # The set outlives every session it lists; members whose session expired are harmless
+        pipe.sadd(self._sessions_key(kb_id), key)
+        pipe.expire(self._sessions_key(kb_id), self.ttl)
+        pipe.execute()
+
+    def clear(self, kb_id: str, session_id: str | None = None):
+        if session_id is not None:
+            key = self._key(kb_id, session_id)
+            pipe = self._client.pipeline()
+            pipe.delete(key)
+            pipe.srem(self._sessions_key(kb_id), key)
+            pipe.execute()
+            return
+        keys = list(self._client.smembers(self._sessions_key(kb_id)))
+        self._client.delete(self._sessions_key(kb_id), *keys)
+
+    def close(self):
+        self._client.close()
+
+def create_conversation_store() -> ConversationStore:
+    """
+    Build the backend selected by settings.CONVERSATION_STORE.
+    """
+    backend = settings.CONVERSATION_STORE
+    if backend == "memory":
+        return MemoryConversationStore(settings.CONVERSATION_MAX_MESSAGES, settings.CONVERSATION_TTL, settings.CONVERSATION_MAX_MB * 2**20)
+    if backend == "sqlite":
+        return SqliteConversationStore(
+            settings.CONVERSATION_DB_PATH or default_path("conversations.sqlite3"), settings.CONVERSATION_MAX_MESSAGES, settings.CONVERSATION_TTL
+        )
+    if backend == "redis":
+        return RedisConversationStore(settings.CONVERSATION_REDIS_URL, settings.CONVERSATION_MAX_MESSAGES, settings.CONVERSATION_TTL)
+    raise ValueError(f"Unknown conversation store '{backend}' (expected 'memory', 'sqlite' or 'redis')")
+
+_store = None
+
+def get_conversation_store() -> ConversationStore:
+    global _store
+    if _store is None:
+        _store = create_conversation_store()
+    return _store
+
+def close_conversation_store():
+    global _store
+    if _store is not None:
+        _store.close()
+        _store = None
+
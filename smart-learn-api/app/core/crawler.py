@@ -0,0 +1,207 @@
+"""
+Concurrent, polite fetching of many web pages for bulk URL ingestion.
+
+A crawl starts from a URL list, a sitemap (or sitemap index) and/or a seed URL; only the seed's
+links are followed, up to max_depth hops. Pages are fetched through ingestion.fetch_web_page with at most
+CRAWL_CONCURRENCY requests in flight, at most CRAWL_PER_HOST of them to the same host, and
+CRAWL_HOST_DELAY seconds between the starts of requests to one host.
+
+The ETag / Last-Modified of every stored page is kept in SQLite per KB, so a re-crawl sends
+conditional requests and unchanged pages cost a 304 instead of a download and a parse (pages whose
+links are still to be followed are always downloaded).
+"""
+import time
+import asyncio
+import threading
+import xml.etree.ElementTree as ET
+from typing import AsyncIterator, NamedTuple
+from urllib.parse import urlsplit, urldefrag
+from app.config import settings
+from app.core.http_clients import get_web_client
+from app.core.ingestion import fetch_web_page
+from app.utils.sqlite import connect, default_path
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS crawled_pages (
+    kb_id TEXT NOT NULL,
+    url TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    content_hash TEXT,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (kb_id, url)
+);
+"""
+
+# Links to these are never followed: they are not HTML pages
+_SKIP_EXTENSIONS = (
+    ".pdf", ".zip", ".gz", ".tar", ".png", ".jpg", ".jpeg", ".gif", ".svg", ".webp", ".ico",
+    ".css", ".js", ".json", ".xml", ".mp3", ".mp4", ".webm", ".woff", ".woff2",
+)
+
+_lock = threading.Lock()
+_conn = None
+
+def _get_conn():
+    global _conn
+    if _conn is None:
+        _conn = connect(settings.CRAWL_DB_PATH or default_path("crawl.sqlite3"))
+        _conn.executescript(_SCHEMA)
+    return _conn
+
+def get_validators(kb_id: str) -> dict[str, dict]:
+    """
+    {url: {"etag", "last_modified", "content_hash"}} of the pages previously crawled into a KB.
+    """
+    with _lock:
+        rows = _get_conn().execute(
+            "SELECT url, etag, last_modified, content_hash FROM crawled_pages WHERE kb_id = ?", (kb_id,)
+        ).fetchall()
+    return {row["url"]: {"etag": row["etag"], "last_modified": row["last_modified"], "content_hash": row["content_hash"]} for row in rows}
+
+def record_page(kb_id: str, url: str, etag: str | None, last_modified: str | None, content_hash: str | None):
+    with _lock:
+        conn = _get_conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO crawled_pages (kb_id, url, etag, last_modified, content_hash, fetched_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (kb_id, url, etag, last_modified, content_hash, time.time()),
+            )
+
+def drop_knowledge_base(kb_id: str):
+    with _lock:
+        conn = _get_conn()
+        with conn:
+            conn.execute("DELETE FROM crawled_pages WHERE kb_id = ?", (kb_id,))
+
+def normalize_url(url: str) -> str:
+    return urldefrag(url.strip()).url
+
+def _host(url: str) -> str:
+    return urlsplit(url).netloc.lower()
+
+def parse_sitemap(xml: str) -> tuple[list[str], list[str]]:
+    """
+    (page URLs, nested sitemap URLs) listed in a sitemap or sitemap index.
+    """
+    root = ET.fromstring(xml)
+    pages, sitemaps = [], []
+    for element in root.iter():
+        if element.tag.rsplit("}", 1)[-1] != "loc" or not (element.text or "").strip():
+            continue
+        target = sitemaps if root.tag.rsplit("}", 1)[-1] == "sitemapindex" else pages
+        target.append(normalize_url(element.text))
+    return pages, sitemaps
+
+async def fetch_sitemap(url: str, max_urls: int, depth: int = 2) -> list[str]:
+    """
+    Page URLs of a sitemap, following nested sitemap indexes up to `depth` levels.
+    """
+    response = await get_web_client().get(url)
+    response.raise_for_status()
+    pages, nested = parse_sitemap(response.text)
+    for sitemap in nested:
+        if len(pages) >= max_urls or depth <= 0:
+            break
+        pages.extend(await fetch_sitemap(sitemap, max_urls - len(pages), depth - 1))
+    return pages[:max_urls]
+
+class CrawledPage(NamedTuple):
+    url: str
+    text: str | None = None  # None when not modified (304) or failed
+    etag: str | None = None
+    last_modified: str | None = None
+    not_modified: bool = False
+    error: str | None = None
+
+class _HostLimiter:
+    """
+    Per-host politeness: at most `concurrency` requests in flight and `delay` seconds between request starts.
+    """
+    def __init__(self, concurrency: int, delay: float):
+        self.semaphore = asyncio.Semaphore(max(1, concurrency))
+        self.delay = delay
+        self.next_start = 0.0
+        self.lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        await self.semaphore.acquire()
+        async with self.lock:
+            now = time.monotonic()
+            wait = self.next_start - now
+            self.next_start = max(now, self.next_start) + self.delay
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def __aexit__(self, *exc):
+        self.semaphore.release()
+
+class Crawler:
+    """
+    Fetch the pages of a crawl concurrently; iterate over crawl() to receive them as they arrive.
+    The listed urls are fetched as they are; links are only followed from the seed, up to max_depth hops.
+    With validators ({url: {"etag", "last_modified"}}) requests for known pages are conditional.
+    """
+    def __init__(self, urls: list[str], max_pages: int, max_depth: int = 0, same_domain: bool = True,
+                 validators: dict[str, dict] | None = None, seed: str | None = None):
+        self.seed = normalize_url(seed) if seed else None
+        self.start_urls = [normalize_url(url) for url in urls]
+        self.max_pages = max_pages
+        self.max_depth = max_depth
+        self.allowed_hosts = {_host(url) for url in self.start_urls + [self.seed] if url} if same_domain else None
+        self.validators = validators or {}
+        self.discovered = 0
+        self._seen = set()
+        self._hosts = {}  # {host: _HostLimiter}
+        self._global = asyncio.Semaphore(max(1, settings.CRAWL_CONCURRENCY))
+
+    def _admit(self, url: str) -> bool:
+        if url in self._seen or self.discovered >= self.max_pages:
+            return False
+        if self.allowed_hosts is not None and _host(url) not in self.allowed_hosts:
+            return False
+        if urlsplit(url).path.lower().endswith(_SKIP_EXTENSIONS):
+            return False
+        self._seen.add(url)
+        self.discovered += 1
+        return True
+
+    async def _fetch(self, url: str, depth: int) -> tuple[CrawledPage, list[str]]:
+        host = _host(url)
+        limiter = self._hosts.setdefault(host, _HostLimiter(settings.CRAWL_PER_HOST, settings.CRAWL_HOST_DELAY))
+        follow = depth < self.max_depth
+        # Pages whose links are followed are always downloaded: a 304 carries no links
+        known = {} if follow else self.validators.get(url) or {}
+        async with self._global, limiter:
+            try:
+                page = await fetch_web_page(url, known.get("etag"), known.get("last_modified"), links=follow)
+            except Exception as e:
+                return CrawledPage(url, error=str(getattr(e, "detail", None) or e)), []
+        if page.text is None:
+            return CrawledPage(url, etag=page.etag, last_modified=page.last_modified, not_modified=True), []
+        return CrawledPage(url, page.text, page.etag, page.last_modified), page.links
+
+    async def crawl(self) -> AsyncIterator[CrawledPage]:
+        tasks = {}  # {task: depth}
+
+        def schedule(url: str, depth: int):
+            if self._admit(url):
+                tasks[asyncio.create_task(self._fetch(url, depth))] = depth
+
+        if self.seed:
+            schedule(self.seed, 0)
+        for url in self.start_urls:
+            # Listed pages start at the depth limit, so their links are not followed
+            schedule(url, self.max_depth)
+        try:
+            while tasks:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    depth = tasks.pop(task)
+                    page, links = task.result()
+                    for link in links:
+                        schedule(normalize_url(link), depth + 1)
+                    yield page
+        finally:
+            for task in tasks:
+                task.cancel()
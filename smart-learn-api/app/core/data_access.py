@@ -0,0 +1,204 @@
+"""
+Async data-access layer over app.core.database.
+
+ChromaDB, the local vector store and the SQLite indexes are synchronous, so calling them from
+request handlers blocks the event loop: one large add_documents stalls every concurrent query.
+Here every store operation runs in a dedicated pool of STORE_WORKERS threads, and is coordinated
+per KB with a fair read/write lock:
+- reads (queries, listings) of a KB run concurrently with each other
+- writes of a KB are exclusive, and at most STORE_WRITE_CONCURRENCY run at once across all KBs,
+  so ingestion can never occupy every thread and queries always find one free
+- waiters are served in arrival order, so a stream of ingestion batches cannot starve queries
+  (each batch is one short write, and queued reads run between batches) and vice versa
+"""
+import asyncio
+import functools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from app.config import settings
+from app.core import database
+from app.core.conversations import get_conversation_store
+from app.core.prompts import get_compiled_prompt as _get_compiled_prompt
+
+class ReadWriteLock:
+    """
+    Fair asyncio read/write lock: readers share it, a writer holds it alone, and waiters are admitted in
+    arrival order (consecutive readers together).
+    """
+
+    def __init__(self):
+        self._readers = 0
+        self._writing = False
+        self._waiters = deque()  # [(future, is_writer)]
+
+    def _admit(self):
+        while self._waiters and not self._writing:
+            future, is_writer = self._waiters[0]
+            if future.done():  # cancelled while waiting
+                self._waiters.popleft()
+                continue
+            if is_writer:
+                if self._readers:
+                    return
+                self._writing = True
+            else:
+                self._readers += 1
+            self._waiters.popleft()
+            future.set_result(None)
+            if is_writer:
+                return
+
+    async def acquire(self, write: bool):
+        if not self._waiters and not self._writing and not (write and self._readers):
+            if write:
+                self._writing = True
+            else:
+                self._readers += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((future, write))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Admitted just as we were cancelled: hand the lock on
+                self.release(write)
+            else:
+                self._admit()
+            raise
+
+    def release(self, write: bool):
+        if write:
+            self._writing = False
+        else:
+            self._readers -= 1
+        self._admit()
+
+    @property
+    def idle(self) -> bool:
+        return not self._readers and not self._writing and not self._waiters
+
+class _LoopState:
+    def __init__(self):
+        self.locks = {}  # {kb_id: ReadWriteLock}
+        self.writes = asyncio.Semaphore(max(1, settings.STORE_WRITE_CONCURRENCY))
+
+_pool = None
+_state = {}  # {event loop: _LoopState}; asyncio primitives belong to the loop that created them
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=settings.STORE_WORKERS, thread_name_prefix="store")
+    return _pool
+
+def _loop_state() -> _LoopState:
+    loop = asyncio.get_running_loop()
+    if loop not in _state:
+        # Forget the state of loops that have been closed (tests, CLI runs)
+        for stale in [other for other in _state if other.is_closed()]:
+            del _state[stale]
+        _state[loop] = _LoopState()
+    return _state[loop]
+
+async def _run(func, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(_get_pool(), functools.partial(func, *args, **kwargs))
+
+async def read(kb_id: str, func, *args, **kwargs):
+    """
+    Run a store read of a KB in the store pool, concurrently with other reads of the KB.
+    """
+    state = _loop_state()
+    lock = state.locks.setdefault(kb_id, ReadWriteLock())
+    await lock.acquire(write=False)
+    try:
+        return await _run(func, *args, **kwargs)
+    finally:
+        lock.release(write=False)
+        if lock.idle:
+            state.locks.pop(kb_id, None)
+
+async def write(kb_id: str, func, *args, **kwargs):
+    """
+    Run a store write of a KB in the store pool, exclusively for the KB.
+    """
+    state = _loop_state()
+    # Take a write slot before the KB lock, so reads of the KB aren't held up while waiting for one
+    async with state.writes:
+        lock = state.locks.setdefault(kb_id, ReadWriteLock())
+        await lock.acquire(write=True)
+        try:
+            return await _run(func, *args, **kwargs)
+        finally:
+            lock.release(write=True)
+            if lock.idle:
+                state.locks.pop(kb_id, None)
+
+def shutdown_store_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+        _pool = None
+
+# Async counterparts of the database functions used by the API
+
+async def list_knowledge_bases() -> list[dict]:
+    return await _run(database.list_knowledge_bases)
+
+async def query_documents(kb_id: str, query_embedding: list[float], n_results: int = 5):
+    return await read(kb_id, database.query_documents, kb_id, query_embedding, n_results=n_results)
+
+async def search_lexical(kb_id: str, query: str, n_results: int = 5) -> dict:
+    return await read(kb_id, database.search_lexical, kb_id, query, n_results=n_results)
+
+async def list_documents(kb_id: str) -> list[str]:
+    return await read(kb_id, database.list_documents, kb_id)
+
+async def list_document_records(kb_id: str) -> list[dict]:
+    return await read(kb_id, database.list_document_records, kb_id)
+
+async def get_document_chunks(kb_id: str, source: str) -> list[dict]:
+    return await read(kb_id, database.get_document_chunks, kb_id, source)
+
+async def get_compiled_prompt(kb_id: str):
+    return await read(kb_id, _get_compiled_prompt, kb_id)
+
+async def add_documents(kb_id: str, ids: list[str], documents: list[str], embeddings: list[list[float]], metadatas: list[dict]):
+    # Short writes let queued reads of the KB run in between
+    step = max(1, settings.STORE_WRITE_BATCH)
+    for start in range(0, len(ids), step):
+        stop = start + step
+        await write(kb_id, database.add_documents, kb_id, ids=ids[start:stop], documents=documents[start:stop],
+                    embeddings=embeddings[start:stop], metadatas=metadatas[start:stop])
+
+async def replace_document(kb_id: str, source: str, **kwargs):
+    return await write(kb_id, database.replace_document, kb_id, source, **kwargs)
+
+async def delete_document(kb_id: str, filename: str):
+    return await write(kb_id, database.delete_document, kb_id, filename)
+
+async def delete_knowledge_base(kb_id: str):
+    return await write(kb_id, database.delete_knowledge_base, kb_id)
+
+async def set_kb_metadata(kb_id: str, name: str, **kwargs):
+    return await write(kb_id, database.set_kb_metadata, kb_id, name, **kwargs)
+
+async def get_collection(kb_id: str):
+    return await write(kb_id, database.get_collection, kb_id)
+
+# Conversation history; the in-memory backend is called inline, sqlite/redis in the store pool
+
+async def _conversations(method: str, *args, **kwargs):
+    store = get_conversation_store()
+    if not store.blocking:
+        return getattr(store, method)(*args, **kwargs)
+    return await _run(getattr(store, method), *args, **kwargs)
+
+async def get_conversation_history(kb_id: str, session_id: str, limit: int | None = None) -> list[dict]:
+    return await _conversations("history", kb_id, session_id, limit=limit)
+
+async def append_conversation(kb_id: str, session_id: str, messages: list[dict]):
+    await _conversations("append", kb_id, session_id, messages)
+
+async def clear_conversations(kb_id: str, session_id: str | None = None):
+    await _conversations("clear", kb_id, session_id)
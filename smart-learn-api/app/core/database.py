@@ -1,9 +1,23 @@
 import json
+import time
 import chromadb
 from chromadb.config import Settings as ChromaSettings
+from chromadb.errors import NotFoundError
 from app.config import settings
+from app.core import registry, lexical, api_keys, crawler
+from app.core.answer_cache import get_answer_cache
+from app.core.metrics import CACHE_REQUESTS
+from app.core.vector_store import VectorStore, create_vector_store
+from app.utils.hashing import text_hash
 
+# KB metadata always lives on the ChromaDB collection; chunks go to the configured vector store
 client = chromadb.PersistentClient(path=settings.CHROMA_DB_PATH)
+_store = None
+
+# Per-KB profile cache: {kb_id: {"metadata": {...}, "chunk_count": int, "documents": [...], "cached_at": float}}
+_kb_profiles = {}
+# Bumped on every write to a KB so a profile read concurrently with a write is never cached
+_kb_generations = {}
 
 def list_knowledge_bases() -> list[dict]:
     """
@@ -11,10 +25,14 @@ def list_knowledge_bases() -> list[dict]:
     """
     try:
         collections = client.list_collections()
+        counts = registry.document_counts()
         kbs = []
         for col in collections:
             if col.name.startswith("kb_"):
                 kb_id = col.name[3:]
+                if not registry.is_indexed(kb_id):
+                    rebuild_document_registry(kb_id)
+                    counts = registry.document_counts()
                 metadata = col.metadata or {}
                 # Robust boolean casting for the custom_instruction flag
                 raw_custom = metadata.get("custom_instruction", False)
@@ -27,7 +45,7 @@ def list_knowledge_bases() -> list[dict]:
                     "instruction": metadata.get("instruction", ""),
                     "custom_instruction": custom_instruction,
                     "conversation_types": _parse_conversation_types(metadata.get("conversation_types")),
-                    "document_count": len(list_documents(kb_id)),
+                    "document_count": counts.get(kb_id, 0),
                 })
         return kbs
     except Exception as e:
@@ -35,6 +53,27 @@ def list_knowledge_bases() -> list[dict]:
         return []
 
 
+def list_kb_ids() -> list[str]:
+    """
+    List the IDs of all knowledge bases without touching their metadata or documents.
+    """
+    return [col.name[3:] for col in client.list_collections() if col.name.startswith("kb_")]
+
+def get_vector_store() -> VectorStore:
+    """
+    Get the chunk store selected by settings.VECTOR_STORE.
+    """
+    global _store
+    if _store is None:
+        _store = create_vector_store(client)
+    return _store
+
+def close_vector_store():
+    global _store
+    if _store is not None:
+        _store.close()
+        _store = None
+
 def get_collection(kb_id: str):
     """
     Get or create a ChromaDB collection for a specific knowledge base.
@@ -43,68 +82,162 @@ def get_collection(kb_id: str):
 
 def add_documents(kb_id: str, ids: list[str], documents: list[str], embeddings: list[list[float]], metadatas: list[dict]):
     """
-    Add documents and their embeddings to a specific KB.
+    Add documents and their embeddings to a specific KB. Chunks with an already stored ID replace it.
     """
-    collection = get_collection(kb_id)
-    collection.add(
-        ids=ids,
-        documents=documents,
-        embeddings=embeddings,
-        metadatas=metadatas
-    )
+    get_collection(kb_id)
+    store = get_vector_store()
+    existing = set(store.get(kb_id, ids=ids, include=()).get("ids") or [])
+    store.add(kb_id, ids=ids, documents=documents, embeddings=embeddings, metadatas=metadatas)
+    # Replaced chunks are already accounted to their document
+    added = [(doc, meta) for chunk_id, doc, meta in zip(ids, documents, metadatas) if chunk_id not in existing]
+    registry.record_chunks(kb_id, [doc for doc, _ in added], [meta for _, meta in added])
+    if lexical.is_indexed(kb_id):
+        lexical.index_chunks(kb_id, ids, documents, metadatas)
+    else:
+        rebuild_lexical_index(kb_id)
+    invalidate_kb_profile(kb_id)
 
 def query_documents(kb_id: str, query_embedding: list[float], n_results: int = 5):
     """
     Query a specific KB for similar documents.
     """
-    collection = get_collection(kb_id)
-    results = collection.query(
-        query_embeddings=[query_embedding],
-        n_results=n_results
-    )
-    return results
+    return get_vector_store().query(kb_id, query_embedding, n_results=n_results)
+
+def search_lexical(kb_id: str, query: str, n_results: int = 5) -> dict:
+    """
+    Query a specific KB with BM25 over the chunk text. Same result shape as query_documents.
+    """
+    if not lexical.is_indexed(kb_id):
+        rebuild_lexical_index(kb_id)
+    ranking = lexical.search(kb_id, query, n_results)
+    if not ranking:
+        return {"ids": [[]], "documents": [[]], "metadatas": [[]], "scores": [[]]}
+    stored = get_vector_store().get(kb_id, ids=[chunk_id for chunk_id, _ in ranking], include=("documents", "metadatas"))
+    by_id = {chunk_id: (doc, meta) for chunk_id, doc, meta in zip(stored["ids"], stored["documents"], stored["metadatas"])}
+    hits = [(chunk_id, score) for chunk_id, score in ranking if chunk_id in by_id]
+    return {
+        "ids": [[chunk_id for chunk_id, _ in hits]],
+        "documents": [[by_id[chunk_id][0] for chunk_id, _ in hits]],
+        "metadatas": [[by_id[chunk_id][1] for chunk_id, _ in hits]],
+        "scores": [[score for _, score in hits]],
+    }
 
 def list_documents(kb_id: str) -> list[str]:
     """
     List all unique documents (filenames) in a specific KB.
     """
-    collection = get_collection(kb_id)
-    result = collection.get(include=["metadatas"])
-    metadatas = result.get("metadatas", [])
-    if not metadatas:
-        return []
-    
-    filenames = set()
-    for meta in metadatas:
-        if meta and "source" in meta:
-            filenames.add(meta["source"])
-            
-    return list(filenames)
+    if not registry.is_indexed(kb_id):
+        rebuild_document_registry(kb_id)
+    return registry.list_sources(kb_id)
+
+def list_document_records(kb_id: str) -> list[dict]:
+    """
+    List the registry records (source, chunk_count, byte_size, content_hash, ingested_at) of a KB.
+    """
+    if not registry.is_indexed(kb_id):
+        rebuild_document_registry(kb_id)
+    return registry.list_records(kb_id)
+
+def rebuild_document_registry(kb_id: str, page_size: int = 5000) -> int:
+    """
+    Rebuild the document registry of a KB by scanning its chunks page by page.
+    Only needed once for stores created before the registry existed.
+    """
+    store = get_vector_store()
+    documents, metadatas = [], []
+    offset = 0
+    while True:
+        page = store.get(kb_id, include=("documents", "metadatas"), limit=page_size, offset=offset)
+        page_ids = page.get("ids") or []
+        if not page_ids:
+            break
+        documents.extend(page.get("documents") or [""] * len(page_ids))
+        metadatas.extend(page.get("metadatas") or [{}] * len(page_ids))
+        offset += len(page_ids)
+    registry.replace_knowledge_base(kb_id, documents, metadatas)
+    return len(registry.list_sources(kb_id))
+
+def rebuild_lexical_index(kb_id: str, page_size: int = 5000) -> int:
+    """
+    Rebuild the BM25 index of a KB from its stored chunks, page by page.
+    Only needed once for stores created before the index existed.
+    """
+    store = get_vector_store()
+
+    def pages():
+        offset = 0
+        while True:
+            page = store.get(kb_id, include=("documents", "metadatas"), limit=page_size, offset=offset)
+            page_ids = page.get("ids") or []
+            if not page_ids:
+                return
+            yield page_ids, page.get("documents") or [""] * len(page_ids), page.get("metadatas") or [{}] * len(page_ids)
+            offset += len(page_ids)
+
+    lexical.replace_knowledge_base(kb_id, pages())
+    return store.count(kb_id)
+
+def get_document_chunks(kb_id: str, source: str) -> list[dict]:
+    """
+    List the stored chunks of a document as {"id", "chunk_hash"}.
+    Chunks stored before chunk hashes were recorded are hashed from their text.
+    """
+    store = get_vector_store()
+    result = store.get(kb_id, source=source, include=("metadatas",))
+    ids = result.get("ids") or []
+    metadatas = result.get("metadatas") or [{}] * len(ids)
+    if all((meta or {}).get("chunk_hash") for meta in metadatas):
+        return [{"id": chunk_id, "chunk_hash": meta["chunk_hash"]} for chunk_id, meta in zip(ids, metadatas)]
+
+    result = store.get(kb_id, source=source, include=("documents",))
+    return [{"id": chunk_id, "chunk_hash": text_hash(doc or "")} for chunk_id, doc in zip(result.get("ids") or [], result.get("documents") or [])]
+
+def replace_document(kb_id: str, source: str, retained_ids: list[str], retained_metadatas: list[dict], stale_ids: list[str],
+                     chunk_count: int, byte_size: int, content_hash: str | None = None):
+    """
+    Finish swapping a document to a new version whose new chunks were already added with add_documents.
+    Retained chunks are re-indexed and stale chunks of the previous version deleted last,
+    so queries keep seeing a complete version of the document throughout the update.
+    """
+    store = get_vector_store()
+    if retained_ids:
+        store.update_metadatas(kb_id, retained_ids, retained_metadatas)
+    if stale_ids:
+        store.delete(kb_id, ids=stale_ids)
+        lexical.remove_chunks(kb_id, stale_ids)
+
+    registry.set_document(kb_id, source, chunk_count=chunk_count, byte_size=byte_size, content_hash=content_hash)
+    invalidate_kb_profile(kb_id)
 
 def has_documents(kb_id: str) -> bool:
     """
     Check if a specific KB has any documents.
     """
-    collection = get_collection(kb_id)
-    return collection.count() > 0
+    return get_vector_store().count(kb_id) > 0
 
 def delete_document(kb_id: str, filename: str):
     """
     Delete all chunks associated with a specific filename in a KB.
     """
-    collection = get_collection(kb_id)
-    collection.delete(
-        where={"source": filename}
-    )
+    get_vector_store().delete(kb_id, source=filename)
+    registry.remove_document(kb_id, filename)
+    lexical.remove_source(kb_id, filename)
+    invalidate_kb_profile(kb_id)
 
 def delete_knowledge_base(kb_id: str):
     """
     Delete an entire knowledge base (collection).
     """
+    get_vector_store().drop(kb_id)
     try:
         client.delete_collection(name=f"kb_{kb_id}")
-    except ValueError:
-        pass  # Collection doesn't exist
+    except (NotFoundError, ValueError):
+        pass  # Collection doesn't exist (or was dropped with the chunks); chromadb < 0.6 raises ValueError
+    registry.drop_knowledge_base(kb_id)
+    lexical.drop_knowledge_base(kb_id)
+    api_keys.drop_knowledge_base(kb_id)
+    crawler.drop_knowledge_base(kb_id)
+    invalidate_kb_profile(kb_id)
 
 def _parse_conversation_types(raw) -> list:
     if isinstance(raw, list):
@@ -135,6 +268,7 @@ def set_kb_metadata(kb_id: str, name: str, assistant_name: str = None, instructi
         metadata["conversation_types"] = json.dumps(conversation_types) if conversation_types else "[]"
     
     collection.modify(metadata=metadata)
+    invalidate_kb_profile(kb_id)
 
 def get_kb_metadata(kb_id: str) -> dict:
     """
@@ -145,40 +279,70 @@ def get_kb_metadata(kb_id: str) -> dict:
     meta["conversation_types"] = _parse_conversation_types(meta.get("conversation_types"))
     return meta
 
-# API Key Management
-def get_api_key_collection():
+def get_kb_profile(kb_id: str) -> dict:
+    """
+    Get the cached profile of a knowledge base: metadata, chunk count and distinct document list.
+    The profile is rebuilt from ChromaDB only after the KB changes or the entry expires.
+    """
+    profile = _kb_profiles.get(kb_id)
+    if profile and time.time() - profile["cached_at"] < settings.KB_PROFILE_TTL:
+        CACHE_REQUESTS.inc(cache="kb_profile", result="hit")
+        return profile
+    CACHE_REQUESTS.inc(cache="kb_profile", result="miss")
+
+    generation = _kb_generations.get(kb_id, 0)
+    profile = {
+        "metadata": get_kb_metadata(kb_id),
+        "chunk_count": get_vector_store().count(kb_id),
+        "documents": list_documents(kb_id),
+        "cached_at": time.time(),
+    }
+    # Only cache if no write happened while the profile was being read
+    if _kb_generations.get(kb_id, 0) == generation:
+        _kb_profiles[kb_id] = profile
+    return profile
+
+def invalidate_kb_profile(kb_id: str):
     """
-    Get or create the API key mapping collection.
+    Drop the cached profile and cached answers of a knowledge base after its documents or metadata change.
     """
-    return client.get_or_create_collection(name="iot_api_keys")
+    _kb_generations[kb_id] = _kb_generations.get(kb_id, 0) + 1
+    _kb_profiles.pop(kb_id, None)
+    # Other workers drop their cached answers when they see the shared generation change
+    get_answer_cache().invalidate(kb_id, registry.bump_generation(kb_id))
+
+# API Key Management (hashed in-memory key table, see app.core.api_keys)
+LEGACY_API_KEY_COLLECTION = "iot_api_keys"
 
 def store_api_key_mapping(api_key: str, kb_id: str):
     """
     Store API key to KB ID mapping.
     """
-    collection = get_api_key_collection()
-    # Use upsert to handle both insert and update cases
-    collection.upsert(
-        ids=[api_key],
-        documents=[f"API key for KB {kb_id}"],
-        metadatas=[{"kb_id": kb_id}]
-    )
-    print(f"Stored API key mapping: {api_key} -> {kb_id}")
-
+    api_keys.set_key(api_key, kb_id)
 
 def get_kb_id_by_api_key(api_key: str) -> str | None:
     """
     Retrieve KB ID associated with an API key.
     """
-    collection = get_api_key_collection()
+    return api_keys.lookup(api_key)
+
+def migrate_api_keys() -> int:
+    """
+    Move mappings from the legacy iot_api_keys collection (raw keys as IDs) into the hashed key
+    store and drop the collection. Returns the number of keys migrated.
+    """
     try:
-        result = collection.get(ids=[api_key], include=["metadatas"])
-        print(f"API Key lookup for '{api_key}': {result}")
-        if result and result.get("metadatas") and len(result["metadatas"]) > 0:
-            kb_id = result["metadatas"][0].get("kb_id")
-            print(f"Found KB ID: {kb_id}")
-            return kb_id
-    except Exception as e:
-        print(f"Error retrieving KB ID for API key: {e}")
-    print(f"No KB ID found for API key: {api_key}")
-    return None
+        collection = client.get_collection(name=LEGACY_API_KEY_COLLECTION)
+    except Exception:
+        return 0  # Nothing to migrate
+    result = collection.get(include=["metadatas"])
+    mapping = {
+        api_keys.hash_key(api_key): metadata["kb_id"]
+        for api_key, metadata in zip(result["ids"], result["metadatas"])
+        if metadata and metadata.get("kb_id")
+    }
+    if mapping:
+        api_keys.set_key_hashes(mapping)
+    client.delete_collection(name=LEGACY_API_KEY_COLLECTION)
+    print(f"Migrated {len(mapping)} API key mapping(s) from {LEGACY_API_KEY_COLLECTION}")
+    return len(mapping)
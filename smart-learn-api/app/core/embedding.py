@@ -1,27 +1,179 @@
+import time
+import random
 import asyncio
+import openai
 from openai import AsyncOpenAI
 from app.config import settings
+from app.core.embedding_cache import get_cache
+from app.utils.tokens import estimate_tokens
 
 client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
 
+class EmbeddingBatcher:
+    """
+    Coalesce concurrent single-text embedding requests into batched API calls.
+
+    The first caller opens a window of EMBEDDING_BATCH_WAIT_MS; every request arriving inside
+    the window joins the same embeddings request. A full batch is sent immediately.
+    """
+
+    def __init__(self, max_batch_size: int, max_wait_ms: float):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._pending = []  # [(text, future, enqueued_at)]
+        self._timer = None
+        self._loop = None
+        self._tasks = set()
+        self.stats = {"requests": 0, "batches": 0, "queue_delay_total": 0.0, "queue_delay_max": 0.0}
+
+    async def submit(self, text: str) -> list[float]:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Pending futures belong to the previous loop (e.g. a restarted test client)
+            self._loop, self._pending, self._timer = loop, [], None
+
+        future = loop.create_future()
+        self._pending.append((text, future, time.perf_counter()))
+        self.stats["requests"] += 1
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            batch, self._pending = self._pending[:self.max_batch_size], self._pending[self.max_batch_size:]
+            task = self._loop.create_task(self._run(batch))
+            # Keep a reference so the task isn't garbage collected mid-flight
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list):
+        now = time.perf_counter()
+        for _, _, enqueued_at in batch:
+            delay = now - enqueued_at
+            self.stats["queue_delay_total"] += delay
+            self.stats["queue_delay_max"] = max(self.stats["queue_delay_max"], delay)
+        self.stats["batches"] += 1
+
+        try:
+            embeddings = await _embed_and_store([text for text, _, _ in batch])
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future, _), embedding in zip(batch, embeddings):
+            if not future.done():
+                future.set_result(embedding)
+
+    def snapshot(self) -> dict:
+        """
+        Counters for monitoring: average batch fill (0-1) and queue delay in seconds.
+        """
+        batches = self.stats["batches"] or 1
+        return {
+            "requests": self.stats["requests"],
+            "batches": self.stats["batches"],
+            "avg_batch_size": self.stats["requests"] / batches if self.stats["batches"] else 0.0,
+            "avg_batch_fill": self.stats["requests"] / (batches * self.max_batch_size) if self.stats["batches"] else 0.0,
+            "avg_queue_delay": self.stats["queue_delay_total"] / self.stats["requests"] if self.stats["requests"] else 0.0,
+            "max_queue_delay": self.stats["queue_delay_max"],
+        }
+
+batcher = EmbeddingBatcher(settings.EMBEDDING_BATCH_MAX_SIZE, settings.EMBEDDING_BATCH_WAIT_MS)
+
 async def get_embedding(text: str) -> list[float]:
     """
     Generate embedding for a single string.
+    Concurrent calls are micro-batched into one request unless EMBEDDING_BATCH_WAIT_MS is 0.
+    """
+    cache = get_cache()
+    if cache is not None:
+        cached = (await asyncio.to_thread(cache.get_many, settings.EMBEDDING_MODEL, [text]))[0]
+        if cached is not None:
+            return cached
+    if settings.EMBEDDING_BATCH_WAIT_MS <= 0:
+        return (await get_embeddings([text]))[0]
+    return await batcher.submit(text)
+
+# Errors worth retrying: throttling, network trouble and provider-side failures
+_RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError)
+
+def plan_batches(texts: list[str], max_items: int, max_tokens: int) -> list[tuple[int, int]]:
+    """
+    Split texts into contiguous [start, end) ranges that respect the per-request item and token limits.
+    A single text larger than max_tokens gets a batch of its own.
     """
-    text = text.replace("\n", " ")
-    response = await client.embeddings.create(
-        input=[text],
-        model=settings.EMBEDDING_MODEL
-    )
-    return response.data[0].embedding
+    batches = []
+    start, tokens = 0, 0
+    for i, text in enumerate(texts):
+        cost = estimate_tokens(text)
+        if i > start and (i - start >= max_items or tokens + cost > max_tokens):
+            batches.append((start, i))
+            start, tokens = i, 0
+        tokens += cost
+    if start < len(texts):
+        batches.append((start, len(texts)))
+    return batches
+
+async def _embed_batch(texts: list[str]) -> list[list[float]]:
+    for attempt in range(settings.EMBEDDING_MAX_RETRIES + 1):
+        try:
+            response = await client.embeddings.create(
+                input=texts,
+                model=settings.EMBEDDING_MODEL
+            )
+            return [data.embedding for data in sorted(response.data, key=lambda d: d.index)]
+        except _RETRYABLE_ERRORS as e:
+            if attempt == settings.EMBEDDING_MAX_RETRIES:
+                raise
+            backoff = settings.EMBEDDING_RETRY_BACKOFF * (2 ** attempt) * (1 + random.random())
+            print(f"Embedding batch of {len(texts)} failed ({e.__class__.__name__}), retrying in {backoff:.2f}s")
+            await asyncio.sleep(backoff)
 
 async def get_embeddings(texts: list[str]) -> list[list[float]]:
     """
     Generate embeddings for a list of strings.
+    Large inputs are split into batches within EMBEDDING_MAX_BATCH_ITEMS / EMBEDDING_MAX_BATCH_TOKENS,
+    up to EMBEDDING_CONCURRENCY batches run at once, and results keep the input order.
+    Texts already in the embedding cache (or repeated within the call) are not sent to the API;
+    the cache's SQLite lookups run in a worker thread, off the event loop.
     """
+    cache = get_cache()
+    if cache is None:
+        return await _embed_uncached(texts)
+
+    results = await asyncio.to_thread(cache.get_many, settings.EMBEDDING_MODEL, texts)
+    missing = list(dict.fromkeys(t for t, r in zip(texts, results) if r is None))
+    if missing:
+        fresh = dict(zip(missing, await _embed_and_store(missing)))
+        results = [r if r is not None else fresh[t] for t, r in zip(texts, results)]
+    return results
+
+async def _embed_and_store(texts: list[str]) -> list[list[float]]:
+    embeddings = await _embed_uncached(texts)
+    cache = get_cache()
+    if cache is not None:
+        await asyncio.to_thread(cache.put_many, settings.EMBEDDING_MODEL, texts, embeddings)
+    return embeddings
+
+async def _embed_uncached(texts: list[str]) -> list[list[float]]:
     processed_texts = [t.replace("\n", " ") for t in texts]
-    response = await client.embeddings.create(
-        input=processed_texts,
-        model=settings.EMBEDDING_MODEL
-    )
-    return [data.embedding for data in response.data]
+    batches = plan_batches(processed_texts, settings.EMBEDDING_MAX_BATCH_ITEMS, settings.EMBEDDING_MAX_BATCH_TOKENS)
+    if len(batches) <= 1:
+        return await _embed_batch(processed_texts) if processed_texts else []
+
+    semaphore = asyncio.Semaphore(settings.EMBEDDING_CONCURRENCY)
+
+    async def run(start: int, end: int) -> list[list[float]]:
+        async with semaphore:
+            return await _embed_batch(processed_texts[start:end])
+
+    results = await asyncio.gather(*(run(start, end) for start, end in batches))
+    return [embedding for batch in results for embedding in batch]
@@ -0,0 +1,149 @@
+"""
+Disk-backed, content-addressed embedding cache.
+
+Vectors are keyed by (EMBEDDING_MODEL, sha256 of the whitespace-normalized text) and stored as
+packed float32 in SQLite, so re-ingesting a document or the same URL into several KBs reuses
+existing embeddings instead of calling the API again. Least recently used entries are evicted
+once the stored vectors exceed EMBEDDING_CACHE_MAX_MB. Hits update recency in memory; it is written
+back at most every EMBEDDING_CACHE_TOUCH_SECONDS (and before an eviction), so lookups rarely write.
+"""
+import time
+import array
+import hashlib
+import threading
+from app.config import settings
+from app.utils.sqlite import connect, default_path
+from app.core.metrics import CACHE_REQUESTS
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    key TEXT PRIMARY KEY,
+    vector BLOB NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used);
+"""
+
+def cache_key(model: str, text: str) -> str:
+    normalized = " ".join(text.split())
+    return hashlib.sha256(f"{model}\0{normalized}".encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    def __init__(self, path: str, max_bytes: int, touch_interval: float = 60.0):
+        self.max_bytes = max_bytes
+        self.touch_interval = touch_interval
+        self._lock = threading.Lock()
+        self._touched = {}  # {key: last used} of hits not yet written back
+        self._last_touch_flush = time.monotonic()
+        self._conn = connect(path)
+        self._conn.executescript(_SCHEMA)
+        row = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()
+        self._entries, self._bytes = row[0], row[1]
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, model: str, texts: list[str]) -> list[list[float] | None]:
+        """
+        Look up cached vectors; None marks a miss.
+        """
+        keys = [cache_key(model, t) for t in texts]
+        found = {}
+        with self._lock:
+            unique = list(dict.fromkeys(keys))
+            # Stay well under SQLite's bound-parameter limit
+            for i in range(0, len(unique), 500):
+                part = unique[i:i + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", part).fetchall()
+                found.update((row[0], row[1]) for row in rows)
+            if found:
+                now = time.time()
+                self._touched.update((k, now) for k in found)
+                if time.monotonic() - self._last_touch_flush >= self.touch_interval:
+                    self._flush_touched()
+
+        results = []
+        for key in keys:
+            blob = found.get(key)
+            if blob is None:
+                results.append(None)
+            else:
+                results.append(array.array("f", blob).tolist())
+        hits = sum(1 for r in results if r is not None)
+        self.hits += hits
+        self.misses += len(results) - hits
+        CACHE_REQUESTS.inc(hits, cache="embedding", result="hit")
+        CACHE_REQUESTS.inc(len(results) - hits, cache="embedding", result="miss")
+        return results
+
+    def put_many(self, model: str, texts: list[str], vectors: list[list[float]]):
+        """
+        Store vectors as packed float32 and evict least recently used entries beyond the size bound.
+        """
+        now = time.time()
+        rows = {cache_key(model, t): array.array("f", v).tobytes() for t, v in zip(texts, vectors)}
+        with self._lock:
+            with self._conn:
+                for key, blob in rows.items():
+                    old = self._conn.execute("SELECT LENGTH(vector) FROM embeddings WHERE key = ?", (key,)).fetchone()
+                    if old is None:
+                        self._entries += 1
+                        self._bytes += len(blob)
+                    else:
+                        self._bytes += len(blob) - old[0]
+                    self._conn.execute("INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", (key, blob, now))
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _flush_touched(self):
+        # Write the recency of hits since the last flush in one transaction
+        if self._touched:
+            with self._conn:
+                self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(t, k) for k, t in self._touched.items()])
+            self._touched.clear()
+        self._last_touch_flush = time.monotonic()
+
+    def _evict(self):
+        self._flush_touched()
+        # Trim to 90% of the bound so eviction doesn't run on every insert
+        target = int(self.max_bytes * 0.9)
+        with self._conn:
+            while self._bytes > target and self._entries > 0:
+                rows = self._conn.execute("SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_used LIMIT 500").fetchall()
+                if not rows:
+                    break
+                victims = []
+                for key, size in rows:
+                    if self._bytes <= target:
+                        break
+                    victims.append((key,))
+                    self._bytes -= size
+                    self._entries -= 1
+                self._conn.executemany("DELETE FROM embeddings WHERE key = ?", victims)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": self._entries,
+            "bytes": self._bytes,
+        }
+
+_cache = None
+
+def get_cache() -> EmbeddingCache | None:
+    """
+    Get the process-wide embedding cache, or None when EMBEDDING_CACHE_ENABLED is off.
+    """
+    global _cache
+    if not settings.EMBEDDING_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        _cache = EmbeddingCache(
+            settings.EMBEDDING_CACHE_PATH or default_path("embedding_cache.sqlite3"),
+            settings.EMBEDDING_CACHE_MAX_MB * 1024 * 1024,
+            settings.EMBEDDING_CACHE_TOUCH_SECONDS,
+        )
+    return _cache
@@ -0,0 +1,260 @@
+"""
+Pluggable HTML-to-text engines for URL ingestion, selected by settings.HTML_ENGINE:
+- lxml: libxml2's C parser and one pass over the tree (the default when lxml is installed)
+- selectolax: the lexbor C parser (when selectolax is installed)
+- bs4: BeautifulSoup with html.parser, the original pure-Python path
+"auto" picks lxml, then selectolax, then bs4.
+
+With HTML_MAIN_CONTENT the text comes from the page's main content element (<main>, <article>, ...)
+and boilerplate is dropped: navigation, headers and footers, sidebars, forms, tables of contents,
+reference lists, citation markers and edit links. The lxml and selectolax engines keep inline
+markup on its line and start a new line at block elements. bs4 puts every text node on its own line,
+as before; HTML_ENGINE=bs4 with HTML_MAIN_CONTENT=false reproduces the original output exactly.
+
+Links are always collected from the whole page, so crawls still follow navigation links.
+When lxml or selectolax raises or finds no text in a non-empty page, the page is re-parsed with bs4.
+"""
+import itertools
+from urllib.parse import urljoin, urldefrag
+from bs4 import BeautifulSoup
+from app.config import settings
+
+try:
+    from lxml import etree
+except ImportError:  # optional: pip install -e ".[html]"
+    etree = None
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:  # optional: pip install selectolax
+    LexborHTMLParser = None
+
+ENGINES = ("lxml", "selectolax", "bs4")
+
+# Elements never part of the readable content
+_DROP_TAGS = ("script", "style", "noscript", "template", "svg", "iframe", "nav", "footer", "aside", "form", "button")
+_ALWAYS_DROP_TAGS = ("script", "style")
+_DROP_ROLES = ("navigation", "banner", "contentinfo", "complementary", "search")
+_DROP_CLASSES = (
+    "navbox", "vertical-navbox", "navigation", "menu", "sidebar", "breadcrumb", "breadcrumbs", "toc",
+    "reflist", "references", "mw-references-wrap", "reference", "mw-editsection", "mw-jump-link",
+    "catlinks", "noprint", "printfooter", "skip-link", "cookie-banner", "site-header", "site-footer",
+)
+_DROP_IDS = ("toc", "footer", "header", "mw-navigation", "mw-panel", "mw-head", "catlinks", "jump-to-nav", "siteSub", "references")
+# First match is taken as the main content
+_MAIN_SELECTORS = ("main", "[role=main]", "article", "#content", "#main")
+
+_DROP_CSS = ", ".join(
+    list(_DROP_TAGS) + [f"[role={role}]" for role in _DROP_ROLES] + [f".{name}" for name in _DROP_CLASSES] + [f"#{name}" for name in _DROP_IDS]
+)
+_DROP_TAG_SET, _DROP_ROLE_SET = frozenset(_DROP_TAGS), frozenset(_DROP_ROLES)
+_DROP_CLASS_SET, _DROP_ID_SET = frozenset(_DROP_CLASSES), frozenset(_DROP_IDS)
+
+def _is_boilerplate(tag: str, attrs) -> bool:
+    """
+    Whether an element (tag name and attribute mapping) is boilerplate; one set lookup per rule instead of a selector match.
+    """
+    if tag in _DROP_TAG_SET or attrs.get("role") in _DROP_ROLE_SET or attrs.get("id") in _DROP_ID_SET:
+        return True
+    classes = attrs.get("class")
+    if not classes:
+        return False
+    return not _DROP_CLASS_SET.isdisjoint(classes.split() if isinstance(classes, str) else classes)
+
+_BLOCK_TAGS = frozenset((
+    "address", "article", "aside", "blockquote", "br", "caption", "dd", "div", "dl", "dt", "figcaption", "figure",
+    "footer", "h1", "h2", "h3", "h4", "h5", "h6", "header", "hr", "li", "main", "nav", "ol", "p", "pre", "section",
+    "table", "td", "th", "title", "tr", "ul",
+))
+
+def resolve_engine(name: str | None = None) -> str:
+    """
+    The engine to use for `name` (default settings.HTML_ENGINE), resolving "auto" to the fastest installed one.
+    """
+    name = name or settings.HTML_ENGINE
+    if name == "auto":
+        return "lxml" if etree is not None else "selectolax" if LexborHTMLParser is not None else "bs4"
+    if name == "lxml" and etree is None:
+        raise RuntimeError('HTML_ENGINE=lxml requires lxml (pip install -e ".[html]")')
+    if name == "selectolax" and LexborHTMLParser is None:
+        raise RuntimeError("HTML_ENGINE=selectolax requires selectolax (pip install selectolax)")
+    if name not in ENGINES:
+        raise ValueError(f"Unknown HTML engine '{name}' (expected 'auto', 'lxml', 'selectolax' or 'bs4')")
+    return name
+
+def _clean_lines(text: str) -> str:
+    lines = (" ".join(line.split()) for line in text.splitlines())
+    return "\n".join(line for line in lines if line)
+
+def _absolute_links(hrefs, base_url: str) -> list[str]:
+    links = []
+    for href in hrefs:
+        link = urldefrag(urljoin(base_url, href.strip())).url
+        if link.startswith(("http://", "https://")):
+            links.append(link)
+    return links
+
+# --- bs4 ---
+
+def _bs4_text(html: str, main_content: bool, base_url: str | None) -> tuple[str, list[str]]:
+    soup = BeautifulSoup(html, "html.parser")
+    links = _absolute_links((a["href"] for a in soup.find_all("a", href=True)), base_url) if base_url is not None else []
+
+    root = soup
+    if main_content:
+        for element in soup.find_all(lambda tag: _is_boilerplate(tag.name, tag.attrs)):
+            element.decompose()
+        for selector in _MAIN_SELECTORS:
+            root = soup.select_one(selector)
+            if root is not None:
+                break
+        else:
+            root = soup
+    else:
+        # Remove script and style elements
+        for script in soup(_ALWAYS_DROP_TAGS):
+            script.decompose()
+
+    text = root.get_text(separator="\n")
+
+    # Clean up whitespace
+    lines = (line.strip() for line in text.splitlines())
+    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+    return "\n".join(chunk for chunk in chunks if chunk), links
+
+# --- lxml ---
+
+if etree is not None:
+    # Plain elements rather than lxml.html's HtmlElement classes, whose per-element class lookup dominates a tree walk.
+    # huge_tree lifts libxml2's nesting limit (255 levels), beyond which the page would silently parse as empty
+    _LXML_PARSER = etree.HTMLParser(remove_comments=True, remove_pis=True, huge_tree=True)
+    _LXML_MAIN = [etree.XPath(path) for path in ("//main", "//*[@role='main']", "//article", "//*[@id='content']", "//*[@id='main']")]
+
+def _lxml_parse(html: str):
+    try:
+        return etree.fromstring(html, _LXML_PARSER)
+    except ValueError:
+        # Unicode strings with an XML encoding declaration must be parsed as bytes
+        return etree.fromstring(html.encode("utf-8"), _LXML_PARSER)
+
+def _lxml_drop(element):
+    # Remove an element but keep its tail text, which belongs to the parent
+    parent = element.getparent()
+    if parent is None:
+        return
+    if element.tail:
+        previous = element.getprevious()
+        if previous is not None:
+            previous.tail = (previous.tail or "") + element.tail
+        else:
+            parent.text = (parent.text or "") + element.tail
+    parent.remove(element)
+
+def _lxml_text(html: str, main_content: bool, base_url: str | None) -> tuple[str, list[str]]:
+    document = _lxml_parse(html)
+    if document is None:
+        return "", []
+    links = _absolute_links(document.xpath("//a/@href"), base_url) if base_url is not None else []
+
+    if main_content:
+        dropped = [element for element in document.iter(etree.Element) if _is_boilerplate(element.tag, element.attrib)]
+    else:
+        dropped = list(document.iter(*_ALWAYS_DROP_TAGS))
+    for element in dropped:
+        _lxml_drop(element)
+    root = document
+    if main_content:
+        for find in _LXML_MAIN:
+            found = find(document)
+            if found:
+                root = found[0]
+                break
+
+    parts = []
+    for event, element in etree.iterwalk(root, events=("start", "end")):
+        tag = element.tag
+        if event == "start":
+            if tag in _BLOCK_TAGS:
+                parts.append("\n")
+            if element.text:
+                parts.append(element.text)
+        else:
+            if tag in _BLOCK_TAGS:
+                parts.append("\n")
+            if element.tail and element is not root:
+                parts.append(element.tail)
+    return _clean_lines("".join(parts)), links
+
+# --- selectolax ---
+
+def _selectolax_walk(root, parts: list):
+    # Iterative so deeply nested pages cannot exhaust the Python stack; None marks a block element's end
+    stack = [iter(root.iter(include_text=True))]
+    while stack:
+        child = next(stack[-1], False)
+        if child is False:
+            stack.pop()
+            continue
+        if child is None:
+            parts.append("\n")
+            continue
+        tag = child.tag
+        if tag == "-text":
+            parts.append(child.text_content)
+        elif not tag.startswith("-"):  # skip comments and doctypes
+            children = child.iter(include_text=True)
+            if tag in _BLOCK_TAGS:
+                parts.append("\n")
+                children = itertools.chain(children, (None,))
+            stack.append(iter(children))
+
+def _selectolax_text(html: str, main_content: bool, base_url: str | None) -> tuple[str, list[str]]:
+    tree = LexborHTMLParser(html)
+    links = _absolute_links((a.attributes.get("href") or "" for a in tree.css("a[href]")), base_url) if base_url is not None else []
+
+    for element in tree.css(_DROP_CSS if main_content else ", ".join(_ALWAYS_DROP_TAGS)):
+        element.decompose()
+    root = tree.root
+    if main_content:
+        for selector in _MAIN_SELECTORS:
+            found = tree.css_first(selector)
+            if found is not None:
+                root = found
+                break
+    if root is None:
+        return "", links
+
+    parts = []
+    _selectolax_walk(root, parts)
+    return _clean_lines("".join(parts)), links
+
+_ENGINES = {"lxml": _lxml_text, "selectolax": _selectolax_text, "bs4": _bs4_text}
+
+def extract(html: str, base_url: str | None = None, engine: str | None = None, main_content: bool | None = None) -> tuple[str, list[str]]:
+    """
+    (text, links) of a page; links (absolute, without fragments) only when base_url is given.
+    """
+    if not html or not html.strip():
+        return "", []
+    if main_content is None:
+        main_content = settings.HTML_MAIN_CONTENT
+    engine = resolve_engine(engine)
+    if engine == "bs4":
+        return _bs4_text(html, main_content, base_url)
+    try:
+        text, links = _ENGINES[engine](html, main_content, base_url)
+        if text:
+            return text, links
+    except Exception as e:
+        print(f"HTML engine {engine} failed ({e.__class__.__name__}: {e}), falling back to bs4")
+    # A fast engine that finds no text in a non-empty page may have hit a parser limit; bs4 gets the final say
+    return _bs4_text(html, main_content, base_url)
+
+def html_to_text(html: str, engine: str | None = None, main_content: bool | None = None) -> str:
+    return extract(html, engine=engine, main_content=main_content)[0]
+
+def html_to_text_and_links(html: str, base_url: str, engine: str | None = None, main_content: bool | None = None) -> tuple[str, list[str]]:
+    """
+    Text of a page plus the absolute http(s) URLs it links to (without fragments), from a single parse.
+    """
+    return extract(html, base_url, engine, main_content)
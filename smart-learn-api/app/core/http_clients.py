@@ -0,0 +1,82 @@
+"""
+Application-scoped outbound HTTP clients.
+
+Opening an httpx.AsyncClient per request pays DNS, TCP and TLS setup every time and never reuses a
+connection. Instead one pooled keep-alive client per purpose is shared by every request:
+- kb: proxying queries to the external knowledge base at KB_URL
+- web: fetching pages for URL ingestion (follows redirects, identifies the bot)
+Clients are created on first use and closed by the application lifespan. Connections belong to the
+event loop that opened them, so (as with the store locks) each loop gets its own clients.
+"""
+import asyncio
+import httpx
+from app.config import settings
+
+try:
+    import h2  # noqa: F401  (HTTP/2 support for httpx)
+except ImportError:
+    h2 = None
+
+# Wikipedia Bot Policy: Use a descriptive User-Agent with contact info.
+# Do NOT mimic a browser, or you'll get a 403.
+WEB_HEADERS = {
+    "User-Agent": "SmartLearnAvatar/1.0 (https://github.com/TODO_USER_GITHUB_PATH; mailto:educational-project@example.com) Educational-AI-Bot",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Encoding": "gzip, deflate, br",
+}
+
+_clients = {}  # {event loop: {name: httpx.AsyncClient}}
+_warned_http2 = False
+
+def _use_http2() -> bool:
+    global _warned_http2
+    if settings.HTTP2 and h2 is None and not _warned_http2:
+        print("HTTP2 is enabled but the h2 package is not installed (pip install -e \".[http2]\"); using HTTP/1.1")
+        _warned_http2 = True
+    return settings.HTTP2 and h2 is not None
+
+def _build(name: str) -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=settings.HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+    )
+    if name == "kb":
+        timeout = httpx.Timeout(settings.KB_URL_TIMEOUT, connect=settings.HTTP_CONNECT_TIMEOUT)
+        return httpx.AsyncClient(limits=limits, timeout=timeout, http2=_use_http2())
+    if name == "web":
+        timeout = httpx.Timeout(settings.URL_FETCH_TIMEOUT, connect=settings.HTTP_CONNECT_TIMEOUT)
+        return httpx.AsyncClient(limits=limits, timeout=timeout, http2=_use_http2(), follow_redirects=True, headers=WEB_HEADERS)
+    raise ValueError(f"Unknown HTTP client: {name}")
+
+def _get(name: str) -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    if loop not in _clients:
+        # Forget the clients of loops that have been closed (tests, CLI runs)
+        for stale in [other for other in _clients if other.is_closed()]:
+            del _clients[stale]
+        _clients[loop] = {}
+    clients = _clients[loop]
+    if name not in clients or clients[name].is_closed:
+        clients[name] = _build(name)
+    return clients[name]
+
+def get_kb_client() -> httpx.AsyncClient:
+    """
+    Pooled client for the external knowledge base at KB_URL.
+    """
+    return _get("kb")
+
+def get_web_client() -> httpx.AsyncClient:
+    """
+    Pooled client for fetching web pages to ingest.
+    """
+    return _get("web")
+
+async def close_http_clients():
+    """
+    Close the clients of the running loop (called from the application lifespan).
+    """
+    clients = _clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.aclose()
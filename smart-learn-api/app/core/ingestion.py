@@ -1,89 +1,224 @@
 import io
+import re
+import mmap
+import contextlib
+import bisect
+import asyncio
+import functools
+from typing import AsyncIterator, NamedTuple
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import pandas as pd
-import httpx
-from bs4 import BeautifulSoup
 from pypdf import PdfReader
 from fastapi import UploadFile, HTTPException
+from app.config import settings
+from app.core.jobs import report_progress
+from app.core.http_clients import get_web_client
+from app.core.html_text import html_to_text, html_to_text_and_links
+from app.utils.tokens import estimate_tokens
+
+# Extraction is CPU-bound, so it runs in worker processes to keep the event loop free for queries
+_pool = None
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn rather than fork: the API process holds threads (ChromaDB, SQLite) that must not be forked
+        _pool = ProcessPoolExecutor(max_workers=settings.EXTRACT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+def _reset_pool():
+    """
+    Kill the pool so a runaway extraction stops consuming CPU; other in-flight extractions fail and are retried by their jobs.
+    """
+    global _pool
+    pool, _pool = _pool, None
+    if pool is None:
+        return
+    for process in list((getattr(pool, "_processes", None) or {}).values()):
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def shutdown_extraction_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+async def run_extraction(func, *args):
+    """
+    Run an extraction function in the process pool and await its result, bounded by EXTRACT_TIMEOUT.
+    With EXTRACT_WORKERS=0 it runs in a thread instead (no multiprocessing available).
+    Raises TimeoutError when the extraction takes longer; it never returns a placeholder result.
+    """
+    loop = asyncio.get_running_loop()
+    if settings.EXTRACT_WORKERS <= 0:
+        future = loop.run_in_executor(None, functools.partial(func, *args))
+    else:
+        future = loop.run_in_executor(_get_pool(), functools.partial(func, *args))
+    try:
+        return await asyncio.wait_for(future, timeout=settings.EXTRACT_TIMEOUT)
+    except asyncio.TimeoutError:
+        if settings.EXTRACT_WORKERS > 0:
+            _reset_pool()
+        raise TimeoutError(f"Extraction timed out after {settings.EXTRACT_TIMEOUT:.0f}s")
+    except BrokenProcessPool:
+        _reset_pool()
+        raise
+
+@contextlib.contextmanager
+def _open_source(source):
+    """
+    Read-only view of an upload: the file memory-mapped when given a path, so the bytes stay in the
+    page cache shared by every worker instead of being copied into each process; bytes otherwise.
+    Workers receive a file path when the upload is on disk, so large files are never pickled across processes.
+    """
+    if not isinstance(source, str):
+        yield source
+        return
+    with open(source, "rb") as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty files cannot be mapped
+            yield b""
+            return
+        with mapped:
+            yield mapped
+
+def _parse_pdf(source) -> str:
+    with _open_source(source) as data:
+        reader = PdfReader(data if isinstance(data, mmap.mmap) else io.BytesIO(data))
+        return "\n".join((page.extract_text() or "") for page in reader.pages) + "\n"
+
+def _count_pdf_pages(source) -> int:
+    with _open_source(source) as data:
+        return len(PdfReader(data if isinstance(data, mmap.mmap) else io.BytesIO(data)).pages)
+
+def _parse_pdf_pages(source, start: int, stop: int) -> list[str]:
+    with _open_source(source) as data:
+        reader = PdfReader(data if isinstance(data, mmap.mmap) else io.BytesIO(data))
+        return [(reader.pages[i].extract_text() or "") + "\n" for i in range(start, stop)]
+
+async def iter_pdf_pages(source, batch_pages: int | None = None) -> AsyncIterator[tuple[int, str]]:
+    """
+    Yield (page_number, text) for each page of a PDF, starting at 1.
+    Pages are extracted in the pool PDF_PAGE_BATCH at a time, so only one batch of page text is in memory.
+    """
+    batch_pages = batch_pages or settings.PDF_PAGE_BATCH
+    try:
+        total = await run_extraction(_count_pdf_pages, source)
+        for start in range(0, total, batch_pages):
+            stop = min(start + batch_pages, total)
+            texts = await run_extraction(_parse_pdf_pages, source, start, stop)
+            for offset, text in enumerate(texts):
+                yield start + offset + 1, text
+            report_progress(stop, total)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error extracting text from PDF: {str(e)}")
+
+def _parse_csv(source) -> str:
+    if isinstance(source, str):
+        df = pd.read_csv(source, memory_map=True)
+    else:
+        df = pd.read_csv(io.BytesIO(source))
+    return df.to_string(index=False)
+
+def _parse_txt(source) -> str:
+    with _open_source(source) as data:
+        # Decoding straight from the mapping skips an intermediate bytes copy
+        with memoryview(data) as view:
+            return str(view, "utf-8")
+
+def _parse_docx(source) -> str:
+    import docx
+    doc = docx.Document(source if isinstance(source, str) else io.BytesIO(source))
+    return "\n".join([para.text for para in doc.paragraphs])
+
+_PARSERS = {
+    ".pdf": (_parse_pdf, "PDF"),
+    ".csv": (_parse_csv, "CSV"),
+    ".txt": (_parse_txt, "TXT"),
+    ".docx": (_parse_docx, "DOCX"),
+}
 
 async def extract_text(file: UploadFile) -> str:
-    content = await file.read()
+    """
+    Extract text from an uploaded file in the extraction pool.
+    Objects exposing a `path` (uploads stored on disk) are handed over by path instead of by content.
+    """
     filename = file.filename.lower()
-    
-    if filename.endswith(".pdf"):
-        return extract_text_from_pdf(content)
-    elif filename.endswith(".csv"):
-        return extract_text_from_csv(content)
-    elif filename.endswith(".txt"):
-        return extract_text_from_txt(content)
-    elif filename.endswith(".docx"):
-        return extract_text_from_docx(content)
+    for extension, (parser, label) in _PARSERS.items():
+        if filename.endswith(extension):
+            break
     else:
         raise HTTPException(status_code=400, detail="Unsupported file type")
 
+    source = getattr(file, "path", None) or await file.read()
+    try:
+        return await run_extraction(parser, source)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error extracting text from {label}: {str(e)}")
+
 def extract_text_from_pdf(content: bytes) -> str:
     try:
-        reader = PdfReader(io.BytesIO(content))
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() + "\n"
-        return text
+        return _parse_pdf(content)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error extracting text from PDF: {str(e)}")
 
 def extract_text_from_csv(content: bytes) -> str:
     try:
-        df = pd.read_csv(io.BytesIO(content))
-        return df.to_string(index=False)
+        return _parse_csv(content)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error extracting text from CSV: {str(e)}")
 
 def extract_text_from_txt(content: bytes) -> str:
     try:
-        return content.decode("utf-8")
+        return _parse_txt(content)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error extracting text from TXT: {str(e)}")
 
 def extract_text_from_docx(content: bytes) -> str:
     try:
-        import docx
-        doc = docx.Document(io.BytesIO(content))
-        return "\n".join([para.text for para in doc.paragraphs])
+        return _parse_docx(content)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error extracting text from DOCX: {str(e)}")
 
-async def extract_text_from_url(url: str) -> str:
+class WebPage(NamedTuple):
+    url: str
+    text: str | None  # None when the page is unchanged since the validators sent with the request
+    links: list[str] = []
+    etag: str | None = None
+    last_modified: str | None = None
+
+async def fetch_web_page(url: str, etag: str | None = None, last_modified: str | None = None, links: bool = False) -> WebPage:
+    """
+    Fetch a page and extract its text (and outgoing links with links=True).
+    Pass the ETag / Last-Modified of a previous fetch to make the request conditional.
+    """
     try:
-        # Wikipedia Bot Policy: Use a descriptive User-Agent with contact info.
-        # Do NOT mimic a browser, or you'll get a 403.
-        headers = {
-            "User-Agent": "SmartLearnAvatar/1.0 (https://github.com/TODO_USER_GITHUB_PATH; mailto:educational-project@example.com) Educational-AI-Bot",
-            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-            "Accept-Encoding": "gzip, deflate, br",
-            "Connection": "keep-alive"
-        }
-        
-        async with httpx.AsyncClient(follow_redirects=True) as client:
-            # Note: Wikipedia prefers honest identification over browser impersonation
-            response = await client.get(url, headers=headers, timeout=30.0)
-            if response.status_code >= 400:
-                # Log the error and raise an HTTPException with the specific status code
-                print(f"HTTP Error fetching URL {url}: {response.status_code}")
-                raise HTTPException(status_code=response.status_code, detail=f"Error fetching URL: Status {response.status_code}")
-            
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Remove script and style elements
-        for script in soup(["script", "style"]):
-            script.decompose()
-            
-        text = soup.get_text(separator='\n')
-        
-        # Clean up whitespace
-        lines = (line.strip() for line in text.splitlines())
-        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-        text = '\n'.join(chunk for chunk in chunks if chunk)
-        
-        return text
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        # The shared web client identifies the bot honestly (see http_clients.WEB_HEADERS) and keeps connections alive
+        response = await get_web_client().get(url, headers=headers)
+        if response.status_code == 304:
+            return WebPage(url, None, etag=etag, last_modified=last_modified)
+        if response.status_code >= 400:
+            # Log the error and raise an HTTPException with the specific status code
+            print(f"HTTP Error fetching URL {url}: {response.status_code}")
+            raise HTTPException(status_code=response.status_code, detail=f"Error fetching URL: Status {response.status_code}")
+
+        # Parsing is CPU-bound; hand it to the extraction pool
+        if links:
+            text, page_links = await run_extraction(html_to_text_and_links, response.text, str(response.url))
+        else:
+            text, page_links = await run_extraction(html_to_text, response.text), []
+        return WebPage(url, text, page_links, response.headers.get("ETag"), response.headers.get("Last-Modified"))
     except HTTPException:
         # Re-raise HTTP exceptions (like the one we raised above) so they aren't caught by the generic handler
         raise
@@ -92,15 +227,239 @@ async def extract_text_from_url(url: str) -> str:
         print(f"Unexpected error extracting text from URL {url}: {e}")
         raise HTTPException(status_code=500, detail=f"Error extracting text from URL: {str(e)}")
 
+async def extract_text_from_url(url: str) -> str:
+    return (await fetch_web_page(url)).text
+
+class Chunk(NamedTuple):
+    text: str
+    page_start: int | None = None
+    page_end: int | None = None
+
+class _StreamingChunker:
+    """
+    Text buffer fed one unit (e.g. a PDF page) at a time that remembers which page each offset came from.
+    Subclasses consume the buffer from self._start and only the unconsumed tail is kept in memory.
+    """
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self._buffer = ""
+        self._start = 0
+        self._page_offsets = []  # buffer offsets where each unit starts
+        self._pages = []
+
+    def _append(self, text: str, page: int | None):
+        self._page_offsets.append(len(self._buffer))
+        self._pages.append(page)
+        self._buffer += text
+
+    def _page_at(self, offset: int) -> int | None:
+        i = bisect.bisect_right(self._page_offsets, offset) - 1
+        return self._pages[max(i, 0)] if self._pages else None
+
+    def _compact(self):
+        # Drop consumed text once per feed instead of slicing per chunk (keeps large units linear)
+        if not self._start:
+            return
+        keep = bisect.bisect_right(self._page_offsets, self._start) - 1
+        self._page_offsets = [max(o - self._start, 0) for o in self._page_offsets[keep:]]
+        self._pages = self._pages[keep:]
+        self._buffer = self._buffer[self._start:]
+        self._start = 0
+
+class FixedWindowChunker(_StreamingChunker):
+    """
+    Fixed character windows with overlap. Produces exactly the chunks of chunk_text over the
+    concatenated units and tags each chunk with its page range.
+    """
+
+    def __init__(self, chunk_size: int = 1000, overlap: int = 200):
+        super().__init__()
+        self.chunk_size = chunk_size
+        self.step = chunk_size - overlap
+
+    def _window(self, start: int) -> Chunk:
+        end = min(start + self.chunk_size, len(self._buffer))
+        return Chunk(self._buffer[start:end], self._page_at(start), self._page_at(end - 1))
+
+    def feed(self, text: str, page: int | None = None) -> list[Chunk]:
+        if not text:
+            return []
+        self._append(text, page)
+        chunks = []
+        while len(self._buffer) - self._start >= self.chunk_size:
+            chunks.append(self._window(self._start))
+            self._start += self.step
+        self._compact()
+        return chunks
+
+    def finish(self) -> list[Chunk]:
+        chunks = []
+        while self._start < len(self._buffer):
+            chunks.append(self._window(self._start))
+            self._start += self.step
+        self._reset()
+        return chunks
+
+_BLOCK_BREAK = re.compile(r"\n[ \t]*\n\s*")
+# End of a sentence: terminal punctuation (plus closing quotes/brackets), whitespace, then something that starts a sentence
+_SENTENCE_END = re.compile(r"(?<=[.!?])[\"')\]]*\s+(?=[A-Z0-9\"'(\[*#-])")
+_MARKDOWN_HEADING = re.compile(r"#{1,6}\s")
+
+class _Segment(NamedTuple):
+    text: str
+    tokens: int
+    new_block: bool  # first segment of a paragraph/heading block
+    heading: bool
+    page_start: int | None
+    page_end: int | None
+
+class StructuredChunker(_StreamingChunker):
+    """
+    Packs whole sentences into chunks of at most max_tokens, keeping paragraphs together where they fit
+    and starting a new chunk at headings. Sentences longer than the budget are split at word boundaries.
+    overlap_tokens carries trailing sentences (up to that many tokens) into the next chunk.
+    """
+
+    def __init__(self, max_tokens: int = 250, overlap_tokens: int = 0):
+        super().__init__()
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        # A heading only closes the current chunk once it holds this much, so tiny sections get merged
+        self.min_tokens = max_tokens // 4
+        self._block_open = False  # the current block already produced segments
+        self._parts: list[_Segment] = []
+        self._tokens = 0
+        self._fresh = 0  # parts that were not carried over as overlap
+
+    # --- Segmentation ---
+
+    def _segments(self, start: int, end: int, complete: bool) -> tuple[list[_Segment], int]:
+        """
+        Split buffer[start:end] (inside one block) into sentence segments.
+        Returns the segments and the offset up to which the text was consumed.
+        """
+        bounds = [m.end() for m in _SENTENCE_END.finditer(self._buffer, start, end)]
+        if complete:
+            bounds.append(end)
+        elif end - (bounds[-1] if bounds else start) > self.max_tokens * 8:
+            # No sentence boundary in sight (tables, unpunctuated text): cut at the last whitespace
+            cut = max(self._buffer.rfind(" ", start, end - 1), self._buffer.rfind("\n", start, end - 1))
+            if cut > (bounds[-1] if bounds else start):
+                bounds.append(cut + 1)
+
+        segments = []
+        for stop in bounds:
+            text = " ".join(self._buffer[start:stop].split())
+            if text:
+                heading = complete and not self._block_open and stop == end and len(bounds) == 1 and self._is_heading(text)
+                segments.extend(self._split_long(text, heading, self._page_at(start), self._page_at(max(stop - 1, start))))
+                self._block_open = True
+            start = stop
+        return segments, start
+
+    @staticmethod
+    def _is_heading(text: str) -> bool:
+        return bool(_MARKDOWN_HEADING.match(text)) or (len(text.split()) <= 12 and text[-1] not in ".!?:;,")
+
+    def _split_long(self, text: str, heading: bool, page_start, page_end) -> list[_Segment]:
+        new_block = not self._block_open
+        tokens = estimate_tokens(text)
+        if tokens <= self.max_tokens:
+            return [_Segment(text, tokens, new_block, heading, page_start, page_end)]
+        pieces, words, size = [], [], 0
+        for word in text.split(" "):
+            cost = estimate_tokens(word + " ")
+            if words and size + cost > self.max_tokens:
+                pieces.append(" ".join(words))
+                words, size = [], 0
+            words.append(word)
+            size += cost
+        pieces.append(" ".join(words))
+        return [
+            _Segment(piece, estimate_tokens(piece), new_block and i == 0, False, page_start, page_end)
+            for i, piece in enumerate(pieces)
+        ]
+
+    def _consume(self, complete: bool) -> list[_Segment]:
+        segments = []
+        for m in _BLOCK_BREAK.finditer(self._buffer, self._start):
+            found, _ = self._segments(self._start, m.start(), complete=True)
+            segments.extend(found)
+            self._start, self._block_open = m.end(), False
+        # The last block may continue in the next unit: only take its finished sentences
+        found, self._start = self._segments(self._start, len(self._buffer), complete)
+        segments.extend(found)
+        if complete:
+            self._block_open = False
+        return segments
+
+    # --- Packing ---
+
+    def _emit(self) -> Chunk:
+        # A heading at the very end belongs with the section that follows it
+        held = []
+        while len(self._parts) > 1 and self._parts[-1].heading:
+            held.insert(0, self._parts.pop())
+        text = ""
+        for part in self._parts:
+            text += ("\n\n" if part.new_block else " ") + part.text if text else part.text
+        chunk = Chunk(text, self._parts[0].page_start, self._parts[-1].page_end)
+        carried, tokens = [], 0
+        for part in reversed(self._parts):
+            if part.heading or tokens + part.tokens > self.overlap_tokens:
+                break
+            carried.insert(0, part._replace(new_block=False))
+            tokens += part.tokens
+        if held:
+            carried, tokens = held, sum(part.tokens for part in held)
+        self._parts, self._tokens, self._fresh = carried, tokens, len(held)
+        return chunk
+
+    def _pack(self, segments: list[_Segment]) -> list[Chunk]:
+        chunks = []
+        for segment in segments:
+            if self._fresh and (
+                (segment.heading and self._tokens >= self.min_tokens)
+                or self._tokens + segment.tokens > self.max_tokens
+            ):
+                chunks.append(self._emit())
+            if self._tokens + segment.tokens > self.max_tokens or (segment.heading and not self._fresh):
+                # Overlap never pushes a chunk over budget or in front of a heading
+                self._parts, self._tokens = [], 0
+            self._parts.append(segment)
+            self._tokens += segment.tokens
+            self._fresh += 1
+        return chunks
+
+    def feed(self, text: str, page: int | None = None) -> list[Chunk]:
+        if not text:
+            return []
+        self._append(text, page)
+        chunks = self._pack(self._consume(complete=False))
+        self._compact()
+        return chunks
+
+    def finish(self) -> list[Chunk]:
+        chunks = self._pack(self._consume(complete=True))
+        if self._fresh:
+            chunks.append(self._emit())
+        self._reset()
+        self._parts, self._tokens, self._fresh = [], 0, 0
+        return chunks
+
+def get_chunker() -> FixedWindowChunker | StructuredChunker:
+    """
+    Chunker selected by settings.CHUNKER for one document.
+    """
+    if settings.CHUNKER == "fixed":
+        return FixedWindowChunker(settings.CHUNK_SIZE, settings.CHUNK_OVERLAP)
+    if settings.CHUNKER == "structured":
+        return StructuredChunker(settings.CHUNK_MAX_TOKENS, settings.CHUNK_OVERLAP_TOKENS)
+    raise ValueError(f"Unknown chunker '{settings.CHUNKER}' (expected 'fixed' or 'structured')")
+
 def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 200) -> list[str]:
-    chunks = []
-    start = 0
-    text_len = len(text)
-    
-    while start < text_len:
-        end = start + chunk_size
-        chunk = text[start:end]
-        chunks.append(chunk)
-        start += chunk_size - overlap
-        
-    return chunks
+    chunker = FixedWindowChunker(chunk_size, overlap)
+    return [chunk.text for chunk in chunker.feed(text) + chunker.finish()]
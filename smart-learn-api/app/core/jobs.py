@@ -0,0 +1,379 @@
+"""
+Durable ingestion job queue.
+
+Jobs are persisted in SQLite and executed by a pool of INGEST_WORKERS asyncio workers started
+with the application. Jobs of the same KB run one at a time in submission order, failures are
+retried with backoff up to INGEST_MAX_ATTEMPTS, and jobs left behind by a crashed process are
+picked up again once their heartbeat lease expires.
+
+Handlers report progress through report_stage / report_progress, which are no-ops when the
+pipeline is called outside a job. Workers read and write the queue's SQLite file in threads, off
+the event loop; API handlers call enqueue / get_job / list_jobs the same way (asyncio.to_thread).
+"""
+import os
+import json
+import time
+import uuid
+import socket
+import asyncio
+import threading
+import contextvars
+from typing import Awaitable, Callable
+from app.config import settings
+from app.utils.sqlite import connect, default_path
+from app.core.metrics import INGEST_JOBS, INGEST_STAGE_SECONDS, observe_stages
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    kb_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    source TEXT,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    stage TEXT,
+    progress REAL NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    error TEXT,
+    stage_timings TEXT NOT NULL DEFAULT '{}',
+    worker TEXT,
+    created_at REAL NOT NULL,
+    available_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    heartbeat_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, available_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_kb ON jobs (kb_id, seq);
+"""
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+
+# Pipeline stages in order; entering a stage sets coarse progress until the handler reports its own
+STAGES = ["extract", "chunk", "embed", "store"]
+
+# {kind: async handler(kb_id, payload)}
+_handlers: dict[str, Callable[[str, dict], Awaitable[None]]] = {}
+
+_current_job = contextvars.ContextVar("current_job", default=None)
+
+def register_handler(kind: str, handler: Callable[[str, dict], Awaitable[None]]):
+    """
+    Register the coroutine that executes jobs of a given kind.
+    """
+    _handlers[kind] = handler
+
+def report_stage(stage: str):
+    """
+    Mark the start of a pipeline stage (extract/chunk/embed/store) for the running job.
+    """
+    reporter = _current_job.get()
+    if reporter is not None:
+        reporter.stage(stage)
+
+def report_progress(done: int, total: int):
+    """
+    Report overall progress of the running job as done/total units of work (e.g. pages).
+    Once reported, stage changes no longer move the progress.
+    """
+    reporter = _current_job.get()
+    if reporter is not None and total:
+        reporter.progress(min(done / total, 1.0))
+
+def _row_to_job(row) -> dict:
+    job = dict(row)
+    job.pop("seq", None)
+    job["payload"] = json.loads(job["payload"])
+    job["stage_timings"] = json.loads(job["stage_timings"] or "{}")
+    return job
+
+class _JobReporter:
+    def __init__(self, queue: "JobQueue", job_id: str):
+        self.queue = queue
+        self.job_id = job_id
+        self.current_stage = None
+        self.stage_started = None
+        self.timings = {}
+        self.reports_progress = False
+        self.started = time.perf_counter()
+        self._pending = {}  # fields not yet written; later reports overwrite earlier ones
+        self._writer = None  # task writing them off the event loop
+
+    def stage(self, stage: str):
+        now = time.perf_counter()
+        self._close_stage(now)
+        self.current_stage, self.stage_started = stage, now
+        fields = {"stage": stage, "stage_timings": json.dumps(self.timings)}
+        if stage in STAGES and not self.reports_progress:
+            fields["progress"] = STAGES.index(stage) / len(STAGES)
+        self._write(fields)
+
+    def progress(self, fraction: float):
+        self.reports_progress = True
+        self._write({"progress": fraction})
+
+    def _write(self, fields: dict):
+        self._pending.update(fields)
+        if self._writer is None:
+            self._writer = asyncio.get_running_loop().create_task(self._flush())
+
+    async def _flush(self):
+        try:
+            while self._pending:
+                fields, self._pending = self._pending, {}
+                await asyncio.to_thread(self.queue._update, self.job_id, **fields)
+        except Exception as e:
+            print(f"Job {self.job_id}: could not record progress: {e}")
+        finally:
+            self._writer = None
+
+    async def drain(self):
+        """
+        Wait for reported stages and progress to be written, so they cannot overwrite the final state.
+        """
+        if self._writer is not None:
+            await self._writer
+
+    def _close_stage(self, now: float):
+        if self.current_stage is not None:
+            self.timings[self.current_stage] = self.timings.get(self.current_stage, 0.0) + now - self.stage_started
+
+    def finish(self) -> str:
+        self._close_stage(time.perf_counter())
+        self.current_stage = None
+        return json.dumps(self.timings)
+
+class JobQueue:
+    def __init__(self, path: str, uploads_dir: str, workers: int, max_attempts: int, retry_backoff: float, lease: float):
+        self.uploads_dir = uploads_dir
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.lease = lease
+        self.worker_name = f"{socket.gethostname()}:{os.getpid()}"
+        self._lock = threading.Lock()
+        self._conn = connect(path)
+        self._conn.executescript(_SCHEMA)
+        self._tasks = []
+        self._wakeup = None
+        self._loop = None
+
+    # --- Submission and status ---
+
+    def upload_path(self, job_id: str) -> str:
+        """
+        Location where the uploaded file of a job is kept until the job finishes.
+        """
+        os.makedirs(self.uploads_dir, exist_ok=True)
+        return os.path.join(self.uploads_dir, job_id)
+
+    def new_job_id(self) -> str:
+        return uuid.uuid4().hex
+
+    def enqueue(self, kind: str, kb_id: str, payload: dict, source: str | None = None, job_id: str | None = None) -> str:
+        """
+        Persist a job and wake up an idle worker. Returns the job ID.
+        """
+        if kind not in _handlers:
+            raise ValueError(f"No handler registered for job kind '{kind}'")
+        job_id = job_id or self.new_job_id()
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    """
+                    INSERT INTO jobs (id, kb_id, kind, source, payload, status, max_attempts, created_at, available_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (job_id, kb_id, kind, source, json.dumps(payload), QUEUED, self.max_attempts, now, now),
+                )
+        if self._wakeup is not None:
+            # Usually called from a worker thread; the event belongs to the workers' loop
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        return job_id
+
+    def get_job(self, job_id: str) -> dict | None:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _row_to_job(row) if row else None
+
+    def list_jobs(self, kb_id: str, limit: int = 50) -> list[dict]:
+        """
+        List the most recent jobs of a KB, newest first.
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM jobs WHERE kb_id = ? ORDER BY seq DESC LIMIT ?", (kb_id, limit)).fetchall()
+        return [_row_to_job(row) for row in rows]
+
+    # --- Worker side ---
+
+    def _update(self, job_id: str, **fields):
+        fields["heartbeat_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            with self._conn:
+                self._conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def _claim(self) -> dict | None:
+        """
+        Atomically take the next runnable job: the oldest queued job of a KB that has no job running.
+        Running jobs whose heartbeat expired (crashed process) are requeued first, or failed once they
+        have used up their attempts, so a job that kills its worker is not retried forever.
+        """
+        now = time.time()
+        with self._lock:
+            # IMMEDIATE takes the write lock up front so concurrent processes can't claim the same job
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                abandoned = self._conn.execute(
+                    "SELECT * FROM jobs WHERE status = ? AND heartbeat_at < ? AND attempts >= max_attempts",
+                    (RUNNING, now - self.lease),
+                ).fetchall()
+                self._conn.execute(
+                    """
+                    UPDATE jobs SET
+                        status = CASE WHEN attempts >= max_attempts THEN ? ELSE ? END,
+                        error = CASE WHEN attempts >= max_attempts THEN ? ELSE error END,
+                        finished_at = CASE WHEN attempts >= max_attempts THEN ? ELSE finished_at END,
+                        worker = NULL
+                    WHERE status = ? AND heartbeat_at < ?
+                    """,
+                    (FAILED, QUEUED, "Worker stopped responding (lease expired)", now, RUNNING, now - self.lease),
+                )
+                row = self._conn.execute(
+                    """
+                    SELECT * FROM jobs j
+                    WHERE j.status = ? AND j.available_at <= ?
+                      AND NOT EXISTS (SELECT 1 FROM jobs r WHERE r.kb_id = j.kb_id AND r.status = ?)
+                      AND NOT EXISTS (SELECT 1 FROM jobs e WHERE e.kb_id = j.kb_id AND e.status = ? AND e.seq < j.seq)
+                    ORDER BY j.seq LIMIT 1
+                    """,
+                    (QUEUED, now, RUNNING, QUEUED),
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1, started_at = ?, heartbeat_at = ?, error = NULL WHERE id = ?",
+                        (RUNNING, self.worker_name, now, now, row["id"]),
+                    )
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+        for expired in abandoned:
+            print(f"Job {expired['id']} ({expired['kind']}) failed permanently: worker stopped responding on attempt {expired['attempts']}")
+            INGEST_JOBS.inc(kind=expired["kind"], outcome="failed")
+            self._cleanup(_row_to_job(expired))
+        if row is None:
+            return None
+        job = _row_to_job(row)
+        job["attempts"] += 1
+        return job
+
+    async def _heartbeat(self, job_id: str):
+        while True:
+            await asyncio.sleep(max(self.lease / 3, 0.1))
+            await asyncio.to_thread(self._update, job_id)
+
+    async def run_one(self) -> bool:
+        """
+        Claim and execute a single job. Returns False when nothing was runnable.
+        """
+        job = await asyncio.to_thread(self._claim)
+        if job is None:
+            return False
+
+        handler = _handlers.get(job["kind"])
+        reporter = _JobReporter(self, job["id"])
+        token = _current_job.set(reporter)
+        heartbeat = asyncio.create_task(self._heartbeat(job["id"]))
+        try:
+            if handler is None:
+                raise ValueError(f"No handler registered for job kind '{job['kind']}'")
+            await handler(job["kb_id"], job["payload"])
+        except Exception as e:
+            timings = reporter.finish()
+            await reporter.drain()
+            self._observe(job, reporter, "retried" if job["attempts"] < job["max_attempts"] else "failed")
+            if job["attempts"] < job["max_attempts"]:
+                delay = self.retry_backoff * (2 ** (job["attempts"] - 1))
+                print(f"Job {job['id']} ({job['kind']}) failed on attempt {job['attempts']}, retrying in {delay:.1f}s: {e}")
+                await asyncio.to_thread(self._update, job["id"], status=QUEUED, worker=None, error=str(e), stage_timings=timings, available_at=time.time() + delay)
+            else:
+                print(f"Job {job['id']} ({job['kind']}) failed permanently: {e}")
+                await asyncio.to_thread(self._update, job["id"], status=FAILED, error=str(e), stage_timings=timings, finished_at=time.time())
+                self._cleanup(job)
+        else:
+            await reporter.drain()
+            await asyncio.to_thread(self._update, job["id"], status=SUCCEEDED, progress=1.0, stage=None, stage_timings=reporter.finish(), finished_at=time.time())
+            self._observe(job, reporter, "succeeded")
+            self._cleanup(job)
+        finally:
+            heartbeat.cancel()
+            _current_job.reset(token)
+        return True
+
+    def _observe(self, job: dict, reporter: "_JobReporter", outcome: str):
+        INGEST_JOBS.inc(kind=job["kind"], outcome=outcome)
+        timings = dict(reporter.timings, total=time.perf_counter() - reporter.started)
+        observe_stages(INGEST_STAGE_SECONDS, timings, kb_id=job["kb_id"], kind=job["kind"])
+
+    def _cleanup(self, job: dict):
+        path = job["payload"].get("upload_path")
+        if path and os.path.exists(path):
+            os.remove(path)
+
+    async def _worker(self):
+        while True:
+            try:
+                if await self.run_one():
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Job worker error: {e}")
+            self._wakeup.clear()
+            try:
+                # Poll as well, for retries coming due and jobs submitted by other processes
+                await asyncio.wait_for(self._wakeup.wait(), timeout=settings.INGEST_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self):
+        """
+        Start the worker pool on the running event loop.
+        """
+        if self._tasks or self.workers <= 0:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """
+        Stop the workers. Interrupted jobs are picked up again after their lease expires.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._wakeup = None
+
+_queue = None
+
+def get_queue() -> JobQueue:
+    """
+    Get the process-wide ingestion job queue.
+    """
+    global _queue
+    if _queue is None:
+        _queue = JobQueue(
+            path=settings.JOBS_DB_PATH or default_path("jobs.sqlite3"),
+            uploads_dir=settings.UPLOADS_DIR or default_path("uploads"),
+            workers=settings.INGEST_WORKERS,
+            max_attempts=settings.INGEST_MAX_ATTEMPTS,
+            retry_backoff=settings.INGEST_RETRY_BACKOFF,
+            lease=settings.INGEST_JOB_LEASE,
+        )
+    return _queue
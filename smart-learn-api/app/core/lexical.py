@@ -0,0 +1,225 @@
+"""
+Per-KB BM25 inverted index over chunk text.
+
+Postings are kept in SQLite and maintained incrementally as chunks are added and deleted, so
+exact-term queries (names, formulas, codes) can be answered without an embedding call and
+fused with vector results.
+
+Build the index of an existing store with:
+    python -m app.core.lexical rebuild [--kb KB_ID]
+"""
+import re
+import sys
+import math
+import time
+import argparse
+import threading
+from collections import Counter
+from app.config import settings
+from app.utils.sqlite import connect, default_path
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS postings (
+    kb_id TEXT NOT NULL,
+    term TEXT NOT NULL,
+    chunk_id TEXT NOT NULL,
+    tf INTEGER NOT NULL,
+    PRIMARY KEY (kb_id, term, chunk_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_postings_chunk ON postings (kb_id, chunk_id);
+CREATE TABLE IF NOT EXISTS chunk_lengths (
+    kb_id TEXT NOT NULL,
+    chunk_id TEXT NOT NULL,
+    source TEXT,
+    length INTEGER NOT NULL,
+    PRIMARY KEY (kb_id, chunk_id)
+);
+CREATE INDEX IF NOT EXISTS idx_chunk_lengths_source ON chunk_lengths (kb_id, source);
+CREATE TABLE IF NOT EXISTS kb_stats (
+    kb_id TEXT PRIMARY KEY,
+    chunk_count INTEGER NOT NULL DEFAULT 0,
+    total_length INTEGER NOT NULL DEFAULT 0,
+    indexed_at REAL NOT NULL
+);
+"""
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Words plus compounds such as "e=mc2", "h2o", "covid-19" or "3.14" (indexed whole and by part)
+_TOKEN_RE = re.compile(r"\w+(?:[-.+^/=]\w+)*")
+_STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have he her his i if in into is it its of on or she so "
+    "that the their them then there these they this to was we were what when where which who why will with you your".split()
+)
+
+_lock = threading.Lock()
+_conn = None
+
+def _get_conn():
+    global _conn
+    if _conn is None:
+        _conn = connect(settings.LEXICAL_DB_PATH or default_path("lexical.sqlite3"))
+        _conn.executescript(_SCHEMA)
+    return _conn
+
+def tokenize(text: str) -> list[str]:
+    """
+    Lowercased index terms of a text, without stopwords.
+    """
+    terms = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token not in _STOPWORDS:
+            terms.append(token)
+        if not token.isalnum():
+            terms.extend(part for part in re.findall(r"\w+", token) if part not in _STOPWORDS)
+    return terms
+
+def _index(conn, kb_id: str, ids: list[str], documents: list[str], metadatas: list[dict]) -> tuple[int, int]:
+    postings, lengths = [], []
+    for chunk_id, doc, meta in zip(ids, documents, metadatas):
+        counts = Counter(tokenize(doc or ""))
+        length = sum(counts.values())
+        lengths.append((kb_id, chunk_id, (meta or {}).get("source"), length))
+        postings.extend((kb_id, term, chunk_id, tf) for term, tf in counts.items())
+    conn.executemany("INSERT OR REPLACE INTO chunk_lengths (kb_id, chunk_id, source, length) VALUES (?, ?, ?, ?)", lengths)
+    conn.executemany("INSERT OR REPLACE INTO postings (kb_id, term, chunk_id, tf) VALUES (?, ?, ?, ?)", postings)
+    return len(lengths), sum(length for *_, length in lengths)
+
+def _remove(conn, kb_id: str, ids: list[str]):
+    for start in range(0, len(ids), 500):
+        batch = ids[start:start + 500]
+        marks = ",".join("?" * len(batch))
+        count, length = conn.execute(
+            f"SELECT COUNT(*), COALESCE(SUM(length), 0) FROM chunk_lengths WHERE kb_id = ? AND chunk_id IN ({marks})", (kb_id, *batch)
+        ).fetchone()
+        conn.execute(f"DELETE FROM chunk_lengths WHERE kb_id = ? AND chunk_id IN ({marks})", (kb_id, *batch))
+        conn.execute(f"DELETE FROM postings WHERE kb_id = ? AND chunk_id IN ({marks})", (kb_id, *batch))
+        conn.execute(
+            "UPDATE kb_stats SET chunk_count = MAX(chunk_count - ?, 0), total_length = MAX(total_length - ?, 0) WHERE kb_id = ?",
+            (count, length, kb_id),
+        )
+
+def index_chunks(kb_id: str, ids: list[str], documents: list[str], metadatas: list[dict]):
+    """
+    Add newly stored chunks to the index of a KB. Re-indexing an existing chunk ID replaces it.
+    """
+    with _lock:
+        conn = _get_conn()
+        with conn:
+            _remove(conn, kb_id, ids)
+            count, length = _index(conn, kb_id, ids, documents, metadatas)
+            conn.execute(
+                "UPDATE kb_stats SET chunk_count = chunk_count + ?, total_length = total_length + ? WHERE kb_id = ?",
+                (count, length, kb_id),
+            )
+
+def remove_chunks(kb_id: str, ids: list[str]):
+    """
+    Prune deleted chunks from the index.
+    """
+    with _lock:
+        conn = _get_conn()
+        with conn:
+            _remove(conn, kb_id, ids)
+
+def remove_source(kb_id: str, source: str):
+    """
+    Prune every chunk of a deleted document from the index.
+    """
+    with _lock:
+        conn = _get_conn()
+        ids = [row[0] for row in conn.execute("SELECT chunk_id FROM chunk_lengths WHERE kb_id = ? AND source = ?", (kb_id, source))]
+        with conn:
+            _remove(conn, kb_id, ids)
+
+def drop_knowledge_base(kb_id: str):
+    with _lock:
+        conn = _get_conn()
+        with conn:
+            for table in ("postings", "chunk_lengths", "kb_stats"):
+                conn.execute(f"DELETE FROM {table} WHERE kb_id = ?", (kb_id,))
+
+def replace_knowledge_base(kb_id: str, pages):
+    """
+    Rebuild the index of a KB from (ids, documents, metadatas) pages covering all of its chunks.
+    """
+    with _lock:
+        conn = _get_conn()
+        with conn:
+            for table in ("postings", "chunk_lengths", "kb_stats"):
+                conn.execute(f"DELETE FROM {table} WHERE kb_id = ?", (kb_id,))
+            count, length = 0, 0
+            for ids, documents, metadatas in pages:
+                added, added_length = _index(conn, kb_id, ids, documents, metadatas)
+                count, length = count + added, length + added_length
+            conn.execute(
+                "INSERT INTO kb_stats (kb_id, chunk_count, total_length, indexed_at) VALUES (?, ?, ?, ?)",
+                (kb_id, count, length, time.time()),
+            )
+
+def is_indexed(kb_id: str) -> bool:
+    """
+    Check whether the index of a KB has been built from its chunks at least once.
+    """
+    with _lock:
+        row = _get_conn().execute("SELECT 1 FROM kb_stats WHERE kb_id = ?", (kb_id,)).fetchone()
+    return row is not None
+
+def search(kb_id: str, query: str, n_results: int = 5) -> list[tuple[str, float]]:
+    """
+    Rank the chunks of a KB against a query with BM25. Returns (chunk_id, score) pairs, best first.
+    """
+    terms = sorted(set(tokenize(query)))
+    if not terms:
+        return []
+    with _lock:
+        conn = _get_conn()
+        stats = conn.execute("SELECT chunk_count, total_length FROM kb_stats WHERE kb_id = ?", (kb_id,)).fetchone()
+        if stats is None or not stats["chunk_count"]:
+            return []
+        rows = conn.execute(
+            f"""
+            SELECT p.term, p.chunk_id, p.tf, l.length FROM postings p
+            JOIN chunk_lengths l ON l.kb_id = p.kb_id AND l.chunk_id = p.chunk_id
+            WHERE p.kb_id = ? AND p.term IN ({','.join('?' * len(terms))})
+            """,
+            (kb_id, *terms),
+        ).fetchall()
+
+    total, avg_length = stats["chunk_count"], max(stats["total_length"] / stats["chunk_count"], 1.0)
+    df = Counter(row["term"] for row in rows)
+    scores = Counter()
+    for row in rows:
+        idf = math.log(1 + (total - df[row["term"]] + 0.5) / (df[row["term"]] + 0.5))
+        tf = row["tf"]
+        scores[row["chunk_id"]] += idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * row["length"] / avg_length))
+    return scores.most_common(n_results)
+
+def reciprocal_rank_fusion(rankings: list[list[str]], k: int = 60, limit: int = 5) -> list[str]:
+    """
+    Merge ranked lists of keys: each key scores sum(1 / (k + rank)) over the lists it appears in.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)[:limit]
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Maintain the BM25 lexical index.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rebuild = sub.add_parser("rebuild", help="Rebuild the index from the stored chunks")
+    rebuild.add_argument("--kb", dest="kb_id", help="Only rebuild this knowledge base")
+    args = parser.parse_args(argv)
+
+    from app.core.database import list_kb_ids, rebuild_lexical_index
+
+    kb_ids = [args.kb_id] if args.kb_id else list_kb_ids()
+    for kb_id in kb_ids:
+        count = rebuild_lexical_index(kb_id)
+        print(f"Rebuilt lexical index for KB {kb_id}: {count} chunks")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,34 +1,76 @@
+from typing import AsyncIterator
 from openai import AsyncOpenAI
 from app.config import settings
 
 client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
 
-async def generate_response(context: str, query: str, system_instruction: str = "You are a helpful assistant.", history: list = None) -> str:
+ERROR_PREFIX = "Error generating response:"
+
+class LLMStreamError(Exception):
+    """
+    A streamed completion failed; tokens already yielded are an incomplete answer.
+    """
+
+def _build_messages(context: str, query: str, system_instruction: str, history: list = None) -> list[dict]:
+    messages = [{"role": "system", "content": system_instruction}]
+    
+    # Add history if provided
+    if history:
+        for msg in history:
+            messages.append({"role": msg["role"], "content": msg["content"]})
+    
+    # Add current context and query
+    if context.strip():
+        user_content = f"Context for this question:\n{context}\n\nQuestion: {query}"
+    else:
+        user_content = query
+        
+    messages.append({"role": "user", "content": user_content})
+    return messages
+
+def _cache_options(cache_key: str | None) -> dict:
+    # Requests sharing a key are routed to the same prompt cache, so a KB's stable system prompt is reused
+    return {"prompt_cache_key": cache_key} if cache_key else {}
+
+async def generate_response(context: str, query: str, system_instruction: str = "You are a helpful assistant.", history: list = None, cache_key: str | None = None) -> str:
     """
     Generate a response from the LLM based on context, query, and history.
     """
     try:
-        messages = [{"role": "system", "content": system_instruction}]
-        
-        # Add history if provided
-        if history:
-            for msg in history:
-                messages.append({"role": msg["role"], "content": msg["content"]})
-        
-        # Add current context and query
-        if context.strip():
-            user_content = f"Context for this question:\n{context}\n\nQuestion: {query}"
-        else:
-            user_content = query
-            
-        messages.append({"role": "user", "content": user_content})
+        messages = _build_messages(context, query, system_instruction, history)
 
         response = await client.chat.completions.create(
             model=settings.LLM_MODEL,
             messages=messages,
             max_tokens=100,
-            temperature=0.7
+            temperature=0.7,
+            **_cache_options(cache_key)
         )
         return response.choices[0].message.content
     except Exception as e:
-        return f"Error generating response: {str(e)}"
+        return f"{ERROR_PREFIX} {str(e)}"
+
+async def generate_response_stream(context: str, query: str, system_instruction: str = "You are a helpful assistant.", history: list = None, cache_key: str | None = None) -> AsyncIterator[str]:
+    """
+    Stream a response from the LLM token by token as the completion is generated.
+    Failures raise LLMStreamError (possibly after some tokens) instead of being yielded as text.
+    """
+    try:
+        messages = _build_messages(context, query, system_instruction, history)
+
+        stream = await client.chat.completions.create(
+            model=settings.LLM_MODEL,
+            messages=messages,
+            max_tokens=100,
+            temperature=0.7,
+            stream=True,
+            **_cache_options(cache_key)
+        )
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            token = chunk.choices[0].delta.content
+            if token:
+                yield token
+    except Exception as e:
+        raise LLMStreamError(f"{ERROR_PREFIX} {str(e)}") from e
@@ -0,0 +1,124 @@
+"""
+Prometheus metrics, rendered in the text exposition format at GET /metrics.
+
+Kept dependency-free: histograms and counters are plain in-process structures, and collectors
+registered with register_collector report counters that other components already keep (cache
+hit/miss counts) at scrape time. With several uvicorn workers each worker reports its own series.
+"""
+import math
+import threading
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+_lock = threading.Lock()
+_metrics = []
+_collectors = []
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}  # {label values: count}
+        _metrics.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(dict(zip(self.labelnames, key)))} {_format_value(value)}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets) + (math.inf,)
+        self._series = {}  # {label values: [bucket counts..., sum, count]}
+        _metrics.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with _lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self._series.items()):
+            labels = dict(zip(self.labelnames, key))
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': _format_value(bound)})} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {series[-1]}")
+        return lines
+
+def register_collector(collect):
+    """
+    Register a callable returning [(name, type, documentation, [(labels, value)])] evaluated at every scrape.
+    """
+    _collectors.append(collect)
+
+def render() -> str:
+    """
+    All metrics in the Prometheus text exposition format.
+    """
+    lines = []
+    with _lock:
+        for metric in _metrics:
+            lines.extend(metric.render())
+    for collect in _collectors:
+        try:
+            families = collect()
+        except Exception as e:
+            print(f"Metrics collector {getattr(collect, '__name__', collect)} failed: {e}")
+            continue
+        for name, kind, documentation, samples in families:
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(f"{name}{_format_labels(labels)} {_format_value(value)}" for labels, value in samples)
+    return "\n".join(lines) + "\n"
+
+QUERY_STAGE_SECONDS = Histogram(
+    "smart_learn_query_stage_seconds",
+    "Time spent in each stage of answering a query (embedding, lexical, retrieval, answer_cache, prompt, llm, total).",
+    ("kb_id", "stage"),
+)
+INGEST_STAGE_SECONDS = Histogram(
+    "smart_learn_ingest_stage_seconds",
+    "Time spent in each stage of an ingestion job (extract, chunk, embed, store, total).",
+    ("kb_id", "kind", "stage"),
+)
+INGEST_JOBS = Counter("smart_learn_ingest_jobs_total", "Ingestion job attempts by outcome (succeeded, retried, failed).", ("kind", "outcome"))
+CACHE_REQUESTS = Counter("smart_learn_cache_requests_total", "Cache lookups by cache and result (hit, miss).", ("cache", "result"))
+
+def observe_stages(histogram: Histogram, timings: dict, **labels):
+    """
+    Record a {stage: seconds} breakdown in a per-stage histogram.
+    """
+    for stage, seconds in timings.items():
+        histogram.observe(seconds, stage=stage, **labels)
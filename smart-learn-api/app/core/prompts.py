@@ -0,0 +1,133 @@
+"""
+Compiled system prompts.
+
+The system instruction of a KB depends only on its metadata and document list, so it is rendered
+once per KB profile (see database.get_kb_profile) instead of on every query, and recompiled when
+the profile is rebuilt after metadata or document changes. Keeping it byte-identical between
+queries also lets the provider's prompt caching reuse the prefix.
+"""
+import threading
+from typing import NamedTuple
+from app.core.database import get_kb_profile
+
+class CompiledPrompt(NamedTuple):
+    with_context: str  # Used when retrieval found context for the query
+    without_context: str
+
+    def render(self, has_context: bool) -> str:
+        return self.with_context if has_context else self.without_context
+
+def compile_system_instruction(profile: dict, has_context: bool) -> str:
+    """
+    Render the system instruction of a KB from its profile.
+    """
+    metadata = profile["metadata"]
+    kb_name = metadata.get("name", "Knowledge Base")
+    assistant_name = metadata.get("assistant_name", kb_name)
+    
+    # Robust boolean check (handles bool, int 0/1, or string "true"/"false")
+    raw_enabled = metadata.get("custom_instruction", False)
+    custom_instruction_enabled = str(raw_enabled).lower() in ["true", "1", "t", "yes", "y"] if not isinstance(raw_enabled, bool) else raw_enabled
+    custom_instruction_text = metadata.get("instruction", "")
+    
+    # Check if the KB has ANY documents at all
+    kb_has_data = profile["chunk_count"] > 0
+
+    # Clean document names for identity/intro summary
+    raw_docs = profile["documents"]
+    cleaned_docs = []
+    for d in raw_docs:
+        # 1. Handle URLs (specifically Wikipedia)
+        if d.startswith("http"):
+            # Take last part of path, replace underscores/dashes with spaces, title case
+            clean_name = d.split("/")[-1].replace("_", " ").replace("-", " ")
+        else:
+            # 2. Handle filenames (remove extensions)
+            clean_name = d.rsplit(".", 1)[0] if "." in d else d
+        
+        if clean_name.strip():
+            cleaned_docs.append(clean_name.strip())
+
+    if len(cleaned_docs) > 1:
+        doc_summary = ", ".join(cleaned_docs[:-1]) + " and " + cleaned_docs[-1]
+    elif len(cleaned_docs) == 1:
+        doc_summary = cleaned_docs[0]
+    else:
+        doc_summary = "general topics"
+
+    # Determine system instruction
+    if custom_instruction_enabled and custom_instruction_text.strip():
+        # Replace placeholders like {assistant_name} and {kb_name} to make instructions dynamic
+        system_instruction = custom_instruction_text.replace("{assistant_name}", assistant_name).replace("{kb_name}", kb_name)
+        
+        # Grounding Logic:
+        # 1. If KB has data: Enforce strict grounding (use context or decline)
+        # 2. If KB is empty: Let the AI speak freely based on the custom instruction personality
+        if kb_has_data:
+            if has_context:
+                system_instruction += f"\n\nIMPORTANT: Use the provided context from the '{kb_name}' knowledge base to answer. Avoid using outside knowledge. If the answer is not in the context, politely say you don't have that specific information."
+            else:
+                system_instruction += f"\n\nIMPORTANT: The user is asking about a topic not found in the '{kb_name}' knowledge base. Politely explain that you can only answer questions based on the provided documents ({doc_summary}) and suggest what topics YOU CAN help with."
+    else:
+        # Default instruction
+        if not kb_has_data:
+            # KB is empty - allow free-roaming helpful assistant
+            system_instruction = f"""You are {assistant_name}, a helpful, polite, and friendly AI assistant.
+            Your tone should be warm, professional, and conversational.
+            If asked who you are, introduce yourself as {assistant_name} and mention you are ready to help once documents are added to the '{kb_name}'.
+            """
+        else:
+            # KB has data - enforce grounding and identity
+            system_instruction = f"""You are {assistant_name}, the {kb_name} assistant. 
+            I have specific knowledge about: {doc_summary}.
+            
+            IDENTITY GUIDELINES:
+            If the user asks "Who are you?" or "What is your name?", always respond naturally:
+            "I am {assistant_name}, your {kb_name} assistant. I have knowledge about {doc_summary}."
+            
+            Your tone should be warm, professional, and conversational.
+            
+            GROUNDING RULES:
+            1. Answer questions ONLY using the information provided in the context from the '{kb_name}'.
+            2. If context is provided, give a clear, concise answer based strictly on that context.
+            3. If context is NOT relevant, politely explain that your current knowledge is limited to {doc_summary} and suggest those topics.
+
+            NEVER use outside knowledge to answer if documents have been provided.
+            """
+
+    # Append conversation-type-specific behavior from KB metadata
+    ct = metadata.get("conversation_types") or []
+    extras = []
+    if "Q&A" in ct:
+        extras.append("Answer in a direct, concise Q&A style. Prioritize clarity and brevity.")
+    if "Follow-up Question" in ct:
+        extras.append("Support follow-up questions (e.g. 'Can you elaborate?', 'What about X?'). Keep conversation context in mind and welcome follow-ups.")
+    if "Revision Mode" in ct:
+        extras.append("If the user requests a revision, rephrasing, or says 'Actually I meant...', provide an updated answer willingly and without repeating the old one at length.")
+    if extras:
+        system_instruction = (system_instruction.rstrip() + "\n\nConversation behavior:\n" + "\n".join("- " + e for e in extras) + "\n")
+
+    # Final constraint: brevity (for small device screens)
+    system_instruction += "\n\nIMPORTANT: Keep your response extremely short and concise (less than 200 characters)."
+
+    return system_instruction
+
+def compile_prompt(profile: dict) -> CompiledPrompt:
+    return CompiledPrompt(compile_system_instruction(profile, True), compile_system_instruction(profile, False))
+
+_lock = threading.Lock()
+_compiled = {}  # {kb_id: (profile, CompiledPrompt)}
+
+def get_compiled_prompt(kb_id: str) -> CompiledPrompt:
+    """
+    Get the compiled system prompt of a KB, recompiling it only when the KB profile was rebuilt.
+    """
+    profile = get_kb_profile(kb_id)
+    with _lock:
+        cached = _compiled.get(kb_id)
+    if cached is not None and cached[0] is profile:
+        return cached[1]
+    compiled = compile_prompt(profile)
+    with _lock:
+        _compiled[kb_id] = (profile, compiled)
+    return compiled
@@ -0,0 +1,212 @@
+"""
+Per-KB source document registry.
+
+Keeps one row per ingested document (source, chunk count, byte size, ingest time, content hash)
+so listing documents and counting them never has to scan every chunk in ChromaDB, and a per-KB
+generation bumped on every change, so per-process caches of other workers notice it.
+
+Rebuild an existing store from its chunks with:
+    python -m app.core.registry rebuild [--kb KB_ID]
+"""
+import sys
+import time
+import argparse
+import threading
+from app.config import settings
+from app.utils.sqlite import connect, default_path
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    kb_id TEXT NOT NULL,
+    source TEXT NOT NULL,
+    chunk_count INTEGER NOT NULL DEFAULT 0,
+    byte_size INTEGER NOT NULL DEFAULT 0,
+    content_hash TEXT,
+    ingested_at REAL NOT NULL,
+    PRIMARY KEY (kb_id, source)
+);
+CREATE TABLE IF NOT EXISTS indexed_kbs (
+    kb_id TEXT PRIMARY KEY,
+    indexed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS kb_generations (
+    kb_id TEXT PRIMARY KEY,
+    generation INTEGER NOT NULL
+);
+"""
+
+_lock = threading.Lock()
+_conn = None
+
+def _get_conn():
+    global _conn
+    if _conn is None:
+        _conn = connect(settings.REGISTRY_DB_PATH or default_path("registry.sqlite3"))
+        _conn.executescript(_SCHEMA)
+    return _conn
+
+def _summarize_chunks(documents: list[str], metadatas: list[dict]) -> dict:
+    """
+    Aggregate chunks into {source: {"chunk_count", "byte_size", "content_hash"}}.
+    """
+    summary = {}
+    for doc, meta in zip(documents, metadatas):
+        if not meta or "source" not in meta:
+            continue
+        entry = summary.setdefault(meta["source"], {"chunk_count": 0, "byte_size": 0, "content_hash": None})
+        entry["chunk_count"] += 1
+        entry["byte_size"] += len((doc or "").encode("utf-8"))
+        if meta.get("content_hash"):
+            entry["content_hash"] = meta["content_hash"]
+    return summary
+
+def record_chunks(kb_id: str, documents: list[str], metadatas: list[dict]):
+    """
+    Account newly stored chunks to their source documents.
+    """
+    summary = _summarize_chunks(documents, metadatas)
+    if not summary:
+        return
+    now = time.time()
+    with _lock:
+        conn = _get_conn()
+        with conn:
+            for source, entry in summary.items():
+                conn.execute(
+                    """
+                    INSERT INTO documents (kb_id, source, chunk_count, byte_size, content_hash, ingested_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (kb_id, source) DO UPDATE SET
+                        chunk_count = chunk_count + excluded.chunk_count,
+                        byte_size = byte_size + excluded.byte_size,
+                        content_hash = COALESCE(excluded.content_hash, content_hash),
+                        ingested_at = excluded.ingested_at
+                    """,
+                    (kb_id, source, entry["chunk_count"], entry["byte_size"], entry["content_hash"], now),
+                )
+
+def set_document(kb_id: str, source: str, chunk_count: int, byte_size: int, content_hash: str | None):
+    """
+    Record the current version of a document, replacing any previous record.
+    """
+    with _lock:
+        conn = _get_conn()
+        with conn:
+            if chunk_count:
+                conn.execute(
+                    "INSERT OR REPLACE INTO documents (kb_id, source, chunk_count, byte_size, content_hash, ingested_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (kb_id, source, chunk_count, byte_size, content_hash, time.time()),
+                )
+            else:
+                conn.execute("DELETE FROM documents WHERE kb_id = ? AND source = ?", (kb_id, source))
+
+def remove_document(kb_id: str, source: str):
+    """
+    Forget a document after its chunks were deleted.
+    """
+    with _lock:
+        conn = _get_conn()
+        with conn:
+            conn.execute("DELETE FROM documents WHERE kb_id = ? AND source = ?", (kb_id, source))
+
+def drop_knowledge_base(kb_id: str):
+    """
+    Forget every document of a deleted knowledge base.
+    """
+    with _lock:
+        conn = _get_conn()
+        with conn:
+            conn.execute("DELETE FROM documents WHERE kb_id = ?", (kb_id,))
+            conn.execute("DELETE FROM indexed_kbs WHERE kb_id = ?", (kb_id,))
+
+def bump_generation(kb_id: str) -> int:
+    """
+    Record a change to a KB's documents or metadata. Returns the new generation.
+    """
+    with _lock:
+        conn = _get_conn()
+        with conn:
+            conn.execute(
+                "INSERT INTO kb_generations (kb_id, generation) VALUES (?, 1) "
+                "ON CONFLICT (kb_id) DO UPDATE SET generation = generation + 1",
+                (kb_id,),
+            )
+            return conn.execute("SELECT generation FROM kb_generations WHERE kb_id = ?", (kb_id,)).fetchone()["generation"]
+
+def get_generation(kb_id: str) -> int:
+    """
+    Number of changes to a KB so far (0 for a KB never changed), shared by every worker.
+    """
+    with _lock:
+        row = _get_conn().execute("SELECT generation FROM kb_generations WHERE kb_id = ?", (kb_id,)).fetchone()
+    return row["generation"] if row else 0
+
+def replace_knowledge_base(kb_id: str, documents: list[str], metadatas: list[dict]):
+    """
+    Replace the registry of a KB with the documents derived from all of its chunks.
+    """
+    summary = _summarize_chunks(documents, metadatas)
+    now = time.time()
+    with _lock:
+        conn = _get_conn()
+        with conn:
+            conn.execute("DELETE FROM documents WHERE kb_id = ?", (kb_id,))
+            conn.executemany(
+                "INSERT INTO documents (kb_id, source, chunk_count, byte_size, content_hash, ingested_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [(kb_id, source, e["chunk_count"], e["byte_size"], e["content_hash"], now) for source, e in summary.items()],
+            )
+            conn.execute("INSERT OR REPLACE INTO indexed_kbs (kb_id, indexed_at) VALUES (?, ?)", (kb_id, now))
+
+def is_indexed(kb_id: str) -> bool:
+    """
+    Check whether the registry of a KB has been built from its chunks at least once.
+    """
+    with _lock:
+        row = _get_conn().execute("SELECT 1 FROM indexed_kbs WHERE kb_id = ?", (kb_id,)).fetchone()
+    return row is not None
+
+def list_sources(kb_id: str) -> list[str]:
+    """
+    List the sources of all documents in a KB, oldest first.
+    """
+    with _lock:
+        rows = _get_conn().execute(
+            "SELECT source FROM documents WHERE kb_id = ? ORDER BY ingested_at, source", (kb_id,)
+        ).fetchall()
+    return [row["source"] for row in rows]
+
+def list_records(kb_id: str) -> list[dict]:
+    """
+    List the full registry records of a KB, oldest first.
+    """
+    with _lock:
+        rows = _get_conn().execute(
+            "SELECT source, chunk_count, byte_size, content_hash, ingested_at FROM documents WHERE kb_id = ? ORDER BY ingested_at, source",
+            (kb_id,),
+        ).fetchall()
+    return [dict(row) for row in rows]
+
+def document_counts() -> dict[str, int]:
+    """
+    Count documents per KB in a single pass over the registry.
+    """
+    with _lock:
+        rows = _get_conn().execute("SELECT kb_id, COUNT(*) AS n FROM documents GROUP BY kb_id").fetchall()
+    return {row["kb_id"]: row["n"] for row in rows}
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Maintain the source document registry.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rebuild = sub.add_parser("rebuild", help="Rebuild the registry from the chunks stored in ChromaDB")
+    rebuild.add_argument("--kb", dest="kb_id", help="Only rebuild this knowledge base")
+    args = parser.parse_args(argv)
+
+    from app.core.database import list_kb_ids, rebuild_document_registry
+
+    kb_ids = [args.kb_id] if args.kb_id else list_kb_ids()
+    for kb_id in kb_ids:
+        count = rebuild_document_registry(kb_id)
+        print(f"Rebuilt registry for KB {kb_id}: {count} documents")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,728 @@
+"""
+Pluggable storage for KB chunks (text, metadata and embeddings).
+
+Two backends implement the same interface:
+- ChromaVectorStore: one ChromaDB collection per KB (the default).
+- LocalVectorStore: each KB's embeddings in a memory-mapped matrix next to a SQLite table of
+  chunk text and metadata. Small KBs are searched by vectorized brute force; KBs with at least
+  LOCAL_HNSW_THRESHOLD chunks use an HNSW graph when hnswlib is installed, built in a background thread
+  while queries keep using brute force. Vectors can be stored quantized (float16/int8, optionally
+  truncated) with full-precision re-ranking of the top candidates. Row state is kept per process, so
+  only one process may open a directory: a second one (e.g. another uvicorn worker) is refused.
+
+Report recall of quantized KBs against full precision with:
+    python -m app.core.vector_store recall [--kb KB_ID]
+
+Results use the ChromaDB shape ({"ids": [[...]], "documents": [[...]], ...}) whichever backend is used.
+"""
+import os
+import sys
+import json
+import argparse
+import threading
+from abc import ABC, abstractmethod
+import numpy as np
+from chromadb.errors import NotFoundError
+from app.config import settings
+from app.utils.sqlite import connect, default_path
+
+try:
+    import hnswlib
+except ImportError:  # optional: pip install hnswlib
+    hnswlib = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: the one-process check is skipped
+    fcntl = None
+
+class VectorStore(ABC):
+    """
+    Interface of a chunk store. Every method takes the KB ID; KBs are created implicitly on first add.
+    Adding a chunk under an existing ID replaces it.
+    """
+
+    @abstractmethod
+    def add(self, kb_id: str, ids: list[str], documents: list[str], embeddings: list[list[float]], metadatas: list[dict]):
+        raise NotImplementedError
+
+    @abstractmethod
+    def query(self, kb_id: str, embedding: list[float], n_results: int = 5) -> dict:
+        """
+        Nearest chunks as {"ids", "documents", "metadatas", "distances"}, each a list holding one list of results.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get(self, kb_id: str, source: str | None = None, include: tuple = ("documents", "metadatas"),
+            limit: int | None = None, offset: int = 0, ids: list[str] | None = None) -> dict:
+        """
+        Stored chunks (optionally of one source, or with the given IDs) as {"ids", "documents"?, "metadatas"?}.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_metadatas(self, kb_id: str, ids: list[str], metadatas: list[dict]):
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete(self, kb_id: str, ids: list[str] | None = None, source: str | None = None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def count(self, kb_id: str) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def drop(self, kb_id: str):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class ChromaVectorStore(VectorStore):
+    def __init__(self, client):
+        self.client = client
+
+    def _collection(self, kb_id: str):
+        return self.client.get_or_create_collection(name=f"kb_{kb_id}")
+
+    def add(self, kb_id, ids, documents, embeddings, metadatas):
+        self._collection(kb_id).upsert(ids=ids, documents=documents, embeddings=embeddings, metadatas=metadatas)
+
+    def query(self, kb_id, embedding, n_results=5):
+        return self._collection(kb_id).query(query_embeddings=[embedding], n_results=n_results)
+
+    def get(self, kb_id, source=None, include=("documents", "metadatas"), limit=None, offset=0, ids=None):
+        where = {"source": source} if source is not None else None
+        return self._collection(kb_id).get(ids=ids, where=where, include=list(include), limit=limit, offset=offset or None)
+
+    def update_metadatas(self, kb_id, ids, metadatas):
+        self._collection(kb_id).update(ids=ids, metadatas=metadatas)
+
+    def delete(self, kb_id, ids=None, source=None):
+        if ids is not None:
+            self._collection(kb_id).delete(ids=ids)
+        elif source is not None:
+            self._collection(kb_id).delete(where={"source": source})
+
+    def count(self, kb_id):
+        return self._collection(kb_id).count()
+
+    def drop(self, kb_id):
+        try:
+            self.client.delete_collection(name=f"kb_{kb_id}")
+        except (NotFoundError, ValueError):
+            pass  # Collection doesn't exist (chromadb < 0.6 raises ValueError)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    kb_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    row INTEGER NOT NULL,
+    source TEXT,
+    document TEXT,
+    metadata TEXT NOT NULL DEFAULT '{}',
+    PRIMARY KEY (kb_id, id)
+);
+CREATE INDEX IF NOT EXISTS idx_chunks_row ON chunks (kb_id, row);
+CREATE INDEX IF NOT EXISTS idx_chunks_source ON chunks (kb_id, source);
+CREATE TABLE IF NOT EXISTS matrices (
+    kb_id TEXT PRIMARY KEY,
+    dims INTEGER NOT NULL,
+    dtype TEXT NOT NULL,
+    store_dims INTEGER,
+    rerank INTEGER NOT NULL DEFAULT 0,
+    rows INTEGER NOT NULL DEFAULT 0,
+    version INTEGER NOT NULL DEFAULT 0,
+    hnsw_version INTEGER
+);
+"""
+
+# Columns added after the first release of the local store: {column: definition}
+_MATRIX_COLUMNS = {"store_dims": "INTEGER", "rerank": "INTEGER NOT NULL DEFAULT 0"}
+
+# Rows copied per block when compacting or building HNSW
+_SCAN_BLOCK = 65536
+# Values decoded to float32 per block during brute-force search (keeps the working set cache-sized)
+_SCAN_ELEMENTS = 1 << 22
+
+DTYPES = ("float32", "float16", "int8")
+
+def _normalize(vectors) -> np.ndarray:
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+class _Mapped:
+    """
+    Growable memory-mapped array of rows (width 0 for a 1-D array of scalars).
+    """
+
+    def __init__(self, path: str, dtype, width: int, capacity: int):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.width = width
+        self.array = self._map(capacity)
+
+    def _map(self, capacity: int) -> np.memmap:
+        size = capacity * max(self.width, 1) * self.dtype.itemsize
+        with open(self.path, "ab") as f:
+            if f.tell() < size:
+                f.truncate(size)
+        shape = (capacity, self.width) if self.width else (capacity,)
+        return np.memmap(self.path, dtype=self.dtype, mode="r+", shape=shape)
+
+    def grow(self, capacity: int):
+        self.array.flush()
+        # Growing the file keeps the old mapping valid for readers still holding it
+        self.array = self._map(capacity)
+
+    def keep(self, rows: np.ndarray, capacity: int):
+        """
+        Rewrite the file with only the given rows, in order.
+        """
+        tmp_path = self.path + ".tmp"
+        shape = (max(len(rows), 1), self.width) if self.width else (max(len(rows), 1),)
+        compacted = np.memmap(tmp_path, dtype=self.dtype, mode="w+", shape=shape)
+        for start in range(0, len(rows), _SCAN_BLOCK):
+            block = rows[start:start + _SCAN_BLOCK]
+            compacted[start:start + len(block)] = self.array[block]
+        compacted.flush()
+        del compacted
+        os.replace(tmp_path, self.path)
+        self.array = self._map(capacity)
+
+class _KbMatrix:
+    """
+    In-memory state of one KB: the memory-mapped vectors, which rows are live, and the optional HNSW graph.
+
+    Vectors are searched in their compact form (float32/float16, or int8 with a scale per row, optionally
+    truncated to the first store_dims dimensions). With rerank, full float32 vectors are kept in a separate
+    file that is only read for the top candidates, so it stays out of memory during scans.
+    """
+
+    def __init__(self, prefix: str, dims: int, dtype: str, store_dims: int, rerank: bool, rows: int, live_rows: list[int]):
+        self.prefix = prefix
+        self.dims = dims
+        self.dtype = np.dtype(dtype)
+        self.store_dims = store_dims
+        self.rows = rows
+        self.capacity = max(rows, 1024)
+        self.compact = _Mapped(prefix + ".vec", dtype, store_dims, self.capacity)
+        self.scale = _Mapped(prefix + ".scale", np.float32, 0, self.capacity) if dtype == "int8" else None
+        self.full = _Mapped(prefix + ".full", np.float32, dims, self.capacity) if rerank else None
+        self.live = np.zeros(self.capacity, dtype=bool)
+        self.live[live_rows] = True
+        self.live_count = len(live_rows)
+        self.hnsw = None
+        self.epoch = 0  # bumped when rows are renumbered by compaction
+
+    def _files(self) -> list[_Mapped]:
+        return [m for m in (self.compact, self.scale, self.full) if m is not None]
+
+    def reserve(self, rows: int):
+        if rows <= self.capacity:
+            return
+        capacity = self.capacity
+        while capacity < rows:
+            capacity *= 2
+        for mapped in self._files():
+            mapped.grow(capacity)
+        live = np.zeros(capacity, dtype=bool)
+        live[:self.capacity] = self.live
+        self.live, self.capacity = live, capacity
+
+    def flush(self):
+        for mapped in self._files():
+            mapped.array.flush()
+
+    def keep(self, rows: np.ndarray):
+        self.capacity = max(len(rows), 1024)
+        for mapped in self._files():
+            mapped.keep(rows, self.capacity)
+        self.rows = self.live_count = len(rows)
+        self.live = np.zeros(self.capacity, dtype=bool)
+        self.live[:self.rows] = True
+
+    # --- Encoding ---
+
+    def prepare(self, vectors: np.ndarray) -> np.ndarray:
+        """
+        Project normalized full vectors to the searched space (Matryoshka truncation, re-normalized).
+        """
+        if self.store_dims < self.dims:
+            return _normalize(vectors[..., :self.store_dims])
+        return vectors
+
+    def write(self, start: int, vectors: np.ndarray):
+        stop = start + len(vectors)
+        compact = self.prepare(vectors)
+        if self.scale is not None:
+            # Symmetric int8 quantization with one scale per vector
+            scales = np.maximum(np.abs(compact).max(axis=1) / 127.0, 1e-12)
+            self.scale.array[start:stop] = scales
+            compact = np.round(compact / scales[:, None])
+        self.compact.array[start:stop] = compact
+        if self.full is not None:
+            self.full.array[start:stop] = vectors
+        self.flush()
+
+    def decode(self, start: int, stop: int) -> np.ndarray:
+        block = np.asarray(self.compact.array[start:stop], dtype=np.float32)
+        if self.scale is not None:
+            block *= self.scale.array[start:stop, None]
+        return block
+
+    # --- Search ---
+
+    def scan(self, query: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Brute-force top-k rows by similarity of the compact vectors, scoring the matrix block by block.
+        """
+        rows, live = self.rows, self.live
+        compact_query = self.prepare(query)
+        scores = np.empty(rows, dtype=np.float32)
+        block = max(_SCAN_ELEMENTS // self.store_dims, 1)
+        for start in range(0, rows, block):
+            stop = min(start + block, rows)
+            scores[start:stop] = np.asarray(self.compact.array[start:stop], dtype=np.float32) @ compact_query
+        if self.scale is not None:
+            scores *= self.scale.array[:rows]
+        scores[~live[:rows]] = -np.inf
+        k = min(k, self.live_count)
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return top, scores[top]
+
+    def rerank(self, query: np.ndarray, candidates: np.ndarray, n_results: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Re-score candidate rows with their full-precision vectors and keep the best n_results.
+        """
+        ordered = np.sort(candidates)  # ascending rows read the file sequentially
+        scores = np.asarray(self.full.array[ordered], dtype=np.float32) @ query
+        best = np.argsort(-scores)[:n_results]
+        return ordered[best], scores[best]
+
+# {directory: [lock file, open stores]} of the local stores opened by this process
+_claimed_roots = {}
+_claimed_lock = threading.Lock()
+
+def _claim_root(root: str):
+    """
+    Lock a store directory for this process. Each process keeps its own row state, so two processes
+    writing the same KB would overwrite each other's rows and miss each other's deletes.
+    """
+    if fcntl is None:
+        return
+    with _claimed_lock:
+        claim = _claimed_roots.get(root)
+        if claim is None:
+            lock_file = open(os.path.join(root, ".lock"), "a")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                raise RuntimeError(
+                    f"VECTOR_STORE=local: {root} is already open in another process. The local store supports a "
+                    "single process; run one uvicorn worker or use VECTOR_STORE=chroma"
+                )
+            claim = _claimed_roots[root] = [lock_file, 0]
+        claim[1] += 1
+
+def _release_root(root: str):
+    if fcntl is None:
+        return
+    with _claimed_lock:
+        claim = _claimed_roots.get(root)
+        if claim is None:
+            return
+        claim[1] -= 1
+        if claim[1] <= 0:
+            claim[0].close()  # releases the lock
+            del _claimed_roots[root]
+
+class LocalVectorStore(VectorStore):
+    def __init__(self, root: str, dtype: str = "float32", hnsw_threshold: int = 50_000, hnsw_ef: int = 64,
+                 dims: int | None = None, rerank_candidates: int = 50):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported vector dtype '{dtype}' (expected one of {', '.join(DTYPES)})")
+        os.makedirs(root, exist_ok=True)
+        _claim_root(os.path.realpath(root))
+        self.root = root
+        self.dtype = dtype
+        self.dims = dims
+        self.rerank_candidates = rerank_candidates
+        self.hnsw_threshold = hnsw_threshold
+        self.hnsw_ef = hnsw_ef
+        self._lock = threading.RLock()
+        self._conn = connect(os.path.join(root, "chunks.sqlite3"))
+        self._conn.executescript(_SCHEMA)
+        existing = {r["name"] for r in self._conn.execute("PRAGMA table_info(matrices)")}
+        for column, definition in _MATRIX_COLUMNS.items():
+            if column not in existing:
+                self._conn.execute(f"ALTER TABLE matrices ADD COLUMN {column} {definition}")
+        self._kbs: dict[str, _KbMatrix] = {}
+        self._builds: dict[str, threading.Thread] = {}  # HNSW graphs being built, by KB
+        self._closed = False
+
+    def _prefix(self, kb_id: str) -> str:
+        return os.path.join(self.root, f"kb_{kb_id}")
+
+    def _path(self, kb_id: str, suffix: str) -> str:
+        return f"{self._prefix(kb_id)}.{suffix}"
+
+    # --- Loading ---
+
+    def _load(self, kb_id: str) -> _KbMatrix | None:
+        kb = self._kbs.get(kb_id)
+        if kb is not None:
+            return kb
+        info = self._conn.execute("SELECT * FROM matrices WHERE kb_id = ?", (kb_id,)).fetchone()
+        if info is None:
+            return None
+        live_rows = [r[0] for r in self._conn.execute("SELECT row FROM chunks WHERE kb_id = ?", (kb_id,))]
+        # Each KB keeps the storage format it was created with
+        kb = _KbMatrix(self._prefix(kb_id), info["dims"], info["dtype"], info["store_dims"] or info["dims"],
+                       bool(info["rerank"]), info["rows"], live_rows)
+        hnsw_path = self._path(kb_id, "hnsw")
+        if hnswlib is not None and info["hnsw_version"] == info["version"] and os.path.exists(hnsw_path):
+            kb.hnsw = hnswlib.Index(space="ip", dim=kb.store_dims)
+            kb.hnsw.load_index(hnsw_path, max_elements=kb.capacity, allow_replace_deleted=False)
+            kb.hnsw.set_ef(self.hnsw_ef)
+        self._kbs[kb_id] = kb
+        return kb
+
+    def _create(self, kb_id: str, dims: int) -> _KbMatrix:
+        store_dims = min(self.dims or dims, dims)
+        # Full vectors are only worth keeping when the compact ones lose precision
+        rerank = self.rerank_candidates > 0 and (self.dtype != "float32" or store_dims < dims)
+        with self._conn:
+            self._conn.execute(
+                "INSERT INTO matrices (kb_id, dims, dtype, store_dims, rerank) VALUES (?, ?, ?, ?, ?)",
+                (kb_id, dims, self.dtype, store_dims, int(rerank)),
+            )
+        kb = _KbMatrix(self._prefix(kb_id), dims, self.dtype, store_dims, rerank, 0, [])
+        self._kbs[kb_id] = kb
+        return kb
+
+    def _bump_version(self, kb_id: str, kb: _KbMatrix):
+        self._conn.execute("UPDATE matrices SET rows = ?, version = version + 1 WHERE kb_id = ?", (kb.rows, kb_id))
+
+    # --- HNSW ---
+
+    def _start_hnsw_build(self, kb_id: str, kb: _KbMatrix):
+        # Called with the lock held; queries keep using brute force until the graph is swapped in
+        if kb_id in self._builds:
+            return
+        thread = threading.Thread(target=self._build_hnsw, args=(kb_id, kb), name=f"hnsw-{kb_id}", daemon=True)
+        self._builds[kb_id] = thread
+        thread.start()
+
+    def _build_hnsw(self, kb_id: str, kb: _KbMatrix):
+        try:
+            with self._lock:
+                rows, epoch, capacity = kb.rows, kb.epoch, kb.capacity
+                built = kb.live[:rows].copy()
+            # The graph is built without the lock: rows below `rows` are never rewritten in place
+            index = hnswlib.Index(space="ip", dim=kb.store_dims)
+            index.init_index(max_elements=capacity, ef_construction=200, M=16)
+            for start in range(0, rows, _SCAN_BLOCK):
+                stop = min(start + _SCAN_BLOCK, rows)
+                labels = np.flatnonzero(built[start:stop])
+                if len(labels):
+                    index.add_items(kb.decode(start, stop)[labels], labels + start)
+            index.set_ef(max(self.hnsw_ef, self.rerank_candidates))
+            with self._lock:
+                if kb.epoch != epoch or self._kbs.get(kb_id) is not kb:
+                    return  # compacted or dropped meanwhile; the next large query starts over
+                # Catch up with the writes made during the build
+                for row in np.flatnonzero(built & ~kb.live[:rows]):
+                    index.mark_deleted(int(row))
+                added = np.flatnonzero(kb.live[rows:kb.rows])
+                if len(added):
+                    if index.get_max_elements() < kb.capacity:
+                        index.resize_index(kb.capacity)
+                    index.add_items(kb.decode(rows, kb.rows)[added], added + rows)
+                kb.hnsw = index
+                self._save_hnsw(kb_id, kb)
+        except Exception as e:
+            print(f"Building the HNSW index of KB {kb_id} failed: {e}")
+        finally:
+            with self._lock:
+                self._builds.pop(kb_id, None)
+
+    def wait_for_index(self, kb_id: str, timeout: float | None = None):
+        """
+        Wait until a background HNSW build of the KB (if any) has finished.
+        """
+        thread = self._builds.get(kb_id)
+        if thread is not None:
+            thread.join(timeout)
+
+    def _save_hnsw(self, kb_id: str, kb: _KbMatrix):
+        kb.hnsw.save_index(self._path(kb_id, "hnsw"))
+        with self._conn:
+            self._conn.execute("UPDATE matrices SET hnsw_version = version WHERE kb_id = ?", (kb_id,))
+
+    # --- Interface ---
+
+    def add(self, kb_id, ids, documents, embeddings, metadatas):
+        if not ids:
+            return
+        vectors = _normalize(embeddings)
+        with self._lock:
+            kb = self._load(kb_id) or self._create(kb_id, vectors.shape[1])
+            if vectors.shape[1] != kb.dims:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match KB {kb_id} ({kb.dims})")
+            # Re-adding an ID replaces the previous chunk
+            self._delete_rows(kb_id, kb, self._rows_of(kb_id, ids))
+
+            start = kb.rows
+            kb.reserve(start + len(ids))
+            kb.write(start, vectors)
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT INTO chunks (kb_id, id, row, source, document, metadata) VALUES (?, ?, ?, ?, ?, ?)",
+                    [
+                        (kb_id, chunk_id, start + i, (meta or {}).get("source"), doc, json.dumps(meta or {}))
+                        for i, (chunk_id, doc, meta) in enumerate(zip(ids, documents, metadatas))
+                    ],
+                )
+                kb.rows = start + len(ids)
+                self._bump_version(kb_id, kb)
+            kb.live[start:kb.rows] = True
+            kb.live_count += len(ids)
+            if kb.hnsw is not None:
+                if kb.hnsw.get_max_elements() < kb.capacity:
+                    kb.hnsw.resize_index(kb.capacity)
+                kb.hnsw.add_items(kb.decode(start, kb.rows), np.arange(start, kb.rows))
+
+    def _search(self, kb: _KbMatrix, query: np.ndarray, n_results: int, rerank: bool = True) -> tuple[np.ndarray, np.ndarray]:
+        # Quantized/truncated vectors only shortlist candidates; full precision decides the final order
+        rerank = rerank and kb.full is not None
+        k = max(n_results, self.rerank_candidates) if rerank else n_results
+        if kb.hnsw is not None:
+            with self._lock:
+                labels, distances = kb.hnsw.knn_query(kb.prepare(query), k=min(k, kb.live_count))
+            rows, scores = labels[0].astype(np.int64), 1.0 - distances[0]
+        else:
+            # Scored outside the lock: numpy releases the GIL, so concurrent queries run in parallel
+            rows, scores = kb.scan(query, k)
+        if rerank and len(rows):
+            rows, scores = kb.rerank(query, rows, n_results)
+        return rows, scores
+
+    def query(self, kb_id, embedding, n_results=5):
+        query = _normalize(embedding)
+        while True:
+            with self._lock:
+                kb = self._load(kb_id)
+                if kb is None or kb.live_count == 0:
+                    return {"ids": [[]], "documents": [[]], "metadatas": [[]], "distances": [[]]}
+                if kb.hnsw is None and hnswlib is not None and kb.live_count >= self.hnsw_threshold:
+                    self._start_hnsw_build(kb_id, kb)
+                epoch = kb.epoch
+            rows, scores = self._search(kb, query, n_results)
+            with self._lock:
+                if kb.epoch != epoch:
+                    continue  # rows were renumbered meanwhile
+                found = {
+                    r["row"]: r for r in self._conn.execute(
+                        f"SELECT row, id, document, metadata FROM chunks WHERE kb_id = ? AND row IN ({','.join('?' * len(rows))})",
+                        (kb_id, *map(int, rows)),
+                    )
+                }
+            hits = [(found[int(row)], float(score)) for row, score in zip(rows, scores) if int(row) in found]
+            return {
+                "ids": [[r["id"] for r, _ in hits]],
+                "documents": [[r["document"] for r, _ in hits]],
+                "metadatas": [[json.loads(r["metadata"]) for r, _ in hits]],
+                "distances": [[1.0 - score for _, score in hits]],
+            }
+
+    def recall(self, kb_id: str, queries: int = 100, k: int = 5, seed: int = 0) -> dict:
+        """
+        recall@k of the KB's storage format against exact full-precision search, with and without re-ranking.
+        Queries are stored vectors perturbed with random noise of the same norm (cosine ~0.7 to the original).
+        """
+        with self._lock:
+            kb = self._load(kb_id)
+        if kb is None or kb.live_count == 0:
+            return {"queries": 0}
+        rng = np.random.default_rng(seed)
+        live_rows = np.flatnonzero(kb.live[:kb.rows])
+        picked = np.sort(rng.choice(live_rows, size=min(queries, len(live_rows)), replace=False))
+        source = kb.full.array if kb.full is not None else None
+        originals = np.asarray(source[picked], dtype=np.float32) if source is not None else kb.decode(0, kb.rows)[picked]
+        noise = _normalize(rng.standard_normal(originals.shape).astype(np.float32))
+        probes = _normalize(originals + noise)
+
+        result = {"queries": len(probes), "dtype": kb.dtype.name, "dims": kb.dims, "store_dims": kb.store_dims}
+        hits, hits_no_rerank = 0, 0
+        for probe in probes:
+            if source is not None:
+                exact = np.full(kb.rows, -np.inf, dtype=np.float32)
+                for start in range(0, kb.rows, _SCAN_BLOCK):
+                    stop = min(start + _SCAN_BLOCK, kb.rows)
+                    exact[start:stop] = np.asarray(source[start:stop], dtype=np.float32) @ probe
+                exact[~kb.live[:kb.rows]] = -np.inf
+                truth = set(np.argsort(-exact)[:k].tolist())
+            else:
+                truth = set(kb.scan(probe, k)[0].tolist())  # float32, untruncated: the stored vectors are exact
+            hits += len(truth & set(self._search(kb, probe, k)[0].tolist()))
+            hits_no_rerank += len(truth & set(self._search(kb, probe, k, rerank=False)[0].tolist()))
+        total = len(probes) * min(k, kb.live_count)
+        result[f"recall@{k}"] = round(hits / total, 4)
+        result[f"recall@{k}_without_rerank"] = round(hits_no_rerank / total, 4)
+        result["bytes_per_vector"] = kb.store_dims * kb.dtype.itemsize + (4 if kb.scale is not None else 0)
+        result["full_bytes_per_vector"] = kb.dims * 4
+        return result
+
+    def get(self, kb_id, source=None, include=("documents", "metadatas"), limit=None, offset=0, ids=None):
+        sql, params = "SELECT id, document, metadata FROM chunks WHERE kb_id = ?", [kb_id]
+        if source is not None:
+            sql += " AND source = ?"
+            params.append(source)
+        if ids is not None:
+            sql += f" AND id IN ({','.join('?' * len(ids))})"
+            params += ids
+        sql += " ORDER BY row LIMIT ? OFFSET ?"
+        params += [limit if limit is not None else -1, offset or 0]
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        result = {"ids": [r["id"] for r in rows]}
+        if "documents" in include:
+            result["documents"] = [r["document"] for r in rows]
+        if "metadatas" in include:
+            result["metadatas"] = [json.loads(r["metadata"]) for r in rows]
+        return result
+
+    def update_metadatas(self, kb_id, ids, metadatas):
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "UPDATE chunks SET metadata = ?, source = ? WHERE kb_id = ? AND id = ?",
+                    [(json.dumps(meta or {}), (meta or {}).get("source"), kb_id, chunk_id) for chunk_id, meta in zip(ids, metadatas)],
+                )
+
+    def _rows_of(self, kb_id: str, ids: list[str]) -> list[int]:
+        rows = []
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            rows += [r[0] for r in self._conn.execute(
+                f"SELECT row FROM chunks WHERE kb_id = ? AND id IN ({','.join('?' * len(batch))})", (kb_id, *batch)
+            )]
+        return rows
+
+    def _delete_rows(self, kb_id: str, kb: _KbMatrix, rows: list[int]):
+        if not rows:
+            return
+        with self._conn:
+            self._conn.executemany("DELETE FROM chunks WHERE kb_id = ? AND row = ?", [(kb_id, row) for row in rows])
+            self._bump_version(kb_id, kb)
+        kb.live[rows] = False
+        kb.live_count -= len(rows)
+        if kb.hnsw is not None:
+            for row in rows:
+                kb.hnsw.mark_deleted(row)
+
+    def delete(self, kb_id, ids=None, source=None):
+        with self._lock:
+            kb = self._load(kb_id)
+            if kb is None:
+                return
+            if ids is not None:
+                rows = self._rows_of(kb_id, ids)
+            elif source is not None:
+                rows = [r[0] for r in self._conn.execute("SELECT row FROM chunks WHERE kb_id = ? AND source = ?", (kb_id, source))]
+            else:
+                return
+            self._delete_rows(kb_id, kb, rows)
+            if kb.rows > 1024 and kb.live_count < kb.rows // 2:
+                self._compact(kb_id, kb)
+
+    def _compact(self, kb_id: str, kb: _KbMatrix):
+        """
+        Rewrite the vector files without deleted rows once they make up more than half of them.
+        """
+        live_rows = np.flatnonzero(kb.live[:kb.rows])
+        with self._conn:
+            self._conn.executemany(
+                "UPDATE chunks SET row = ? WHERE kb_id = ? AND row = ?",
+                [(new, kb_id, int(old)) for new, old in enumerate(live_rows)],
+            )
+            kb.keep(live_rows)
+            self._bump_version(kb_id, kb)
+        kb.hnsw = None  # rebuilt on the next query if still large
+        kb.epoch += 1
+
+    def count(self, kb_id):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks WHERE kb_id = ?", (kb_id,)).fetchone()[0]
+
+    def drop(self, kb_id):
+        with self._lock:
+            self._kbs.pop(kb_id, None)
+            with self._conn:
+                self._conn.execute("DELETE FROM chunks WHERE kb_id = ?", (kb_id,))
+                self._conn.execute("DELETE FROM matrices WHERE kb_id = ?", (kb_id,))
+            for suffix in ("vec", "scale", "full", "hnsw"):
+                if os.path.exists(self._path(kb_id, suffix)):
+                    os.remove(self._path(kb_id, suffix))
+
+    def close(self):
+        """
+        Flush vectors and persist HNSW graphs changed since they were last saved.
+        """
+        for kb_id in list(self._builds):
+            self.wait_for_index(kb_id)
+        with self._lock:
+            if self._closed:
+                return
+            for kb_id, kb in self._kbs.items():
+                kb.flush()
+                if kb.hnsw is not None:
+                    self._save_hnsw(kb_id, kb)
+            self._closed = True
+        _release_root(os.path.realpath(self.root))
+
+def create_vector_store(client=None) -> VectorStore:
+    """
+    Build the backend selected by settings.VECTOR_STORE.
+    """
+    if settings.VECTOR_STORE == "chroma":
+        return ChromaVectorStore(client)
+    if settings.VECTOR_STORE == "local":
+        return LocalVectorStore(
+            settings.LOCAL_VECTOR_PATH or default_path("vectors"),
+            dtype=settings.LOCAL_VECTOR_DTYPE,
+            hnsw_threshold=settings.LOCAL_HNSW_THRESHOLD,
+            hnsw_ef=settings.LOCAL_HNSW_EF,
+            dims=settings.LOCAL_VECTOR_DIMS,
+            rerank_candidates=settings.LOCAL_RERANK_CANDIDATES,
+        )
+    raise ValueError(f"Unknown vector store '{settings.VECTOR_STORE}' (expected 'chroma' or 'local')")
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="python -m app.core.vector_store", description="Local vector store maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+    recall_cmd = commands.add_parser("recall", help="Report recall@k of quantized KBs against full-precision search")
+    recall_cmd.add_argument("--kb", help="Only this knowledge base (default: all)")
+    recall_cmd.add_argument("--queries", type=int, default=100)
+    recall_cmd.add_argument("-k", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    store = create_vector_store()
+    if not isinstance(store, LocalVectorStore):
+        print("recall is only available with VECTOR_STORE=local")
+        return 1
+    kb_ids = [args.kb] if args.kb else [r[0] for r in store._conn.execute("SELECT kb_id FROM matrices ORDER BY kb_id")]
+    for kb_id in kb_ids:
+        print(kb_id, json.dumps(store.recall(kb_id, queries=args.queries, k=args.k)))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,35 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from app.api.routes import router
 from app.config import settings
+from app.core.jobs import get_queue
+from app.core.ingestion import shutdown_extraction_pool
+from app.core.database import close_vector_store, get_vector_store, migrate_api_keys
+from app.core.data_access import shutdown_store_pool
+from app.core.conversations import close_conversation_store
+from app.core.http_clients import close_http_clients
+from app.core import metrics, api_keys
 
-app = FastAPI(title=settings.PROJECT_NAME, description=settings.DESCRIPTION, version=settings.VERSION)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Device API keys are served from memory; import any left in the legacy Chroma collection first
+    migrate_api_keys()
+    api_keys.load()
+    if settings.VECTOR_STORE == "local":
+        # Opened now so a second worker process fails at startup (the local store is single-process)
+        get_vector_store()
+    # Ingestion workers live as long as the application
+    await get_queue().start()
+    yield
+    await get_queue().stop()
+    shutdown_extraction_pool()
+    shutdown_store_pool()
+    close_vector_store()
+    close_conversation_store()
+    await close_http_clients()
+
+app = FastAPI(title=settings.PROJECT_NAME, description=settings.DESCRIPTION, version=settings.VERSION, lifespan=lifespan)
 
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -19,3 +46,10 @@ app.include_router(router, prefix="/api/v1")
 @app.get("/")
 async def root():
     return {"message": "RAG SecuraAI API is running"}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """
+    Prometheus metrics: per-stage query and ingestion latency histograms, job outcomes and cache hit counters.
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,23 @@
+import hashlib
+
+def text_hash(text: str) -> str:
+    """
+    Stable SHA-256 hex digest of a text, used for document and chunk content hashes.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def file_hash(path: str, block_size: int = 1024 * 1024) -> str:
+    """
+    SHA-256 hex digest of a file, read in blocks so large uploads are never fully loaded.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def chunk_id(source: str, content_hash: str, chunk_index: int) -> str:
+    """
+    Deterministic ID of a document chunk, so re-storing a chunk (e.g. when a failed job is retried) replaces it.
+    """
+    return hashlib.sha256(f"{source}\0{content_hash}\0{chunk_index}".encode("utf-8")).hexdigest()[:32]
@@ -0,0 +1,22 @@
+import os
+import sqlite3
+from app.config import settings
+
+def default_path(filename: str) -> str:
+    """
+    Resolve a state file next to the ChromaDB data so it shares the same persistent volume.
+    """
+    return os.path.join(settings.CHROMA_DB_PATH, filename)
+
+def connect(path: str) -> sqlite3.Connection:
+    """
+    Open a SQLite connection that can be shared across threads.
+    Callers serialize access with their own lock; WAL keeps readers in other processes unblocked.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=30.0)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
@@ -0,0 +1,6 @@
+def estimate_tokens(text: str) -> int:
+    """
+    Approximate token count (~4 characters per token for English text), shared by the chunk
+    budgets (CHUNK_MAX_TOKENS) and the embedding batch budgets (EMBEDDING_MAX_BATCH_TOKENS).
+    """
+    return len(text) // 4 + 1
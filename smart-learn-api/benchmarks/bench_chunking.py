@@ -0,0 +1,102 @@
+"""
+Fixed-window vs. structured chunking on a synthetic corpus: chunk count, embedding cost and retrieval hit rate.
+
+Queries are word subsets of sentences sampled from the corpus; a query is a hit when one of the top-k
+chunks (ranked by the fake OpenAI embeddings) contains the whole sentence.
+
+    python -m benchmarks.bench_chunking --docs-per-topic 5 --paragraphs 40 --queries 400
+"""
+import argparse
+import random
+import time
+
+from benchmarks import common
+from benchmarks.corpus import TOPICS, make_document
+from benchmarks.fake_openai import fake_embedding
+
+import numpy as np
+from app.config import settings
+from app.core.ingestion import FixedWindowChunker, StructuredChunker
+from app.utils.tokens import estimate_tokens
+
+# text-embedding-3-small list price, USD per million tokens
+PRICE_PER_M_TOKENS = 0.02
+
+def normalize(text: str) -> str:
+    return " ".join(text.split())
+
+def make_queries(documents: list[str], count: int, rng: random.Random) -> list[tuple[str, str]]:
+    """
+    (query, sentence) pairs: a query is 8 words of a sentence picked from a random document.
+    """
+    queries = []
+    for _ in range(count):
+        paragraphs = [p for p in rng.choice(documents).split("\n\n") if not p.startswith("#")]
+        sentence = rng.choice(rng.choice(paragraphs).split(". ")).rstrip(".") + "."
+        words = sentence.rstrip(".").split()
+        queries.append((" ".join(rng.sample(words, min(8, len(words)))), sentence))
+    return queries
+
+def run_chunker(name: str, make_chunker, documents: list[str], queries: list[tuple[str, str]], dims: int) -> dict:
+    start = time.perf_counter()
+    chunks = []
+    for document in documents:
+        chunker = make_chunker()
+        chunks += [chunk.text for chunk in chunker.feed(document) + chunker.finish()]
+    chunk_seconds = time.perf_counter() - start
+
+    tokens = sum(estimate_tokens(chunk) for chunk in chunks)
+    source_tokens = sum(estimate_tokens(document) for document in documents)
+    matrix = np.array([fake_embedding(chunk, dims) for chunk in chunks], dtype=np.float32)
+    normalized = [normalize(chunk) for chunk in chunks]
+
+    hits = {1: 0, 5: 0}
+    for query, sentence in queries:
+        scores = matrix @ np.array(fake_embedding(query, dims), dtype=np.float32)
+        ranked = np.argsort(-scores)[:5]
+        for k in hits:
+            if any(sentence in normalized[i] for i in ranked[:k]):
+                hits[k] += 1
+
+    return {
+        "chunker": name,
+        "chunks": len(chunks),
+        "avg_chunk_tokens": round(tokens / len(chunks), 1),
+        "embedded_tokens": tokens,
+        "duplicated_token_fraction": round(max(tokens - source_tokens, 0) / tokens, 3),
+        "embedding_cost_usd": round(tokens / 1_000_000 * PRICE_PER_M_TOKENS, 6),
+        "chunk_ms": round(chunk_seconds * 1000, 1),
+        "hit_rate@1": round(hits[1] / len(queries), 3),
+        "hit_rate@5": round(hits[5] / len(queries), 3),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--docs-per-topic", type=int, default=5)
+    parser.add_argument("--paragraphs", type=int, default=40)
+    parser.add_argument("--queries", type=int, default=400)
+    parser.add_argument("--dimensions", type=int, default=512)
+    parser.add_argument("--max-tokens", type=int, default=settings.CHUNK_MAX_TOKENS)
+    parser.add_argument("--output", help="Write JSON results here instead of benchmarks/results/")
+    args = parser.parse_args()
+
+    documents = [make_document(topic, args.paragraphs, seed) for topic in TOPICS for seed in range(args.docs_per_topic)]
+    queries = make_queries(documents, args.queries, random.Random(0))
+
+    chunkers = {
+        "fixed": lambda: FixedWindowChunker(settings.CHUNK_SIZE, settings.CHUNK_OVERLAP),
+        "structured": lambda: StructuredChunker(args.max_tokens, settings.CHUNK_OVERLAP_TOKENS),
+    }
+    results = {"documents": len(documents), "queries": len(queries), "max_tokens": args.max_tokens, "runs": []}
+    for name, make_chunker in chunkers.items():
+        run = run_chunker(name, make_chunker, documents, queries, args.dimensions)
+        results["runs"].append(run)
+        print(
+            f"{name:>10}: {run['chunks']} chunks, {run['embedded_tokens']} tokens (${run['embedding_cost_usd']}), "
+            f"{run['duplicated_token_fraction']:.0%} duplicated, hit@1 {run['hit_rate@1']}, hit@5 {run['hit_rate@5']}"
+        )
+
+    print(f"Results written to {common.write_results('chunking', results, args.output)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Query throughput while documents are being ingested, with store calls made directly on the event loop
+("blocking", how the API used to call ChromaDB) versus through the async data-access layer ("pool").
+
+Query workers search a pre-filled KB while a writer keeps adding INGEST_FLUSH_SIZE-chunk batches to the
+store, as ingestion jobs do. Event-loop lag is sampled alongside: in blocking mode every store call
+freezes the loop, so queries (and every other request) queue behind ingestion writes.
+
+    python -m benchmarks.bench_concurrent_ingest --duration 10 --concurrency 16
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+from benchmarks import common
+
+import numpy as np
+from app.core import database, data_access
+
+async def run_blocking(func, *args, **kwargs):
+    return func(*args, **kwargs)
+
+async def measure(mode: str, ingest: bool, args, rng) -> dict:
+    query = (lambda vec: data_access.query_documents("bench", vec, n_results=5)) if mode == "pool" else (
+        lambda vec: run_blocking(database.query_documents, "bench", vec, n_results=5))
+    add = data_access.add_documents if mode == "pool" else (lambda *a, **kw: run_blocking(database.add_documents, *a, **kw))
+    probes = rng.standard_normal((256, args.dims), dtype=np.float32).tolist()
+    deadline = time.perf_counter() + args.duration
+    latencies, lags, ingested = [], [], 0
+
+    async def query_worker(worker: int):
+        i = worker
+        while time.perf_counter() < deadline:
+            t = time.perf_counter()
+            # Request boundary: a real handler is scheduled behind whatever else runs on the loop
+            await asyncio.sleep(0)
+            await query(probes[i % len(probes)])
+            latencies.append(time.perf_counter() - t)
+            i += args.concurrency
+
+    async def writer():
+        nonlocal ingested
+        while time.perf_counter() < deadline:
+            ids = [str(uuid.uuid4()) for _ in range(args.batch)]
+            vectors = rng.standard_normal((args.batch, args.dims), dtype=np.float32).tolist()
+            await add("ingest", ids=ids, documents=ids, embeddings=vectors, metadatas=[{"source": "ingest.pdf"}] * args.batch)
+            ingested += args.batch
+            await asyncio.sleep(0)
+
+    async def lag_probe():
+        while time.perf_counter() < deadline:
+            t = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lags.append(max(time.perf_counter() - t - 0.01, 0.0))
+
+    tasks = [query_worker(i) for i in range(args.concurrency)] + [lag_probe()] + ([writer()] if ingest else [])
+    start = time.perf_counter()
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    return {
+        "mode": mode,
+        "ingesting": ingest,
+        "queries_per_second": round(len(latencies) / elapsed, 1),
+        "query_latency": common.percentiles(latencies),
+        "loop_lag": common.percentiles(lags),
+        "chunks_ingested_per_second": round(ingested / elapsed, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seed-chunks", type=int, default=20_000, help="Chunks in the queried KB")
+    parser.add_argument("--dims", type=int, default=384)
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per case")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent query workers")
+    parser.add_argument("--batch", type=int, default=128, help="Chunks per ingestion write (INGEST_FLUSH_SIZE)")
+    parser.add_argument("--output", help="Write JSON results here instead of benchmarks/results/")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    for start in range(0, args.seed_chunks, 5000):
+        count = min(5000, args.seed_chunks - start)
+        ids = [str(start + i) for i in range(count)]
+        database.add_documents("bench", ids=ids, documents=ids, embeddings=rng.standard_normal((count, args.dims), dtype=np.float32).tolist(),
+                               metadatas=[{"source": f"doc{(start + i) // 100}"} for i in range(count)])
+
+    results = {"seed_chunks": args.seed_chunks, "dims": args.dims, "concurrency": args.concurrency, "batch": args.batch, "runs": []}
+    for mode in ("blocking", "pool"):
+        for ingest in (False, True):
+            run = asyncio.run(measure(mode, ingest, args, rng))
+            results["runs"].append(run)
+            print(
+                f"{mode:>8} {'with' if ingest else 'without'} ingestion: {run['queries_per_second']} queries/s, "
+                f"p95 {run['query_latency'].get('p95_ms')}ms, loop lag p99 {run['loop_lag'].get('p99_ms')}ms, "
+                f"{run['chunks_ingested_per_second']} chunks/s ingested"
+            )
+
+    data_access.shutdown_store_pool()
+    print(f"Results written to {common.write_results('concurrent_ingest', results, args.output)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Latency of queries proxied to an external knowledge base (KB_URL), with a new httpx client per query
+(the previous behaviour) vs. the shared keep-alive client from app.core.http_clients.
+
+A stand-in KB server runs under uvicorn on a local port, so every new client pays a real TCP
+connect; `--kb-latency` adds server think time. Devices post to /kb/{kb_id}/query on the app, which
+forwards each query to the stand-in.
+
+    python -m benchmarks.bench_external_kb --queries 2000 --concurrency 32
+"""
+import argparse
+import asyncio
+import socket
+import threading
+import time
+
+from benchmarks import common
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, HTTPException
+from app.main import app
+from app.config import settings
+from app.api import routes
+
+def create_kb_server(latency: float) -> FastAPI:
+    kb = FastAPI()
+
+    @kb.post("/query")
+    async def query(body: dict):
+        if latency:
+            await asyncio.sleep(latency)
+        return {"answer": f"Stand-in answer to: {body['query']}", "context": ["stand-in context"], "latency": latency}
+
+    return kb
+
+def start_kb_server(latency: float) -> tuple[uvicorn.Server, int]:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(create_kb_server(latency), host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, port
+
+async def query_per_request_client(query: str) -> dict:
+    # The pre-pool behaviour: a new client (and connection) for every query
+    try:
+        async with httpx.AsyncClient() as client:
+            response = await client.post(settings.KB_URL, json={"query": query}, timeout=60.0)
+            response.raise_for_status()
+            return response.json()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"External KB Error: {str(e)}")
+
+async def run_mode(client: httpx.AsyncClient, mode: str, args) -> dict:
+    original = routes.query_external_kb
+    if mode == "per_request":
+        routes.query_external_kb = query_per_request_client
+    try:
+        latencies, errors = [], 0
+        queue = asyncio.Queue()
+        for i in range(args.queries):
+            queue.put_nowait(i)
+
+        async def device():
+            nonlocal errors
+            while not queue.empty():
+                i = queue.get_nowait()
+                start = time.perf_counter()
+                try:
+                    response = await client.post("/api/v1/kb/external/query", json={"query": f"question {i}"})
+                    response.raise_for_status()
+                    latencies.append(time.perf_counter() - start)
+                except Exception:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(device() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+    finally:
+        routes.query_external_kb = original
+    return {
+        "mode": mode,
+        "queries_per_second": round(len(latencies) / elapsed, 1),
+        "query_latency": common.percentiles(latencies),
+        "errors": errors,
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--kb-latency", type=float, default=0.0, help="Seconds the stand-in KB takes per query")
+    parser.add_argument("--output", help="Write JSON results here instead of benchmarks/results/")
+    args = parser.parse_args()
+
+    server, port = start_kb_server(args.kb_latency)
+    settings.KB_URL = f"http://127.0.0.1:{port}/query"
+    results = {"config": {k: v for k, v in vars(args).items() if k != "output"}, "runs": []}
+    try:
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://api", timeout=120.0) as client:
+                for mode in ("per_request", "shared"):
+                    run = await run_mode(client, mode, args)
+                    results["runs"].append(run)
+                    latency = run["query_latency"]
+                    print(
+                        f"{mode:>12}: {run['queries_per_second']} queries/s, p50 {latency.get('p50_ms')}ms "
+                        f"p95 {latency.get('p95_ms')}ms p99 {latency.get('p99_ms')}ms, {run['errors']} errors"
+                    )
+    finally:
+        server.should_exit = True
+
+    print(f"Results written to {common.write_results('external_kb', results, args.output)}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
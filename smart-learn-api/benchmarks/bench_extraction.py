@@ -0,0 +1,95 @@
+"""
+Query latency while bulk PDF extraction runs, with extraction on the event loop vs. in the process pool.
+
+    python -m benchmarks.bench_extraction --pdfs 6 --pages 150
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from benchmarks import common
+from benchmarks.corpus import make_pdf
+
+import httpx
+from app.main import app
+from app.core import ingestion
+from app.core.database import add_documents, set_kb_metadata
+from app.api.routes import StoredUpload
+
+def run_inline(func, *args):
+    # The pre-pool behaviour: parse synchronously on the event loop
+    async def call():
+        return func(*args)
+    return call()
+
+async def run_mode(mode: str, pdf_paths: list[str], kb_id: str, concurrency: int) -> dict:
+    original = ingestion.run_extraction
+    if mode == "inline":
+        ingestion.run_extraction = run_inline
+    try:
+        latencies = []
+        done = asyncio.Event()
+
+        async def ingest():
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def one(path):
+                async with semaphore:
+                    await ingestion.extract_text(StoredUpload(path, os.path.basename(path)))
+
+            start = time.perf_counter()
+            await asyncio.gather(*(one(p) for p in pdf_paths))
+            done.set()
+            return time.perf_counter() - start
+
+        async def query_loop():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://api") as client:
+                while not done.is_set():
+                    start = time.perf_counter()
+                    response = await client.post(f"/api/v1/kb/{kb_id}/query", json={"query": "What is photosynthesis?"})
+                    response.raise_for_status()
+                    latencies.append(time.perf_counter() - start)
+                    await asyncio.sleep(0.01)
+
+        ingest_seconds, _ = await asyncio.gather(ingest(), query_loop())
+        return {"ingest_seconds": round(ingest_seconds, 2), "query_latency": common.percentiles(latencies)}
+    finally:
+        ingestion.run_extraction = original
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pdfs", type=int, default=6)
+    parser.add_argument("--pages", type=int, default=150)
+    parser.add_argument("--concurrency", type=int, default=2)
+    parser.add_argument("--output", help="Write JSON results here instead of benchmarks/results/")
+    args = parser.parse_args()
+
+    common.install_fake_openai()
+    kb_id = "bench_extract"
+    set_kb_metadata(kb_id, "Benchmark KB")
+    add_documents(kb_id, ids=["c0"], documents=["Plants use light to make glucose."], embeddings=[[0.0] * 1535 + [1.0]], metadatas=[{"source": "seed.txt", "chunk_index": 0}])
+
+    workdir = tempfile.mkdtemp(prefix="bench-pdfs-")
+    pdf_paths = []
+    for i in range(args.pdfs):
+        path = os.path.join(workdir, f"book_{i}.pdf")
+        with open(path, "wb") as f:
+            f.write(make_pdf(args.pages, seed=i))
+        pdf_paths.append(path)
+
+    # Warm the pool so process start-up isn't counted against the pool mode
+    await ingestion.extract_text(StoredUpload(pdf_paths[0], "warmup.pdf"))
+
+    results = {"pdfs": args.pdfs, "pages": args.pages}
+    for mode in ("inline", "pool"):
+        results[mode] = await run_mode(mode, pdf_paths, kb_id, args.concurrency)
+        print(f"{mode:>6}: ingest {results[mode]['ingest_seconds']}s, query latency {results[mode]['query_latency']}")
+
+    ingestion.shutdown_extraction_pool()
+    print(f"Results written to {common.write_results('extraction', results, args.output)}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
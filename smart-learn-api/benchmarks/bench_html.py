@@ -0,0 +1,92 @@
+"""
+Per-page HTML-to-text time of each engine in app.core.html_text against the original path
+(BeautifulSoup html.parser, whole page: HTML_ENGINE=bs4 with HTML_MAIN_CONTENT=false).
+
+Runs on saved HTML files (e.g. Wikipedia articles saved with `curl -o`), or on synthetic
+encyclopedia-style pages from benchmarks/corpus.py when no fixtures are given.
+
+    python -m benchmarks.bench_html --fixtures path/to/saved/pages
+    python -m benchmarks.bench_html --pages 20 --paragraphs 300
+"""
+import argparse
+import glob
+import os
+import time
+
+from benchmarks import common
+from benchmarks.corpus import TOPICS, make_html_page
+
+from app.core import html_text
+
+def load_pages(args) -> list[tuple[str, str]]:
+    if args.fixtures:
+        paths = sorted(glob.glob(os.path.join(args.fixtures, "*.htm*")))
+        if not paths:
+            raise SystemExit(f"No .html files in {args.fixtures}")
+        pages = []
+        for path in paths:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                pages.append((os.path.basename(path), f.read()))
+        return pages
+    topics = list(TOPICS)
+    return [(f"synthetic-{i}", make_html_page(topics[i % len(topics)], paragraphs=args.paragraphs, seed=i)) for i in range(args.pages)]
+
+def configurations() -> list[tuple[str, str, bool]]:
+    configs = [("original", "bs4", False), ("bs4", "bs4", True)]
+    for engine in ("lxml", "selectolax"):
+        try:
+            html_text.resolve_engine(engine)
+        except RuntimeError:
+            print(f"Skipping {engine}: not installed")
+            continue
+        configs.append((engine, engine, True))
+    return configs
+
+def run_config(pages: list[tuple[str, str]], engine: str, main_content: bool, repeat: int) -> dict:
+    samples, chars = [], 0
+    for _, html in pages:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            text = html_text.html_to_text(html, engine=engine, main_content=main_content)
+            samples.append(time.perf_counter() - start)
+        chars += len(text)
+    return {
+        "engine": engine,
+        "main_content": main_content,
+        "page_latency": common.percentiles(samples),
+        "mean_page_ms": round(sum(samples) / len(samples) * 1000, 2),
+        "pages_per_second": round(len(samples) / sum(samples), 1),
+        "text_chars_per_page": round(chars / len(pages)),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--fixtures", help="Directory of saved .html pages")
+    parser.add_argument("--pages", type=int, default=10, help="Synthetic pages when no fixtures are given")
+    parser.add_argument("--paragraphs", type=int, default=200, help="Paragraphs per synthetic page")
+    parser.add_argument("--repeat", type=int, default=3, help="Extractions per page")
+    parser.add_argument("--output", help="Write JSON results here instead of benchmarks/results/")
+    args = parser.parse_args()
+
+    pages = load_pages(args)
+    html_kb = sum(len(html) for _, html in pages) / len(pages) / 1024
+    print(f"{len(pages)} pages, {html_kb:.0f} KiB of HTML on average")
+    results = {"config": {k: v for k, v in vars(args).items() if k != "output"}, "html_kib_per_page": round(html_kb, 1), "runs": []}
+
+    baseline = None
+    for label, engine, main_content in configurations():
+        run = run_config(pages, engine, main_content, args.repeat)
+        run["label"] = label
+        baseline = baseline or run["mean_page_ms"]
+        run["speedup"] = round(baseline / run["mean_page_ms"], 2)
+        results["runs"].append(run)
+        latency = run["page_latency"]
+        print(
+            f"{label:>10}: p50 {latency['p50_ms']}ms p95 {latency['p95_ms']}ms per page, "
+            f"{run['speedup']}x, {run['text_chars_per_page']} chars of text per page"
+        )
+
+    print(f"Results written to {common.write_results('html', results, args.output)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Quantized local vector storage: recall@5 against full precision, bytes per vector and query latency.
+
+Vectors are synthetic with Matryoshka-style decay (leading dimensions carry most of the signal), as
+with text-embedding-3 models. Recall is measured by LocalVectorStore.recall on noisy stored vectors.
+
+    python -m benchmarks.bench_quantization --size 50000 --dims 1536
+"""
+import argparse
+import tempfile
+import time
+
+from benchmarks import common
+
+import numpy as np
+from app.core.vector_store import LocalVectorStore
+
+VARIANTS = [
+    ("float32", None),
+    ("float16", None),
+    ("int8", None),
+    ("float16", 512),
+    ("int8", 512),
+    ("int8", 256),
+]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=50_000)
+    parser.add_argument("--dims", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--rerank-candidates", type=int, default=50)
+    parser.add_argument("--output", help="Write JSON results here instead of benchmarks/results/")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    decay = np.exp(-np.arange(args.dims) / (args.dims / 3)).astype(np.float32)
+    vectors = rng.standard_normal((args.size, args.dims), dtype=np.float32) * decay
+    ids = [str(i) for i in range(args.size)]
+    probes = rng.standard_normal((args.queries, args.dims), dtype=np.float32) * decay
+
+    results = {"size": args.size, "dims": args.dims, "rerank_candidates": args.rerank_candidates, "runs": []}
+    for dtype, dims in VARIANTS:
+        store = LocalVectorStore(tempfile.mkdtemp(prefix="bench-quant-"), dtype=dtype, dims=dims, rerank_candidates=args.rerank_candidates)
+        for start in range(0, args.size, 5000):
+            stop = min(start + 5000, args.size)
+            store.add("bench", ids[start:stop], ids[start:stop], vectors[start:stop], [{}] * (stop - start))
+
+        latencies = []
+        for probe in probes:
+            t = time.perf_counter()
+            store.query("bench", probe, n_results=5)
+            latencies.append(time.perf_counter() - t)
+
+        run = {**store.recall("bench", queries=args.queries, k=5), "query_latency": common.percentiles(latencies)}
+        run["scanned_mb"] = round(run["bytes_per_vector"] * args.size / 2**20, 1)
+        results["runs"].append(run)
+        print(
+            f"{dtype:>7} dims={run['store_dims']:>4}: {run['bytes_per_vector']:>5} B/vector ({run['scanned_mb']} MB scanned), "
+            f"recall@5 {run['recall@5']} (without rerank {run['recall@5_without_rerank']}), p50 {run['query_latency']['p50_ms']}ms"
+        )
+
+    print(f"Results written to {common.write_results('quantization', results, args.output)}")
+
+if __name__ == "__main__":
+    main()
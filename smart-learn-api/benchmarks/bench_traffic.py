@@ -0,0 +1,142 @@
+"""
+Scripted device traffic against the whole API: concurrent devices asking questions on
+/kb/{kb_id}/query while documents are uploaded to /kb/{kb_id}/ingest, with the OpenAI API replaced
+by the in-process fake server (configurable embedding and chat latency).
+
+For every KB size a fresh KB is seeded with synthetic pre-embedded chunks, then `--devices` devices
+each loop: ask a question (own session_id), wait `--think-time`, repeat. One uploader posts a new
+text document every 1/`--ingest-rate` seconds and the ingestion jobs are followed to completion.
+Reports p50/p95/p99 latency, throughput, error counts, answer cache hit rate and peak RSS.
+
+    python -m benchmarks.bench_traffic --sizes 1000,10000,100000 --devices 32 --duration 30
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from benchmarks import common
+from benchmarks.corpus import TOPICS, make_document, make_question, seed_knowledge_base
+
+import httpx
+from app.main import app
+from app.core.answer_cache import get_answer_cache
+from app.core.database import set_kb_metadata
+
+async def device(client: httpx.AsyncClient, kb_id: str, device_id: int, deadline: float, args, stats: dict):
+    rng = random.Random(device_id)
+    topics = list(TOPICS)
+    while time.perf_counter() < deadline:
+        query = make_question(rng, rng.choice(topics))
+        start = time.perf_counter()
+        try:
+            response = await client.post(f"/api/v1/kb/{kb_id}/query", json={"query": query, "session_id": f"device-{device_id}"})
+            response.raise_for_status()
+            stats["query"].append(time.perf_counter() - start)
+        except Exception:
+            stats["query_errors"] += 1
+        await asyncio.sleep(rng.uniform(0, 2 * args.think_time))
+
+async def uploader(client: httpx.AsyncClient, kb_id: str, deadline: float, args, stats: dict):
+    topics = list(TOPICS)
+    i = 0
+    while args.ingest_rate > 0 and time.perf_counter() < deadline:
+        text = make_document(topics[i % len(topics)], paragraphs=args.doc_paragraphs, seed=i)
+        start = time.perf_counter()
+        try:
+            response = await client.post(f"/api/v1/kb/{kb_id}/ingest", files={"file": (f"upload-{i}.txt", text.encode("utf-8"), "text/plain")})
+            response.raise_for_status()
+            stats["ingest_accept"].append(time.perf_counter() - start)
+            stats["jobs"].append(response.json()["job_id"])
+        except Exception:
+            stats["ingest_errors"] += 1
+        i += 1
+        await asyncio.sleep(1 / args.ingest_rate)
+
+async def wait_for_jobs(client: httpx.AsyncClient, job_ids: list[str], timeout: float) -> dict:
+    deadline = time.perf_counter() + timeout
+    pending, finished = set(job_ids), {}
+    while pending and time.perf_counter() < deadline:
+        for job_id in list(pending):
+            job = (await client.get(f"/api/v1/jobs/{job_id}")).json()
+            if job["status"] in ("succeeded", "failed"):
+                finished[job_id] = job
+                pending.discard(job_id)
+        await asyncio.sleep(0.2)
+    return {
+        "jobs": len(job_ids),
+        "succeeded": sum(job["status"] == "succeeded" for job in finished.values()),
+        "failed": sum(job["status"] == "failed" for job in finished.values()),
+        "unfinished": len(pending),
+        "job_latency": common.percentiles([job["finished_at"] - job["created_at"] for job in finished.values()]),
+    }
+
+async def run_size(client: httpx.AsyncClient, size: int, args) -> dict:
+    kb_id = f"traffic_{size}"
+    set_kb_metadata(kb_id, f"Traffic {size}")
+    seed_seconds = await asyncio.to_thread(seed_knowledge_base, kb_id, size)
+    cache_before = get_answer_cache().stats()
+
+    stats = {"query": [], "query_errors": 0, "ingest_accept": [], "ingest_errors": 0, "jobs": []}
+    start = time.perf_counter()
+    deadline = start + args.duration
+    await asyncio.gather(
+        *(device(client, kb_id, i, deadline, args, stats) for i in range(args.devices)),
+        uploader(client, kb_id, deadline, args, stats),
+    )
+    elapsed = time.perf_counter() - start
+    jobs = await wait_for_jobs(client, stats["jobs"], args.job_timeout)
+
+    cache_after = get_answer_cache().stats()
+    hits = cache_after["hits"] - cache_before["hits"]
+    lookups = hits + cache_after["misses"] - cache_before["misses"]
+    return {
+        "chunks": size,
+        "seed_seconds": round(seed_seconds, 2),
+        "queries_per_second": round(len(stats["query"]) / elapsed, 1),
+        "query_latency": common.percentiles(stats["query"]),
+        "query_errors": stats["query_errors"],
+        "answer_cache_hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+        "ingest_accept_latency": common.percentiles(stats["ingest_accept"]),
+        "ingest_errors": stats["ingest_errors"],
+        "ingestion": jobs,
+        "peak_rss_mb": common.peak_rss_mb(),
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="1000,10000", help="Comma-separated KB sizes in chunks (1000 to 1000000)")
+    parser.add_argument("--devices", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds of traffic per KB size")
+    parser.add_argument("--think-time", type=float, default=0.5, help="Mean seconds between a device's questions")
+    parser.add_argument("--ingest-rate", type=float, default=0.2, help="Document uploads per second; 0 disables ingestion")
+    parser.add_argument("--doc-paragraphs", type=int, default=40)
+    parser.add_argument("--job-timeout", type=float, default=120.0, help="Seconds to wait for ingestion jobs after the traffic stops")
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--chat-ttft", type=float, default=0.3)
+    parser.add_argument("--chat-token-latency", type=float, default=0.02)
+    parser.add_argument("--output", help="Write JSON results here instead of benchmarks/results/")
+    args = parser.parse_args()
+
+    common.install_fake_openai(embedding_latency=args.embedding_latency, chat_ttft=args.chat_ttft, chat_token_latency=args.chat_token_latency)
+    results = {"config": {k: v for k, v in vars(args).items() if k != "output"}, "runs": []}
+
+    # Run the app's lifespan so the ingestion workers are up, as under uvicorn
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://api", timeout=120.0) as client:
+            for size in [int(s) for s in args.sizes.split(",")]:
+                run = await run_size(client, size, args)
+                results["runs"].append(run)
+                latency = run["query_latency"]
+                print(
+                    f"{size:>8} chunks: {run['queries_per_second']} queries/s, p50 {latency.get('p50_ms')}ms "
+                    f"p95 {latency.get('p95_ms')}ms p99 {latency.get('p99_ms')}ms, {run['query_errors']} errors, "
+                    f"cache hit rate {run['answer_cache_hit_rate']}, jobs {run['ingestion']['succeeded']}/{run['ingestion']['jobs']}, "
+                    f"rss {run['peak_rss_mb']}MB"
+                )
+
+    print(f"Results written to {common.write_results('traffic', results, args.output)}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
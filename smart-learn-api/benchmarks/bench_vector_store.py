@@ -0,0 +1,109 @@
+"""
+ChromaDB vs. the local memory-mapped vector store: build time, load time, query latency and memory.
+
+Every (backend, size) case is built and then queried in separate child processes, so load time is
+measured from a fresh process and peak RSS belongs to that case alone.
+
+    python -m benchmarks.bench_vector_store --sizes 10000,100000,1000000 --dims 1536
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import common
+
+import numpy as np
+
+BATCH = 5000  # ChromaDB rejects add() batches above ~5.4k items
+
+def vectors(size: int, dims: int, seed: int):
+    rng = np.random.default_rng(seed)
+    for start in range(0, size, BATCH):
+        yield start, rng.standard_normal((min(BATCH, size - start), dims), dtype=np.float32)
+
+def open_store(backend: str, path: str, dtype: str, hnsw_threshold: int):
+    if backend == "chroma":
+        import chromadb
+        from app.core.vector_store import ChromaVectorStore
+        return ChromaVectorStore(chromadb.PersistentClient(path=path))
+    from app.core.vector_store import LocalVectorStore
+    return LocalVectorStore(path, dtype=dtype, hnsw_threshold=hnsw_threshold)
+
+def build(args) -> dict:
+    store = open_store(args.backend, args.path, args.dtype, args.hnsw_threshold)
+    start = time.perf_counter()
+    for offset, batch in vectors(args.size, args.dims, seed=0):
+        ids = [str(offset + i) for i in range(len(batch))]
+        store.add("bench", ids=ids, documents=[f"chunk {i}" for i in ids], embeddings=batch, metadatas=[{"source": f"doc{int(i) // 100}"} for i in ids])
+    if args.backend == "local":
+        # Start the background HNSW build (if the KB is large enough); close() waits for it, so it counts as ingestion
+        store.query("bench", np.ones(args.dims, dtype=np.float32), n_results=1)
+    store.close()
+    return {"build_seconds": round(time.perf_counter() - start, 2), "disk_mb": round(du(args.path) / 2**20, 1)}
+
+def query(args) -> dict:
+    start = time.perf_counter()
+    store = open_store(args.backend, args.path, args.dtype, args.hnsw_threshold)
+    queries = np.random.default_rng(1).standard_normal((args.queries, args.dims), dtype=np.float32)
+    store.query("bench", queries[0].tolist(), n_results=5)
+    load_seconds = time.perf_counter() - start
+
+    latencies = []
+    for q in queries[1:]:
+        t = time.perf_counter()
+        store.query("bench", q.tolist(), n_results=5)
+        latencies.append(time.perf_counter() - t)
+    return {"load_seconds": round(load_seconds, 3), "query_latency": common.percentiles(latencies), "peak_rss_mb": common.peak_rss_mb()}
+
+def du(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+
+def run_case(args, backend: str, size: int) -> dict:
+    path = tempfile.mkdtemp(prefix=f"bench-{backend}-{size}-")
+    base = [sys.executable, "-m", "benchmarks.bench_vector_store", "--backend", backend, "--size", str(size), "--path", path,
+            "--dims", str(args.dims), "--dtype", args.dtype, "--hnsw-threshold", str(args.hnsw_threshold), "--queries", str(args.queries)]
+    result = {"backend": backend, "size": size}
+    for phase in ("build", "query"):
+        out = subprocess.run(base + ["--phase", phase], capture_output=True, text=True, check=True).stdout
+        result.update(json.loads(out.strip().splitlines()[-1]))
+    subprocess.run(["rm", "-rf", path], check=False)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--backends", default="chroma,local")
+    parser.add_argument("--dims", type=int, default=1536)
+    parser.add_argument("--dtype", default="float32", choices=["float32", "float16"])
+    parser.add_argument("--hnsw-threshold", type=int, default=50_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--output", help="Write JSON results here instead of benchmarks/results/")
+    # Child process arguments
+    parser.add_argument("--phase", choices=["build", "query"])
+    parser.add_argument("--backend")
+    parser.add_argument("--size", type=int)
+    parser.add_argument("--path")
+    args = parser.parse_args()
+
+    if args.phase:
+        print(json.dumps(build(args) if args.phase == "build" else query(args)))
+        return
+
+    results = {"dims": args.dims, "dtype": args.dtype, "hnsw_threshold": args.hnsw_threshold, "runs": []}
+    for size in map(int, args.sizes.split(",")):
+        for backend in args.backends.split(","):
+            run = run_case(args, backend, size)
+            results["runs"].append(run)
+            print(
+                f"{backend:>7} {size:>8}: build {run['build_seconds']}s, load {run['load_seconds']}s, "
+                f"p50 {run['query_latency']['p50_ms']}ms, p95 {run['query_latency']['p95_ms']}ms, "
+                f"rss {run['peak_rss_mb']}MB, disk {run['disk_mb']}MB"
+            )
+    print(f"Results written to {common.write_results('vector_store', results, args.output)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Shared helpers for benchmarks: isolated settings, in-process fake OpenAI clients and latency stats.
+
+Import this module before anything from `app`, since it sets the environment the settings are read from.
+"""
+import os
+import json
+import time
+import tempfile
+import resource
+import platform
+import subprocess
+
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("CHROMA_DB_PATH", tempfile.mkdtemp(prefix="smart-learn-bench-"))
+
+import httpx
+from openai import AsyncOpenAI
+from benchmarks.fake_openai import create_app as create_fake_openai
+
+def fake_openai_client(**latencies) -> AsyncOpenAI:
+    """
+    OpenAI client wired in-process to a fake OpenAI server with the given latencies.
+    """
+    transport = httpx.ASGITransport(app=create_fake_openai(**latencies))
+    return AsyncOpenAI(api_key="benchmark", base_url="http://fake-openai/v1", http_client=httpx.AsyncClient(transport=transport), max_retries=0)
+
+def install_fake_openai(**latencies):
+    """
+    Point the app's embedding and LLM clients at the fake server.
+    """
+    from app.core import embedding, llm
+
+    fake = fake_openai_client(**latencies)
+    embedding.client = fake
+    llm.client = fake
+    return fake
+
+def percentiles(samples: list[float]) -> dict:
+    """
+    p50/p95/p99/max of latency samples, in milliseconds.
+    """
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pick(q: float) -> float:
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)] * 1000
+
+    return {
+        "count": len(ordered),
+        "p50_ms": round(pick(0.50), 2),
+        "p95_ms": round(pick(0.95), 2),
+        "p99_ms": round(pick(0.99), 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
+
+def peak_rss_mb() -> float:
+    """
+    Peak resident set size of this process in MiB.
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    return round(rss / 1024 / (1024 if platform.system() == "Darwin" else 1), 1)
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+def write_results(name: str, results: dict, output: str | None = None) -> str:
+    """
+    Save machine-readable results (with commit and timestamp) as JSON; returns the file path.
+    """
+    record = {"benchmark": name, "git_revision": git_revision(), "timestamp": time.time(), "results": results}
+    if output is None:
+        directory = os.path.join(os.path.dirname(__file__), "results")
+        os.makedirs(directory, exist_ok=True)
+        output = os.path.join(directory, f"{name}-{record['git_revision']}-{int(record['timestamp'])}.json")
+    with open(output, "w") as f:
+        json.dump(record, f, indent=2)
+    return output
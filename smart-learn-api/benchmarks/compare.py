@@ -0,0 +1,83 @@
+"""
+Compare two benchmark result files (as written by common.write_results) and flag regressions.
+
+Every numeric metric present in both files is compared. Latencies, durations, memory and error counts
+regress when they grow; throughput, hit rates and recall regress when they shrink. The exit status
+is 1 when any metric regressed by more than --threshold, so the script can gate CI.
+
+    python -m benchmarks.compare benchmarks/results/traffic-abc123-....json benchmarks/results/traffic-def456-....json
+"""
+import argparse
+import json
+import sys
+
+HIGHER_IS_BETTER = ("per_second", "hit_rate", "recall", "succeeded")
+LOWER_IS_BETTER = ("_ms", "seconds", "_mb", "errors", "failed", "unfinished", "bytes")
+
+def flatten(value, prefix: str = "") -> dict:
+    """
+    {"runs.0.query_latency.p95_ms": 12.3, ...} for every numeric leaf.
+    """
+    if isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, list):
+        items = enumerate(value)
+    else:
+        return {prefix: value} if isinstance(value, (int, float)) and not isinstance(value, bool) else {}
+    flat = {}
+    for key, child in items:
+        flat.update(flatten(child, f"{prefix}.{key}" if prefix else str(key)))
+    return flat
+
+def direction(metric: str) -> int:
+    """
+    +1 if higher is better, -1 if lower is better, 0 for configuration and counts.
+    """
+    name = metric.rsplit(".", 1)[-1]
+    if any(marker in name for marker in HIGHER_IS_BETTER):
+        return 1
+    if any(marker in name for marker in LOWER_IS_BETTER):
+        return -1
+    return 0
+
+def compare(baseline: dict, candidate: dict, threshold: float) -> list[dict]:
+    old, new = flatten(baseline["results"]), flatten(candidate["results"])
+    rows = []
+    for metric in sorted(old.keys() & new.keys()):
+        sign = direction(metric)
+        if not sign or old[metric] == new[metric]:
+            continue
+        change = (new[metric] - old[metric]) / abs(old[metric]) if old[metric] else float("inf")
+        rows.append({"metric": metric, "old": old[metric], "new": new[metric], "change": change, "regression": sign * change < -threshold})
+    return rows
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files.")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative change counted as a regression (default 10%%)")
+    parser.add_argument("--all", action="store_true", help="Show every changed metric, not only regressions and improvements")
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    if baseline["benchmark"] != candidate["benchmark"]:
+        print(f"Warning: comparing {baseline['benchmark']} results with {candidate['benchmark']} results")
+
+    print(f"{baseline['benchmark']}: {baseline['git_revision']} -> {candidate['git_revision']}")
+    rows = compare(baseline, candidate, args.threshold)
+    for row in rows:
+        significant = abs(row["change"]) > args.threshold
+        if not (args.all or significant):
+            continue
+        label = "REGRESSION" if row["regression"] else ("improved" if significant else "")
+        print(f"{row['metric']:<60} {row['old']:>12.6g} -> {row['new']:>12.6g} ({row['change']:+.1%}) {label}")
+
+    regressions = sum(row["regression"] for row in rows)
+    print(f"{regressions} regression(s) beyond {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
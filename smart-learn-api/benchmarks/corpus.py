@@ -0,0 +1,149 @@
+"""
+Synthetic corpus generators for benchmarks: topic-flavoured prose, multi-page text PDFs and
+pre-embedded KBs of any size (1k to 1M chunks) for query load tests.
+"""
+import time
+import random
+
+TOPICS = {
+    "photosynthesis": "chlorophyll light leaves glucose carbon dioxide oxygen plants energy sunlight stomata".split(),
+    "gravity": "mass force acceleration newton orbit weight planets attraction falling earth".split(),
+    "volcanoes": "magma lava eruption crust tectonic plates ash crater mountain heat".split(),
+    "cells": "nucleus membrane mitochondria cytoplasm organelles division dna protein tissue".split(),
+    "fractions": "numerator denominator divide equal parts whole half quarter ratio simplify".split(),
+    "electricity": "current voltage circuit resistance battery wire electrons charge switch bulb".split(),
+    "water cycle": "evaporation condensation precipitation clouds rain rivers oceans vapour collection".split(),
+    "solar system": "sun planets moon orbit mercury venus mars jupiter saturn asteroid".split(),
+}
+
+FILLER = "the a of and to in is that it for on with as was by this are from at be which can".split()
+
+def make_sentence(rng: random.Random, topic: str, length: int = 14) -> str:
+    words = []
+    for _ in range(length):
+        pool = TOPICS[topic] if rng.random() < 0.35 else FILLER
+        words.append(rng.choice(pool))
+    words[0] = words[0].capitalize()
+    return " ".join(words) + "."
+
+def make_paragraph(rng: random.Random, topic: str, sentences: int = 5) -> str:
+    return " ".join(make_sentence(rng, topic) for _ in range(sentences))
+
+def make_document(topic: str, paragraphs: int = 20, seed: int = 0) -> str:
+    """
+    A plain-text document about one topic, with a heading and blank-line separated paragraphs.
+    """
+    rng = random.Random(f"{topic}-{seed}")
+    parts = [f"# {topic.title()}"]
+    for i in range(paragraphs):
+        if i and i % 5 == 0:
+            parts.append(f"## {topic.title()} part {i // 5 + 1}")
+        parts.append(make_paragraph(rng, topic))
+    return "\n\n".join(parts)
+
+def make_html_page(topic: str, paragraphs: int = 60, seed: int = 0) -> str:
+    """
+    An encyclopedia-style article page about one topic: site header, navigation sidebar, table of contents,
+    paragraphs with citation markers and edit links, a reference list, a navbox and a footer.
+    """
+    rng = random.Random(f"html-{topic}-{seed}")
+    title = topic.title()
+    sections = max(1, paragraphs // 6)
+    nav = "".join(f'<li><a href="/wiki/{other}">{other.title()}</a></li>' for other in TOPICS)
+    toc = "".join(f'<li><a href="#s{i}">{title} part {i + 1}</a></li>' for i in range(sections))
+    body = []
+    for i in range(paragraphs):
+        if i % 6 == 0:
+            section = i // 6
+            body.append(f'<h2 id="s{section}">{title} part {section + 1}<span class="mw-editsection">[<a href="?action=edit&amp;section={section}">edit</a>]</span></h2>')
+        sentences = [make_sentence(rng, topic) for _ in range(5)]
+        marker = f'<sup class="reference"><a href="#cite-{i}">[{i + 1}]</a></sup>'
+        body.append(f"<p>{sentences[0]} <b>{sentences[1]}</b>{marker} {' '.join(sentences[2:])}</p>")
+    references = "".join(f'<li id="cite-{i}">{make_sentence(rng, topic, 8)} Retrieved 2024.</li>' for i in range(paragraphs))
+    return (
+        f"<!DOCTYPE html><html><head><title>{title} - Encyclopedia</title><style>body {{ margin: 0 }}</style>"
+        f"<script>var config = {{page: '{topic}'}};</script></head><body>"
+        f'<header role="banner"><a href="/">Encyclopedia</a><form role="search"><input name="q"></form></header>'
+        f'<nav id="mw-panel"><ul>{nav}</ul></nav>'
+        f'<main id="content"><h1>{title}</h1><div id="toc" class="toc"><ul>{toc}</ul></div>'
+        f'{"".join(body)}<h2>References</h2><div class="reflist"><ol class="references">{references}</ol></div>'
+        f'<div class="navbox"><ul>{nav}</ul></div></main>'
+        f'<footer id="footer">Text is available under a license. <a href="/privacy">Privacy policy</a></footer>'
+        f"</body></html>"
+    )
+
+def make_question(rng: random.Random, topic: str) -> str:
+    """
+    A student-style question about a topic, mentioning a few of its words.
+    """
+    template = rng.choice(["What is {topic}?", "How does {topic} work?", "Explain {topic} and {word}.", "What is the role of {word} in {topic}?"])
+    return template.format(topic=topic, word=rng.choice(TOPICS[topic]))
+
+def iter_chunks(count: int, seed: int = 0, sentences: int = 4):
+    """
+    Yield (topic, text) for `count` chunks cycling through the topics, without holding them in memory.
+    """
+    rng = random.Random(seed)
+    topics = list(TOPICS)
+    for i in range(count):
+        topic = topics[i % len(topics)]
+        yield topic, make_paragraph(rng, topic, sentences)
+
+def seed_knowledge_base(kb_id: str, count: int, dimensions: int = 1536, batch: int = 5000, seed: int = 0) -> float:
+    """
+    Fill a KB with `count` chunks embedded by the fake OpenAI embedding (so questions about a topic
+    retrieve that topic's chunks), writing straight to the store. Returns the seconds taken.
+    """
+    from app.core.database import add_documents
+    from benchmarks.fake_openai import fake_embedding
+
+    start = time.perf_counter()
+    ids, texts, metadatas = [], [], []
+    for i, (topic, text) in enumerate(iter_chunks(count, seed)):
+        ids.append(f"{kb_id}-{i}")
+        texts.append(text)
+        metadatas.append({"source": f"{topic}-{i // 100}.txt", "chunk_index": i % 100})
+        if len(ids) == batch or i == count - 1:
+            add_documents(kb_id, ids=ids, documents=texts, embeddings=[fake_embedding(t, dimensions) for t in texts], metadatas=metadatas)
+            ids, texts, metadatas = [], [], []
+    return time.perf_counter() - start
+
+def make_pdf(pages: int, lines_per_page: int = 45, seed: int = 0) -> bytes:
+    """
+    Build a valid text PDF (Helvetica, one content stream per page) without any PDF library.
+    """
+    rng = random.Random(seed)
+    topics = list(TOPICS)
+    objects = [None, None]  # 1: catalog, 2: page tree (filled in at the end)
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    font_ref = len(objects)
+    page_refs = []
+
+    for page in range(pages):
+        topic = topics[page % len(topics)]
+        lines = [make_sentence(rng, topic, length=10) for _ in range(lines_per_page)]
+        text_ops = " T* ".join(f"({line}) Tj" for line in lines)
+        content = f"BT /F1 10 Tf 12 TL 50 780 Td {text_ops} ET".encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+        content_ref = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] /Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>"
+            % (font_ref, content_ref)
+        )
+        page_refs.append(len(objects))
+
+    objects[0] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    kids = " ".join(f"{ref} 0 R" for ref in page_refs).encode("ascii")
+    objects[1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % len(page_refs)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref_offset = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+    return bytes(out)
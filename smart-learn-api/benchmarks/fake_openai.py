@@ -0,0 +1,149 @@
+"""
+Local stand-in for the OpenAI API used by tests and benchmarks.
+
+Implements POST /v1/embeddings and POST /v1/chat/completions (including stream=True) with
+configurable latency. Embeddings are deterministic hashed bag-of-words vectors, so texts that
+share words are close in cosine space and retrieval quality can be measured offline.
+
+Run standalone and point the API at it with OPENAI_BASE_URL:
+    python -m benchmarks.fake_openai --port 8100 --chat-ttft 0.3 --chat-token-latency 0.02
+"""
+import re
+import json
+import time
+import math
+import array
+import base64
+import asyncio
+import hashlib
+import argparse
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+DEFAULT_REPLY = "This is a simulated answer from the fake OpenAI server."
+
+_WORD_RE = re.compile(r"\w+")
+
+def fake_embedding(text: str, dimensions: int = 1536) -> list[float]:
+    """
+    Hash each word of the text into a bucket and L2-normalize the counts.
+    """
+    vec = [0.0] * dimensions
+    for word in _WORD_RE.findall(text.lower()):
+        digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+        bucket = int.from_bytes(digest[:4], "little") % dimensions
+        sign = 1.0 if digest[4] & 1 else -1.0
+        vec[bucket] += sign
+    norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+    return [v / norm for v in vec]
+
+def create_app(
+    embedding_latency: float = 0.0,
+    embedding_item_latency: float = 0.0,
+    chat_ttft: float = 0.0,
+    chat_token_latency: float = 0.0,
+    reply: str = DEFAULT_REPLY,
+    dimensions: int = 1536,
+) -> FastAPI:
+    """
+    Build a fake OpenAI app. Latencies are in seconds:
+    embedding_latency per request plus embedding_item_latency per input,
+    chat_ttft before the first token and chat_token_latency between tokens.
+    Request counters are kept in app.state.stats.
+    """
+    app = FastAPI(title="Fake OpenAI")
+    app.state.stats = {"embedding_requests": 0, "embedding_inputs": 0, "chat_requests": 0}
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body["input"]
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        app.state.stats["embedding_requests"] += 1
+        app.state.stats["embedding_inputs"] += len(inputs)
+        await asyncio.sleep(embedding_latency + embedding_item_latency * len(inputs))
+
+        dims = body.get("dimensions") or dimensions
+        data = []
+        for i, text in enumerate(inputs):
+            vec = fake_embedding(text, dims)
+            if body.get("encoding_format") == "base64":
+                vec = base64.b64encode(array.array("f", vec).tobytes()).decode("ascii")
+            data.append({"object": "embedding", "index": i, "embedding": vec})
+        tokens = sum(len(t.split()) for t in inputs)
+        return JSONResponse({
+            "object": "list",
+            "data": data,
+            "model": body.get("model", "fake-embedding"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        app.state.stats["chat_requests"] += 1
+        model = body.get("model", "fake-llm")
+        created = int(time.time())
+        completion_id = f"chatcmpl-fake-{app.state.stats['chat_requests']}"
+        tokens = re.findall(r"\S+\s*", reply)
+
+        if not body.get("stream"):
+            await asyncio.sleep(chat_ttft + chat_token_latency * max(len(tokens) - 1, 0))
+            return JSONResponse({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)},
+            })
+
+        def chunk(delta: dict, finish_reason=None) -> str:
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            return f"data: {json.dumps(payload)}\n\n"
+
+        async def events():
+            await asyncio.sleep(chat_ttft)
+            yield chunk({"role": "assistant", "content": ""})
+            for i, token in enumerate(tokens):
+                if i:
+                    await asyncio.sleep(chat_token_latency)
+                yield chunk({"content": token})
+            yield chunk({}, finish_reason="stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake OpenAI-compatible server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--embedding-latency", type=float, default=0.0)
+    parser.add_argument("--embedding-item-latency", type=float, default=0.0)
+    parser.add_argument("--chat-ttft", type=float, default=0.0)
+    parser.add_argument("--chat-token-latency", type=float, default=0.0)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    app = create_app(
+        embedding_latency=args.embedding_latency,
+        embedding_item_latency=args.embedding_item_latency,
+        chat_ttft=args.chat_ttft,
+        chat_token_latency=args.chat_token_latency,
+        dimensions=args.dimensions,
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
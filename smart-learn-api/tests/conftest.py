@@ -0,0 +1,48 @@
+import os
+import tempfile
+import pytest
+
+# Settings are read at import time; keep even that first client out of ./chroma_db
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ["CHROMA_DB_PATH"] = tempfile.mkdtemp(prefix="smart-learn-tests-")
+
+import chromadb
+from app.config import settings
+from app.core import (
+    answer_cache, api_keys, conversations, crawler, database, embedding_cache, jobs, lexical, prompts, registry,
+)
+
+# State files that default to a path inside CHROMA_DB_PATH
+_STATE_PATHS = (
+    "EMBEDDING_CACHE_PATH", "JOBS_DB_PATH", "UPLOADS_DIR", "LOCAL_VECTOR_PATH", "CONVERSATION_DB_PATH",
+    "API_KEYS_DB_PATH", "CRAWL_DB_PATH", "REGISTRY_DB_PATH", "LEXICAL_DB_PATH",
+)
+
+def _reset_singletons():
+    database.close_vector_store()
+    conversations.close_conversation_store()
+    for module in (registry, lexical, api_keys, crawler):
+        if module._conn is not None:
+            module._conn.close()
+            module._conn = None
+    api_keys._keys, api_keys._generation, api_keys._checked_at = None, None, 0.0
+    database._kb_profiles.clear()
+    database._kb_generations.clear()
+    prompts._compiled.clear()
+    embedding_cache._cache = None
+    answer_cache._cache = None
+    jobs._queue = None
+
+@pytest.fixture(autouse=True)
+def isolated_state(tmp_path, monkeypatch):
+    """
+    Point every persistent store at a fresh directory so tests never touch ./chroma_db or see each other's data.
+    """
+    chroma_path = str(tmp_path / "chroma_db")
+    monkeypatch.setattr(settings, "CHROMA_DB_PATH", chroma_path)
+    for name in _STATE_PATHS:
+        monkeypatch.setattr(settings, name, None)  # resolved inside chroma_path
+    _reset_singletons()
+    monkeypatch.setattr(database, "client", chromadb.PersistentClient(path=chroma_path))
+    yield
+    _reset_singletons()
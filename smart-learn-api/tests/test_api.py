@@ -1,10 +1,47 @@
+import os
+import json
+import time
+import asyncio
+import httpx
 import pytest
+from fastapi import Request
 from fastapi.testclient import TestClient
+from openai import AsyncOpenAI
 from unittest.mock import MagicMock, patch
 from app.main import app
+from app.api import routes
+from app.core import answer_cache
+from app.core.conversations import get_conversation_store
+from app.core.llm import LLMStreamError
+from app.core.database import invalidate_kb_profile
+from app.utils.hashing import text_hash
+from benchmarks.corpus import make_pdf
+from benchmarks.fake_openai import create_app as create_fake_openai
 
 client = TestClient(app)
 
+@pytest.fixture(autouse=True)
+def fresh_answer_cache():
+    """Tests reuse the same fake embeddings, so each starts with an empty answer cache."""
+    answer_cache._cache = None
+    yield
+    answer_cache._cache = None
+
+def fake_openai_client(**kwargs) -> AsyncOpenAI:
+    """OpenAI client wired in-process to the fake OpenAI server."""
+    transport = httpx.ASGITransport(app=create_fake_openai(**kwargs))
+    return AsyncOpenAI(api_key="test", base_url="http://fake-openai/v1", http_client=httpx.AsyncClient(transport=transport))
+
+def wait_for_job(test_client: TestClient, job_id: str, timeout: float = 10.0) -> dict:
+    """Poll the job status endpoint until the ingestion job finishes."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = test_client.get(f"/api/v1/jobs/{job_id}").json()
+        if job["status"] in ("succeeded", "failed"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"Job {job_id} did not finish in {timeout}s")
+
 def test_read_main():
     response = client.get("/")
     assert response.status_code == 200
@@ -17,12 +54,19 @@ def test_ingest_endpoint(mock_add, mock_embed, mock_extract):
     mock_extract.return_value = "Sample text content"
     mock_embed.return_value = [[0.1, 0.2, 0.3]]
     
-    # Mocking file upload
+    # Mocking file upload; the context manager starts the ingestion workers
     files = {'file': ('test.txt', b'Sample text content', 'text/plain')}
-    response = client.post("/api/v1/kb/kb1/ingest", files=files)
+    with TestClient(app) as test_client:
+        response = test_client.post("/api/v1/kb/kb1/ingest", files=files)
     
-    assert response.status_code == 200
-    assert response.json() == {"message": "File upload accepted for KB kb1. Processing in background."}
+        assert response.status_code == 200
+        data = response.json()
+        assert data["message"] == "File upload accepted for KB kb1. Processing in background."
+        job = wait_for_job(test_client, data["job_id"])
+
+    assert job["status"] == "succeeded"
+    assert job["source"] == "test.txt"
+    assert set(job["stage_timings"]) == {"extract", "chunk", "embed", "store"}
     
     # Verify add_documents called with kb_id
     args = mock_add.call_args
@@ -35,10 +79,14 @@ def test_ingest_url_endpoint(mock_add, mock_embed, mock_extract):
     mock_extract.return_value = "Sample web content"
     mock_embed.return_value = [[0.1, 0.2, 0.3]]
     
-    response = client.post("/api/v1/kb/kb1/ingest/url", json={"url": "http://example.com"})
+    with TestClient(app) as test_client:
+        response = test_client.post("/api/v1/kb/kb1/ingest/url", json={"url": "http://example.com"})
     
-    assert response.status_code == 200
-    assert response.json() == {"message": "URL ingestion accepted for KB kb1. Processing in background."}
+        assert response.status_code == 200
+        data = response.json()
+        assert data["message"] == "URL ingestion accepted for KB kb1. Processing in background."
+        assert wait_for_job(test_client, data["job_id"])["status"] == "succeeded"
+        assert data["job_id"] in [job["id"] for job in test_client.get("/api/v1/kb/kb1/jobs").json()]
     
     # Verify add_documents called with kb_id and correct metadata
     args = mock_add.call_args
@@ -67,25 +115,35 @@ def test_delete_document(mock_delete):
 @patch("app.api.routes.delete_document")
 @patch("app.api.routes.extract_text")
 @patch("app.api.routes.get_embeddings")
-@patch("app.api.routes.add_documents")
-def test_update_document(mock_add, mock_embed, mock_extract, mock_delete):
+@patch("app.api.routes.get_document_chunks")
+@patch("app.api.routes.replace_document")
+def test_update_document(mock_replace, mock_chunks, mock_embed, mock_extract, mock_delete):
     mock_extract.return_value = "New content"
-    mock_embed.return_value = [[0.1, 0.2, 0.3]]
+    mock_chunks.return_value = [
+        {"id": "old1", "chunk_hash": text_hash("New content")},
+        {"id": "old2", "chunk_hash": text_hash("Removed content")},
+    ]
     
     files = {'file': ('new_doc.txt', b'New content', 'text/plain')}
-    response = client.put("/api/v1/kb/kb1/documents/doc1.pdf", files=files)
+    with TestClient(app) as test_client:
+        response = test_client.put("/api/v1/kb/kb1/documents", params={"filename": "doc1.pdf"}, files=files)
     
-    assert response.status_code == 200
-    assert response.json() == {"message": "Document doc1.pdf update started in background for KB kb1."}
+        assert response.status_code == 200
+        data = response.json()
+        assert data["message"] == "Document doc1.pdf update started in background for KB kb1."
+        assert wait_for_job(test_client, data["job_id"])["status"] == "succeeded"
     
-    # Verify delete was called for the old filename
-    mock_delete.assert_called_once_with("kb1", "doc1.pdf")
+    # The old version is never deleted wholesale and unchanged chunks are not re-embedded
+    mock_delete.assert_not_called()
+    mock_embed.assert_not_called()
+    mock_chunks.assert_called_once_with("kb1", "doc1.pdf")
     
-    # Check if add_documents was called with correct kb_id and metadata source
-    call_args = mock_add.call_args
-    assert call_args[0][0] == "kb1"
-    metadatas = call_args[1]['metadatas']
-    assert metadatas[0]['source'] == 'doc1.pdf'
+    args, kwargs = mock_replace.call_args
+    assert args == ("kb1", "doc1.pdf")
+    assert kwargs["chunk_count"] == 1
+    assert kwargs["retained_ids"] == ["old1"]
+    assert kwargs["retained_metadatas"][0]['source'] == 'doc1.pdf'
+    assert kwargs["stale_ids"] == ["old2"]
 
 @patch("app.api.routes.cached_query_embedding")
 @patch("app.api.routes.query_documents")
@@ -115,15 +173,15 @@ def test_set_kb_metadata(mock_set_meta):
     assert response.json() == {"message": "Metadata updated for KB kb1. Name set to 'Marketing KB'."}
     mock_set_meta.assert_called_once_with("kb1", "Marketing KB")
 
-@patch("app.api.routes.get_kb_metadata")
+@patch("app.core.prompts.get_kb_profile")
 @patch("app.api.routes.cached_query_embedding")
 @patch("app.api.routes.query_documents")
 @patch("app.api.routes.generate_response")
-def test_query_with_metadata(mock_llm, mock_query_docs, mock_embed_query, mock_get_meta):
+def test_query_with_metadata(mock_llm, mock_query_docs, mock_embed_query, mock_get_profile):
     mock_embed_query.return_value = [0.1, 0.2, 0.3]
     mock_query_docs.return_value = {'documents': [['Chunk 1']]}
     mock_llm.return_value = "Answer"
-    mock_get_meta.return_value = {"name": "Marketing KB"}
+    mock_get_profile.return_value = {"metadata": {"name": "Marketing KB"}, "chunk_count": 1, "documents": ["brand_guide.pdf"]}
     
     response = client.post("/api/v1/kb/kb1/query", json={"query": "Hello"})
     
@@ -134,4 +192,282 @@ def test_query_with_metadata(mock_llm, mock_query_docs, mock_embed_query, mock_g
     assert call_args is not None
     # args: context, query, system_instruction
     system_instruction = call_args[0][2]
-    assert "You are the Marketing KB assistant" in system_instruction
+    assert "You are Marketing KB, the Marketing KB assistant" in system_instruction
+    assert "I have specific knowledge about: brand_guide." in system_instruction
+    mock_get_profile.assert_called_with("kb1")
+
+@patch("app.api.routes.cached_query_embedding")
+@patch("app.api.routes.query_documents")
+def test_query_stream_endpoint(mock_query_docs, mock_embed_query):
+    mock_embed_query.return_value = [0.1, 0.2, 0.3]
+    mock_query_docs.return_value = {'documents': [['Chunk 1']]}
+
+    with patch("app.core.llm.client", fake_openai_client(reply="Plants make sugar from light.")):
+        response = client.post("/api/v1/kb/kb1/query/stream?format=ndjson", json={"query": "What is photosynthesis?"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    frames = [json.loads(line) for line in response.text.splitlines()]
+    tokens = [f["token"] for f in frames if f["type"] == "token"]
+    assert len(tokens) > 1
+    assert "".join(tokens) == "Plants make sugar from light."
+
+    done = frames[-1]
+    assert done["type"] == "done"
+    assert done["answer"] == "Plants make sugar from light."
+    assert done["context"] == ["Chunk 1"]
+    assert 0 <= done["time_to_first_token"] <= done["latency"]
+    assert {"embedding", "retrieval", "prompt", "llm"} <= set(done["timings"])
+
+@patch("app.api.routes.cached_query_embedding")
+@patch("app.api.routes.query_documents")
+def test_query_stream_sse(mock_query_docs, mock_embed_query):
+    mock_embed_query.return_value = [0.1, 0.2, 0.3]
+    mock_query_docs.return_value = {'documents': [[]]}
+
+    with patch("app.core.llm.client", fake_openai_client(reply="Hello there")):
+        response = client.post("/api/v1/kb/kb1/query/stream", json={"query": "Hi"})
+
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = [block.split("\n") for block in response.text.strip().split("\n\n")]
+    assert events[-1][0] == "event: done"
+    assert json.loads(events[-1][1][len("data: "):])["answer"] == "Hello there"
+
+@patch("app.api.routes.cached_query_embedding")
+@patch("app.api.routes.query_documents")
+def test_failed_stream_is_reported_and_not_kept(mock_query_docs, mock_embed_query):
+    mock_embed_query.return_value = [0.1, 0.2, 0.3]
+    mock_query_docs.return_value = {'documents': [['Chunk 1']]}
+
+    async def failing_stream(*args, **kwargs):
+        yield "Plants make"
+        raise LLMStreamError("Error generating response: connection reset")
+
+    with patch("app.api.routes.generate_response_stream", side_effect=failing_stream):
+        response = client.post("/api/v1/kb/kb-stream-error/query/stream?format=ndjson",
+                               json={"query": "What is photosynthesis?", "session_id": "device-a"})
+
+    frames = [json.loads(line) for line in response.text.splitlines()]
+    assert [f["type"] for f in frames] == ["token", "error"]
+    assert frames[-1] == {"type": "error", "error": "Error generating response: connection reset", "partial_answer": "Plants make"}
+    assert answer_cache.get_answer_cache().stats()["entries"] == 0
+    assert get_conversation_store().history("kb-stream-error", "device-a") == []
+
+@patch("app.api.routes.get_embeddings")
+@patch("app.api.routes.add_documents")
+def test_pdf_ingested_page_by_page_in_batches(mock_add, mock_embed, tmp_path):
+    mock_embed.side_effect = lambda texts: [[0.1, 0.2, 0.3]] * len(texts)
+    path = tmp_path / "book.pdf"
+    path.write_bytes(make_pdf(6, lines_per_page=20))
+
+    from app.api import routes
+    with patch.object(routes.settings, "INGEST_FLUSH_SIZE", 4), patch.object(routes.settings, "PDF_PAGE_BATCH", 2):
+        asyncio.run(routes.process_file("kb1", str(path), "book.pdf"))
+
+    metadatas = [m for call in mock_add.call_args_list for m in call[1]["metadatas"]]
+    assert mock_add.call_count > 1
+    assert all(len(call[1]["ids"]) <= 4 for call in mock_add.call_args_list)
+    assert [m["chunk_index"] for m in metadatas] == list(range(len(metadatas)))
+    assert metadatas[0]["page_start"] == 1
+    assert metadatas[-1]["page_end"] == 6
+    assert all(m["page_start"] <= m["page_end"] for m in metadatas)
+    assert len({m["content_hash"] for m in metadatas}) == 1
+
+def test_retried_ingestion_does_not_duplicate_flushed_chunks(tmp_path):
+    from app.api import routes
+    from app.core import database, registry
+    kb_id = f"test_{os.urandom(4).hex()}"
+    path = tmp_path / "book.pdf"
+    path.write_bytes(make_pdf(6, lines_per_page=20))
+    calls = []
+
+    async def flaky_embeddings(texts):
+        calls.append(len(texts))
+        if len(calls) == 2:
+            raise RuntimeError("embedding API unavailable")
+        return [[0.1, 0.2, 0.3]] * len(texts)
+
+    with patch.object(routes, "get_embeddings", flaky_embeddings), patch.object(routes.settings, "INGEST_FLUSH_SIZE", 4):
+        with pytest.raises(RuntimeError):
+            asyncio.run(routes.process_file(kb_id, str(path), "book.pdf"))
+        asyncio.run(routes.process_file(kb_id, str(path), "book.pdf"))
+
+    stored = database.get_vector_store().get(kb_id, include=("metadatas",))
+    indexes = [m["chunk_index"] for m in stored["metadatas"]]
+    assert sorted(indexes) == list(range(len(indexes)))
+    assert registry.list_records(kb_id)[0]["chunk_count"] == len(indexes)
+    database.delete_knowledge_base(kb_id)
+
+@patch("app.api.routes.search_lexical")
+@patch("app.api.routes.query_documents")
+@patch("app.api.routes.generate_response")
+def test_query_fuses_vector_and_bm25_results(mock_llm, mock_query_docs, mock_lexical):
+    mock_query_docs.return_value = {'documents': [['Vector A', 'Shared']]}
+    mock_lexical.return_value = {'documents': [['Shared', 'Lexical B']]}
+    mock_llm.return_value = "Answer"
+
+    with patch("app.api.routes.cached_query_embedding", return_value=[0.1, 0.2, 0.3]):
+        response = client.post("/api/v1/kb/kb1/query", json={"query": "What is E=mc2?"})
+
+    assert response.json()["context"][0] == "Shared"
+    assert set(response.json()["context"]) == {"Vector A", "Shared", "Lexical B"}
+
+@patch("app.api.routes.search_lexical")
+@patch("app.api.routes.query_documents")
+@patch("app.api.routes.generate_response")
+def test_query_answers_from_bm25_when_embedding_is_slow(mock_llm, mock_query_docs, mock_lexical):
+    mock_lexical.return_value = {'documents': [['Lexical hit']]}
+    mock_llm.return_value = "Answer"
+
+    async def slow_embedding(query):
+        await asyncio.sleep(5)
+
+    from app.api import routes
+    with patch.object(routes, "cached_query_embedding", slow_embedding), patch.object(routes.settings, "LEXICAL_FALLBACK_TIMEOUT", 0.05):
+        start = time.perf_counter()
+        response = client.post("/api/v1/kb/kb1/query", json={"query": "Einstein"})
+
+    assert time.perf_counter() - start < 2
+    assert response.json()["context"] == ["Lexical hit"]
+    mock_query_docs.assert_not_called()
+
+@patch("app.api.routes.search_lexical")
+@patch("app.api.routes.query_documents")
+@patch("app.api.routes.generate_response")
+def test_similar_questions_served_from_answer_cache(mock_llm, mock_query_docs, mock_lexical):
+    mock_query_docs.return_value = {'documents': [['Chlorophyll absorbs light']]}
+    mock_lexical.return_value = {'documents': [[]]}
+    mock_llm.return_value = "Plants turn light into sugar."
+    embeddings = {"What is photosynthesis?": [1.0, 0.0, 0.1], "what is photosynthesis": [1.0, 0.0, 0.12], "Who are you?": [0.0, 1.0, 0.0]}
+
+    async def embed(query):
+        return embeddings[query]
+
+    with patch("app.api.routes.cached_query_embedding", embed):
+        first = client.post("/api/v1/kb/kb1/query", json={"query": "What is photosynthesis?"}).json()
+        second = client.post("/api/v1/kb/kb1/query", json={"query": "what is photosynthesis"}).json()
+        client.post("/api/v1/kb/kb1/query", json={"query": "Who are you?"})
+        assert mock_llm.call_count == 2
+        assert not first["cached"]
+        assert second["cached"]
+        assert second["answer"] == first["answer"]
+        assert second["context"] == ["Chlorophyll absorbs light"]
+
+        # Ingestion and metadata changes drop the KB's cached answers
+        invalidate_kb_profile("kb1")
+        third = client.post("/api/v1/kb/kb1/query", json={"query": "what is photosynthesis"}).json()
+        assert not third["cached"]
+        assert mock_llm.call_count == 3
+
+    stats = client.get("/api/v1/cache/stats").json()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 3
+    assert stats["kbs"]["kb1"]["hit_rate"] == 0.25
+
+@patch("app.api.routes.cached_query_embedding")
+@patch("app.api.routes.query_documents")
+@patch("app.api.routes.generate_response")
+def test_conversation_history_kept_per_session(mock_llm, mock_query_docs, mock_embed_query):
+    mock_embed_query.return_value = [0.1, 0.2, 0.3]
+    mock_query_docs.return_value = {'documents': [['Chunk 1']]}
+    mock_llm.return_value = "Answer"
+
+    with patch.object(answer_cache.settings, "ANSWER_CACHE_ENABLED", False):
+        client.post("/api/v1/kb/kb-sessions/query", json={"query": "First question", "session_id": "device-a"})
+        client.post("/api/v1/kb/kb-sessions/query", json={"query": "Second question"}, headers={"X-Session-Id": "device-a"})
+        client.post("/api/v1/kb/kb-sessions/query", json={"query": "Other device", "session_id": "device-b"})
+
+    histories = [call[1]["history"] for call in mock_llm.call_args_list]
+    assert histories[1] == [{"role": "user", "content": "First question"}, {"role": "assistant", "content": "Answer"}]
+    assert histories[2] == []
+
+@patch("app.api.routes.cached_query_embedding")
+@patch("app.api.routes.query_documents")
+@patch("app.api.routes.generate_response")
+def test_devices_without_session_id_keep_separate_conversations(mock_llm, mock_query_docs, mock_embed_query):
+    mock_embed_query.return_value = [0.1, 0.2, 0.3]
+    mock_query_docs.return_value = {'documents': [['Chunk 1']]}
+    mock_llm.return_value = "Answer"
+
+    with patch.object(answer_cache.settings, "ANSWER_CACHE_ENABLED", False):
+        client.post("/api/v1/kb/kb-devices/query", json={"query": "From device A"}, headers={"Authorization": "Bearer key-a"})
+        client.post("/api/v1/kb/kb-devices/query", json={"query": "From device B"}, headers={"X-API-Key": "key-b"})
+        client.post("/api/v1/kb/kb-devices/query", json={"query": "Device A again"}, headers={"Authorization": "Bearer key-a"})
+
+    histories = [call[1]["history"] for call in mock_llm.call_args_list]
+    assert histories[1] == []
+    assert histories[2] == [{"role": "user", "content": "From device A"}, {"role": "assistant", "content": "Answer"}]
+
+def test_session_falls_back_to_client_address():
+    request = routes.QueryRequest(query="Hi")
+    http_request = Request({"type": "http", "headers": [], "client": ("10.0.0.7", 5000)})
+    assert routes.resolve_session_id(request, None, http_request) == "addr:10.0.0.7"
+    assert routes.resolve_session_id(request, None) == "default"
+
+@patch("app.api.routes.query_documents")
+@patch("app.api.routes.generate_response")
+def test_query_timings_and_metrics(mock_llm, mock_query_docs):
+    mock_query_docs.return_value = {'documents': [['Chunk 1']]}
+    mock_llm.return_value = "Answer"
+
+    with patch("app.api.routes.cached_query_embedding", return_value=[0.1, 0.2, 0.3]):
+        data = client.post("/api/v1/kb/kb-metrics/query?timings=true", json={"query": "What is a cell?"}).json()
+        assert {"embedding", "retrieval", "prompt", "llm", "total"} <= set(data["timings"])
+        assert client.post("/api/v1/kb/kb-metrics/query", json={"query": "What is a cell?"}).json()["timings"] is None
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    lines = response.text.splitlines()
+    assert "# TYPE smart_learn_query_stage_seconds histogram" in lines
+    assert 'smart_learn_query_stage_seconds_count{kb_id="kb-metrics",stage="llm"} 1' in lines
+    assert 'smart_learn_cache_requests_total{cache="answer",result="hit"}' in response.text
+    assert "smart_learn_query_embedding_memo_requests_total" in response.text
+    assert "# TYPE smart_learn_embedding_batch_fill gauge" in lines
+    assert any(line.startswith('smart_learn_embedding_queue_delay_seconds{stat="max"} ') for line in lines)
+
+def test_external_kb_queries_share_pooled_client():
+    requests = []
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(json.loads(request.content))
+        return httpx.Response(200, json={"answer": "From the external KB", "context": [], "latency": 0.01})
+
+    built = []
+    def build(name):
+        built.append(name)
+        return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    with patch("app.core.http_clients._build", side_effect=build), patch("app.api.routes.settings.KB_URL", "http://external-kb/query"):
+        with TestClient(app) as test_client:
+            for query in ("What is a cell?", "What is DNA?"):
+                response = test_client.post("/api/v1/kb/kb1/query", json={"query": query})
+                assert response.status_code == 200
+                assert response.json()["answer"] == "From the external KB"
+
+    # One keep-alive client served both queries
+    assert built == ["kb"]
+    assert [r["query"] for r in requests] == ["What is a cell?", "What is DNA?"]
+
+def test_upload_over_size_limit_rejected(monkeypatch):
+    from app.core.jobs import get_queue
+    monkeypatch.setattr("app.api.routes.settings.MAX_UPLOAD_MB", 0.001)  # ~1 KB
+    monkeypatch.setattr("app.api.routes.settings.UPLOAD_COPY_CHUNK_KB", 1)
+    uploads_dir = get_queue().uploads_dir
+    before = set(os.listdir(uploads_dir)) if os.path.isdir(uploads_dir) else set()
+
+    response = client.post("/api/v1/kb/kb1/ingest", files={"file": ("big.txt", b"x" * 5000, "text/plain")})
+
+    assert response.status_code == 413
+    after = set(os.listdir(uploads_dir)) if os.path.isdir(uploads_dir) else set()
+    assert after == before
+
+def test_upload_copied_to_job_in_chunks(monkeypatch, tmp_path):
+    monkeypatch.setattr("app.api.routes.settings.UPLOAD_COPY_CHUNK_KB", 1)
+    content = make_pdf(2, lines_per_page=5)
+    path = tmp_path / "job"
+    with patch("app.api.routes.get_queue") as mock_queue:
+        mock_queue.return_value.upload_path.return_value = str(path)
+        response = client.post("/api/v1/kb/kb1/ingest", files={"file": ("book.pdf", content, "application/pdf")})
+
+    assert response.status_code == 200
+    assert path.read_bytes() == content
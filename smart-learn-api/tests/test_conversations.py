@@ -0,0 +1,83 @@
+import time
+import pytest
+from app.core import conversations
+from app.core.conversations import MemoryConversationStore, SqliteConversationStore
+
+def exchange(n: int, size: int = 10) -> list[dict]:
+    return [{"role": "user", "content": f"q{n}".ljust(size)}, {"role": "assistant", "content": f"a{n}".ljust(size)}]
+
+def contents(messages: list[dict]) -> list[str]:
+    return [m["content"].strip() for m in messages]
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemoryConversationStore(max_messages=4, ttl=60, max_bytes=2**20)
+    return SqliteConversationStore(str(tmp_path / "conversations.sqlite3"), max_messages=4, ttl=60)
+
+def test_sessions_keep_their_last_messages(store):
+    for n in range(3):
+        store.append("kb1", "device-a", exchange(n))
+    store.append("kb1", "device-b", exchange(9))
+
+    assert contents(store.history("kb1", "device-a")) == ["q1", "a1", "q2", "a2"]
+    assert contents(store.history("kb1", "device-a", limit=2)) == ["q2", "a2"]
+    assert contents(store.history("kb1", "device-b")) == ["q9", "a9"]
+    assert store.history("kb2", "device-a") == []
+
+    store.clear("kb1", "device-b")
+    assert store.history("kb1", "device-b") == []
+    store.clear("kb1")
+    assert store.history("kb1", "device-a") == []
+
+def test_idle_sessions_expire(store, monkeypatch):
+    store.append("kb1", "device-a", exchange(0))
+    now = time.time()
+    monkeypatch.setattr(conversations.time, "time", lambda: now + 61)
+
+    assert store.history("kb1", "device-a") == []
+    store.append("kb1", "device-a", exchange(1))
+    assert contents(store.history("kb1", "device-a")) == ["q1", "a1"]
+
+def test_memory_cap_evicts_least_recently_active_sessions():
+    store = MemoryConversationStore(max_messages=20, ttl=60, max_bytes=3 * 2 * (100 + conversations._MESSAGE_OVERHEAD))
+    for device in ("a", "b", "c"):
+        store.append("kb1", device, exchange(0, size=100))
+    store.history("kb1", "a")
+    store.append("kb1", "a", exchange(1, size=1))
+    store.append("kb1", "d", exchange(0, size=100))
+
+    assert store.history("kb1", "b") == []
+    assert contents(store.history("kb1", "a")) == ["q0", "a0", "q1", "a1"]
+    assert store.stats()["bytes"] <= store.max_bytes
+
+def test_sqlite_store_shared_between_workers(tmp_path):
+    path = str(tmp_path / "conversations.sqlite3")
+    worker_a = SqliteConversationStore(path, max_messages=20, ttl=60)
+    worker_b = SqliteConversationStore(path, max_messages=20, ttl=60)
+
+    worker_a.append("kb1", "device-a", exchange(0))
+    worker_b.append("kb1", "device-a", exchange(1))
+    assert contents(worker_a.history("kb1", "device-a")) == ["q0", "a0", "q1", "a1"]
+
+def test_blocking_backends_run_in_the_store_pool(tmp_path, monkeypatch):
+    import asyncio
+    import threading
+    from app.core import data_access
+    store = SqliteConversationStore(str(tmp_path / "conversations.sqlite3"), max_messages=4, ttl=60)
+    threads = []
+    history = store.history
+    monkeypatch.setattr(store, "history", lambda *args, **kwargs: threads.append(threading.current_thread()) or history(*args, **kwargs))
+    monkeypatch.setattr(conversations, "_store", store)
+
+    async def converse():
+        await data_access.append_conversation("kb1", "device-a", exchange(0))
+        return await data_access.get_conversation_history("kb1", "device-a")
+
+    assert contents(asyncio.run(converse())) == ["q0", "a0"]
+    assert threads and threads[0] is not threading.main_thread()
+
+def test_redis_keys_escape_ids():
+    key = conversations.RedisConversationStore._key
+    assert key("a:b", "c") != key("a", "b:c")
+    assert "*" not in key("kb*", "?")
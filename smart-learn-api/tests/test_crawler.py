@@ -0,0 +1,107 @@
+import uuid
+import asyncio
+import httpx
+import pytest
+from unittest.mock import patch
+from app.config import settings
+from app.api import routes
+from app.core import crawler, registry
+from app.core.database import delete_knowledge_base, get_vector_store
+
+PAGES = {
+    "/": '<a href="/a">A</a> <a href="/a#intro">A again</a> <a href="/b">B</a> <a href="/copy">Copy</a> <a href="http://other.test/x">Other</a>',
+    "/a": "<p>Mitochondria produce energy for the cell.</p>",
+    "/b": '<p>Ribosomes build proteins.</p> <a href="/c">C</a>',
+    "/c": "<p>Too deep to be crawled.</p>",
+    "/copy": "<p>Mitochondria produce energy for the cell.</p>",
+    "/long": "<p>Cells divide by mitosis.</p><p>Chromosomes are copied first.</p><p>The cell then splits in two.</p>" '<a href="/c">C</a>',
+}
+
+class FakeSite:
+    def __init__(self):
+        self.requests = []
+        self.in_flight = self.max_in_flight = 0
+        self.not_modified = 0
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request.url.path)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        etag = f'"{request.url.path}"'
+        if request.headers.get("If-None-Match") == etag:
+            self.not_modified += 1
+            return httpx.Response(304)
+        return httpx.Response(200, text=f"<html><body>{PAGES[request.url.path]}</body></html>", headers={"ETag": etag})
+
+@pytest.fixture
+def site(monkeypatch):
+    monkeypatch.setattr(settings, "EXTRACT_WORKERS", 0)
+    monkeypatch.setattr(settings, "CRAWL_HOST_DELAY", 0.0)
+    monkeypatch.setattr(settings, "CRAWL_PER_HOST", 2)
+    fake = FakeSite()
+    with patch("app.core.http_clients._build", side_effect=lambda name: httpx.AsyncClient(transport=httpx.MockTransport(fake))):
+        yield fake
+
+async def fake_embeddings(texts):
+    return [[0.1, 0.2, 0.3] for _ in texts]
+
+def test_crawl_follows_links_politely_and_skips_unchanged_pages(site):
+    kb_id = f"test_{uuid.uuid4().hex[:8]}"
+    payload = {"seed": "http://docs.test/", "max_depth": 1, "max_pages": 10, "same_domain": True}
+
+    with patch.object(routes, "get_embeddings", side_effect=fake_embeddings) as mock_embed:
+        asyncio.run(routes.process_crawl(kb_id, payload))
+
+        # Depth 1 from the seed, same host only, fragments folded, the duplicate page not stored
+        assert sorted(site.requests) == ["/", "/a", "/b", "/copy"]
+        assert site.max_in_flight <= 2
+        sources = registry.list_sources(kb_id)
+        assert "http://docs.test/a" in sources and "http://docs.test/b" in sources
+        assert "http://docs.test/copy" not in sources
+        # Chunks of all pages were embedded together
+        assert mock_embed.call_count == 1
+
+        # A re-crawl sends conditional requests and embeds nothing
+        site.requests.clear()
+        asyncio.run(routes.process_crawl(kb_id, payload))
+        assert mock_embed.call_count == 1
+        assert site.not_modified == 2  # /a and /b; the seed is downloaded for its links, the copy was never stored
+        assert set(crawler.get_validators(kb_id)) >= {"http://docs.test/a", "http://docs.test/b"}
+
+    delete_knowledge_base(kb_id)
+    assert crawler.get_validators(kb_id) == {}
+
+def test_crawl_retry_completes_partially_stored_pages(site, monkeypatch):
+    kb_id = f"test_{uuid.uuid4().hex[:8]}"
+    monkeypatch.setattr(settings, "INGEST_FLUSH_SIZE", 1)
+    monkeypatch.setattr(settings, "CHUNK_MAX_TOKENS", 8)
+    # Only the seed's links are followed; /long links to /c
+    payload = {"seed": "http://docs.test/a", "urls": ["http://docs.test/long"], "max_depth": 2}
+    failed = []
+
+    async def flaky_embeddings(texts):
+        if "Chromosomes are copied first." in texts and not failed:
+            failed.append(texts)
+            raise RuntimeError("embedding API unavailable")
+        return [[0.1, 0.2, 0.3] for _ in texts]
+
+    url = "http://docs.test/long"
+    with patch.object(routes, "get_embeddings", side_effect=flaky_embeddings):
+        with pytest.raises(RuntimeError):
+            asyncio.run(routes.process_crawl(kb_id, payload))
+        partial = {r["source"]: r["chunk_count"] for r in registry.list_records(kb_id)}[url]
+        asyncio.run(routes.process_crawl(kb_id, payload))
+
+    assert sorted(site.requests) == ["/a", "/a", "/long", "/long"]
+    # The retry kept the flushed chunk and stored the rest of the page
+    chunk_count = {r["source"]: r["chunk_count"] for r in registry.list_records(kb_id)}[url]
+    assert chunk_count == len(get_vector_store().get(kb_id, source=url, include=())["ids"]) > partial
+    delete_knowledge_base(kb_id)
+
+def test_parse_sitemap_index_and_urlset():
+    index = '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9"><sitemap><loc>http://docs.test/pages.xml</loc></sitemap></sitemapindex>'
+    urlset = '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9"><url><loc> http://docs.test/a#top </loc></url><url><loc>http://docs.test/b</loc></url></urlset>'
+    assert crawler.parse_sitemap(index) == ([], ["http://docs.test/pages.xml"])
+    assert crawler.parse_sitemap(urlset) == (["http://docs.test/a", "http://docs.test/b"], [])
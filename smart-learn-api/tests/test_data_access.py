@@ -0,0 +1,38 @@
+import asyncio
+from unittest.mock import patch
+from app.core import data_access
+from app.core.data_access import ReadWriteLock
+
+def test_read_write_lock_admits_waiters_in_order():
+    async def scenario():
+        lock, events = ReadWriteLock(), []
+
+        async def reader(name):
+            await lock.acquire(write=False)
+            events.append(f"start {name}")
+            await asyncio.sleep(0.01)
+            events.append(f"end {name}")
+            lock.release(write=False)
+
+        async def writer(name):
+            await lock.acquire(write=True)
+            events.append(f"start {name}")
+            await asyncio.sleep(0.01)
+            events.append(f"end {name}")
+            lock.release(write=True)
+
+        first = asyncio.create_task(reader("r1"))
+        await asyncio.sleep(0)
+        # r2 arrives after the writer, so it waits for it instead of overtaking it
+        await asyncio.gather(first, writer("w1"), reader("r2"), reader("r3"))
+        return events
+
+    events = asyncio.run(scenario())
+    assert events == ["start r1", "end r1", "start w1", "end w1", "start r2", "start r3", "end r2", "end r3"]
+
+def test_ingestion_writes_split_into_short_batches():
+    with patch.object(data_access.database, "add_documents") as mock_add, patch.object(data_access.settings, "STORE_WRITE_BATCH", 2):
+        ids = ["a", "b", "c", "d", "e"]
+        asyncio.run(data_access.add_documents("kb1", ids=ids, documents=ids, embeddings=[[0.1]] * 5, metadatas=[{}] * 5))
+
+    assert [call[1]["ids"] for call in mock_add.call_args_list] == [["a", "b"], ["c", "d"], ["e"]]
@@ -0,0 +1,167 @@
+import uuid
+from unittest.mock import patch
+from app.core import database, registry, lexical, api_keys, answer_cache
+from app.utils.hashing import text_hash
+
+def test_kb_profile_cached_until_write():
+    kb_id = f"test_{uuid.uuid4().hex[:8]}"
+    database.set_kb_metadata(kb_id, "Biology")
+
+    profile = database.get_kb_profile(kb_id)
+    assert profile["metadata"]["name"] == "Biology"
+    assert profile["chunk_count"] == 0
+
+    # A second read is served from the cache without touching ChromaDB
+    with patch.object(database, "list_documents") as mock_list:
+        assert database.get_kb_profile(kb_id) is profile
+        mock_list.assert_not_called()
+
+    database.add_documents(kb_id, ids=["c1"], documents=["Cells"], embeddings=[[0.1, 0.2, 0.3]], metadatas=[{"source": "cells.pdf", "chunk_index": 0}])
+    profile = database.get_kb_profile(kb_id)
+    assert profile["chunk_count"] == 1
+    assert profile["documents"] == ["cells.pdf"]
+
+    database.delete_knowledge_base(kb_id)
+
+def test_document_registry_tracks_sources():
+    kb_id = f"test_{uuid.uuid4().hex[:8]}"
+    database.set_kb_metadata(kb_id, "Physics")
+    database.add_documents(
+        kb_id,
+        ids=["c1", "c2", "c3"],
+        documents=["Force", "Mass", "Energy"],
+        embeddings=[[0.1, 0.2, 0.3]] * 3,
+        metadatas=[
+            {"source": "newton.pdf", "chunk_index": 0, "content_hash": "abc"},
+            {"source": "newton.pdf", "chunk_index": 1, "content_hash": "abc"},
+            {"source": "energy.txt", "chunk_index": 0},
+        ],
+    )
+
+    records = {r["source"]: r for r in registry.list_records(kb_id)}
+    assert records["newton.pdf"]["chunk_count"] == 2
+    assert records["newton.pdf"]["byte_size"] == len("Force") + len("Mass")
+    assert records["newton.pdf"]["content_hash"] == "abc"
+    assert sorted(database.list_documents(kb_id)) == ["energy.txt", "newton.pdf"]
+
+    database.delete_document(kb_id, "newton.pdf")
+    assert database.list_documents(kb_id) == ["energy.txt"]
+
+    # A rebuild from the stored chunks yields the same registry
+    assert database.rebuild_document_registry(kb_id) == 1
+    assert registry.list_records(kb_id)[0]["chunk_count"] == 1
+
+    database.delete_knowledge_base(kb_id)
+    assert registry.list_records(kb_id) == []
+
+def test_replace_document_swaps_chunks_in_place():
+    kb_id = f"test_{uuid.uuid4().hex[:8]}"
+    database.add_documents(
+        kb_id,
+        ids=["a", "b"],
+        documents=["Old intro", "Old body"],
+        embeddings=[[0.1, 0.2, 0.3]] * 2,
+        metadatas=[{"source": "notes.txt", "chunk_index": 0}, {"source": "notes.txt", "chunk_index": 1}],
+    )
+    # Chunks stored without a chunk_hash are hashed from their text
+    assert {c["chunk_hash"] for c in database.get_document_chunks(kb_id, "notes.txt")} == {text_hash("Old intro"), text_hash("Old body")}
+
+    # New chunks are added first, then the swap keeps "a" and drops "b"
+    database.add_documents(kb_id, ids=["c"], documents=["New body"], embeddings=[[0.3, 0.2, 0.1]],
+                           metadatas=[{"source": "notes.txt", "chunk_index": 1, "chunk_hash": text_hash("New body")}])
+    database.replace_document(
+        kb_id, "notes.txt",
+        retained_ids=["a"], retained_metadatas=[{"source": "notes.txt", "chunk_index": 0, "chunk_hash": text_hash("Old intro")}],
+        stale_ids=["b"], chunk_count=2, byte_size=17, content_hash="v2",
+    )
+
+    stored = database.get_collection(kb_id).get(include=["documents"])
+    assert sorted(stored["documents"]) == ["New body", "Old intro"]
+    assert registry.list_records(kb_id)[0]["chunk_count"] == 2
+    assert registry.list_records(kb_id)[0]["content_hash"] == "v2"
+    assert database.get_kb_profile(kb_id)["chunk_count"] == 2
+
+    database.delete_knowledge_base(kb_id)
+
+def test_lexical_index_follows_chunk_changes():
+    kb_id = f"test_{uuid.uuid4().hex[:8]}"
+    database.add_documents(
+        kb_id,
+        ids=["c1", "c2", "c3"],
+        documents=["Einstein wrote E=mc2 in 1905.", "Photosynthesis makes glucose.", "Glucose feeds the cell."],
+        embeddings=[[0.1, 0.2, 0.3]] * 3,
+        metadatas=[{"source": "physics.txt"}, {"source": "bio.txt"}, {"source": "bio.txt"}],
+    )
+
+    assert database.search_lexical(kb_id, "what is e=mc2?")["ids"] == [["c1"]]
+    assert database.search_lexical(kb_id, "glucose photosynthesis")["ids"][0][0] == "c2"
+
+    database.delete_document(kb_id, "bio.txt")
+    assert database.search_lexical(kb_id, "glucose")["documents"] == [[]]
+
+    # Stores created before the index existed are indexed on first use
+    lexical.drop_knowledge_base(kb_id)
+    assert database.search_lexical(kb_id, "Einstein")["ids"] == [["c1"]]
+
+    database.delete_knowledge_base(kb_id)
+    assert not lexical.is_indexed(kb_id)
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    fused = lexical.reciprocal_rank_fusion([["a", "b", "c"], ["c", "d", "a"]], k=60, limit=3)
+    assert fused[:2] == ["a", "c"]
+    assert set(fused) <= {"a", "b", "c", "d"}
+
+def test_api_keys_hashed_at_rest_and_migrated():
+    kb_id = f"test_{uuid.uuid4().hex[:8]}"
+    api_key = f"device-{uuid.uuid4().hex}"
+    database.store_api_key_mapping(api_key, kb_id)
+    assert database.get_kb_id_by_api_key(api_key) == kb_id
+    assert database.get_kb_id_by_api_key("unknown-key") is None
+
+    # Only the digest is stored, and a reload from SQLite serves the same mapping
+    rows = api_keys._get_conn().execute("SELECT key_hash FROM api_keys WHERE kb_id = ?", (kb_id,)).fetchall()
+    assert [row["key_hash"] for row in rows] == [api_keys.hash_key(api_key)]
+    api_keys.load()
+    assert database.get_kb_id_by_api_key(api_key) == kb_id
+
+    # Keys from the legacy Chroma collection are imported and the collection dropped
+    legacy_key = f"legacy-{uuid.uuid4().hex}"
+    database.client.get_or_create_collection(database.LEGACY_API_KEY_COLLECTION).upsert(
+        ids=[legacy_key], documents=["API key"], embeddings=[[0.1, 0.2, 0.3]], metadatas=[{"kb_id": kb_id}]
+    )
+    assert database.migrate_api_keys() == 1
+    assert database.get_kb_id_by_api_key(legacy_key) == kb_id
+    assert database.LEGACY_API_KEY_COLLECTION not in [c.name for c in database.client.list_collections()]
+
+    database.delete_knowledge_base(kb_id)
+    assert database.get_kb_id_by_api_key(api_key) is None
+    assert database.get_kb_id_by_api_key(legacy_key) is None
+
+def test_api_key_revoked_by_another_worker_stops_resolving(monkeypatch):
+    kb_id = f"test_{uuid.uuid4().hex[:8]}"
+    api_key = f"device-{uuid.uuid4().hex}"
+    api_keys.set_key(api_key, kb_id)
+    assert api_keys.lookup(api_key) == kb_id
+
+    # Another worker process deletes the key: only SQLite changes, this worker's dict still has it
+    conn = api_keys._get_conn()
+    with conn:
+        conn.execute("DELETE FROM api_keys WHERE key_hash = ?", (api_keys.hash_key(api_key),))
+        api_keys._bump_generation(conn)
+    monkeypatch.setattr(api_keys.settings, "API_KEYS_RECHECK_SECONDS", 3600.0)
+    assert api_keys.lookup(api_key) == kb_id
+    monkeypatch.setattr(api_keys.settings, "API_KEYS_RECHECK_SECONDS", 0.0)
+    assert api_keys.lookup(api_key) is None
+
+def test_answers_invalidated_by_another_worker_stop_being_served():
+    kb_id = f"test_{uuid.uuid4().hex[:8]}"
+    worker = answer_cache.AnswerCache(0.95, 3600, 100, recheck=0.0, shared_generation=registry.get_generation)
+    worker.refresh(kb_id)
+    worker.store(kb_id, "What do cells need?", [1.0, 0.0], "Energy", ["Chunk"], generation=worker.generation(kb_id))
+    assert worker.lookup(kb_id, [1.0, 0.0])["answer"] == "Energy"
+
+    # Another worker ingests into the KB: its invalidation only reaches this one through the registry
+    database.invalidate_kb_profile(kb_id)
+    assert worker.refresh_due(kb_id)
+    worker.refresh(kb_id)
+    assert worker.lookup(kb_id, [1.0, 0.0]) is None
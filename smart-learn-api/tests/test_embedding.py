@@ -0,0 +1,106 @@
+import asyncio
+import httpx
+import pytest
+from unittest.mock import patch
+from openai import AsyncOpenAI
+from app.core import embedding, embedding_cache
+from benchmarks.fake_openai import create_app as create_fake_openai, fake_embedding
+
+@pytest.fixture(autouse=True)
+def isolated_cache(tmp_path, monkeypatch):
+    cache = embedding_cache.EmbeddingCache(str(tmp_path / "embedding_cache.sqlite3"), max_bytes=10 * 1024 * 1024)
+    monkeypatch.setattr(embedding_cache, "_cache", cache)
+    return cache
+
+def fake_openai():
+    fake = create_fake_openai(dimensions=8)
+    transport = httpx.ASGITransport(app=fake)
+    client = AsyncOpenAI(api_key="test", base_url="http://fake-openai/v1", http_client=httpx.AsyncClient(transport=transport))
+    return fake, client
+
+def test_concurrent_queries_share_one_request():
+    fake, client = fake_openai()
+    batcher = embedding.EmbeddingBatcher(max_batch_size=16, max_wait_ms=20)
+
+    async def run():
+        return await asyncio.gather(*(batcher.submit(f"question {i}") for i in range(10)))
+
+    with patch.object(embedding, "client", client):
+        results = asyncio.run(run())
+
+    assert len(results) == 10
+    assert results[3] == pytest.approx(fake_embedding("question 3", 8), abs=1e-6)
+    assert fake.state.stats["embedding_requests"] == 1
+    snapshot = batcher.snapshot()
+    assert snapshot["batches"] == 1
+    assert snapshot["avg_batch_size"] == 10
+
+def test_full_batch_is_sent_without_waiting():
+    fake, client = fake_openai()
+    batcher = embedding.EmbeddingBatcher(max_batch_size=4, max_wait_ms=10_000)
+
+    async def run():
+        return await asyncio.wait_for(asyncio.gather(*(batcher.submit(f"q{i}") for i in range(8))), timeout=5)
+
+    with patch.object(embedding, "client", client):
+        assert len(asyncio.run(run())) == 8
+    assert fake.state.stats["embedding_requests"] == 2
+
+def test_plan_batches_respects_item_and_token_limits():
+    texts = ["a" * 30] * 10  # 8 estimated tokens each
+    assert embedding.plan_batches(texts, max_items=4, max_tokens=1000) == [(0, 4), (4, 8), (8, 10)]
+    assert embedding.plan_batches(texts, max_items=100, max_tokens=20) == [(0, 2), (2, 4), (4, 6), (6, 8), (8, 10)]
+    assert embedding.plan_batches(["a" * 300], max_items=10, max_tokens=5) == [(0, 1)]
+
+def test_large_input_is_batched_in_order():
+    fake, client = fake_openai()
+    texts = [f"chunk number {i}" for i in range(25)]
+
+    with patch.object(embedding, "client", client), \
+         patch.object(embedding.settings, "EMBEDDING_MAX_BATCH_ITEMS", 4), \
+         patch.object(embedding.settings, "EMBEDDING_CONCURRENCY", 2):
+        results = asyncio.run(embedding.get_embeddings(texts))
+
+    assert fake.state.stats["embedding_requests"] == 7
+    assert [r == pytest.approx(fake_embedding(t, 8), abs=1e-6) for r, t in zip(results, texts)] == [True] * 25
+
+def test_cache_avoids_repeat_requests(isolated_cache):
+    fake, client = fake_openai()
+    texts = ["Photosynthesis  happens in leaves.", "Cells divide.", "Cells divide."]
+
+    with patch.object(embedding, "client", client):
+        first = asyncio.run(embedding.get_embeddings(texts))
+        # Whitespace differences normalize to the same key
+        second = asyncio.run(embedding.get_embeddings(["Photosynthesis happens in\nleaves.", "Cells divide."]))
+
+    assert fake.state.stats["embedding_requests"] == 1
+    assert fake.state.stats["embedding_inputs"] == 2
+    assert second[0] == pytest.approx(first[0], abs=1e-6)
+    assert isolated_cache.stats()["hits"] == 2
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    vector = [0.5] * 256  # 1 KiB as float32
+    cache = embedding_cache.EmbeddingCache(str(tmp_path / "lru.sqlite3"), max_bytes=4 * 1024)
+    for i in range(4):
+        cache.put_many("m", [f"text {i}"], [vector])
+    cache.get_many("m", ["text 0"])  # refresh the oldest entry
+    cache.put_many("m", ["text 4"], [vector])
+
+    assert cache.stats()["bytes"] <= 4 * 1024
+    assert cache.get_many("m", ["text 0"])[0] is not None
+    assert cache.get_many("m", ["text 1"])[0] is None
+
+def test_cache_hits_write_recency_back_in_batches(tmp_path):
+    cache = embedding_cache.EmbeddingCache(str(tmp_path / "touch.sqlite3"), max_bytes=1024 * 1024, touch_interval=3600)
+    cache.put_many("m", ["a", "b"], [[0.1], [0.2]])
+
+    def last_used():
+        return dict(cache._conn.execute("SELECT key, last_used FROM embeddings").fetchall())
+
+    stored = last_used()
+    cache.get_many("m", ["a", "b"])
+    assert last_used() == stored  # only recorded in memory
+
+    cache.touch_interval = 0
+    cache.get_many("m", ["a"])
+    assert all(last_used()[key] > stored[key] for key in stored)
@@ -0,0 +1,61 @@
+import pytest
+from app.core import html_text
+
+PAGE = """<!DOCTYPE html><html><head><title>Cells</title><script>var x = 1;</script></head><body>
+<header role="banner"><a href="/">Encyclopedia</a></header>
+<nav id="mw-panel"><a href="/wiki/Gravity">Gravity</a></nav>
+<main id="content">
+  <h1>Cells</h1>
+  <div id="toc" class="toc"><a href="#structure">Structure</a></div>
+  <h2 id="structure">Structure<span class="mw-editsection">[<a href="?action=edit">edit</a>]</span></h2>
+  <p>Every cell has a <b>membrane</b>.<sup class="reference"><a href="#cite-1">[1]</a></sup> Most have a nucleus.</p>
+  <div class="reflist"><ol class="references"><li id="cite-1">Alberts, Molecular Biology.</li></ol></div>
+</main>
+<footer id="footer">Privacy policy</footer>
+</body></html>"""
+
+def installed_engines():
+    engines = []
+    for engine in html_text.ENGINES:
+        try:
+            engines.append(html_text.resolve_engine(engine))
+        except RuntimeError:
+            pass
+    return engines
+
+@pytest.mark.parametrize("engine", installed_engines())
+def test_main_content_drops_boilerplate(engine):
+    text, links = html_text.extract(PAGE, base_url="http://docs.test/wiki/Cells", engine=engine, main_content=True)
+
+    assert "Cells" in text and "Structure" in text
+    assert "membrane" in text and "Most have a nucleus." in text
+    for boilerplate in ("Encyclopedia", "Gravity", "edit", "[1]", "Alberts", "Privacy", "var x"):
+        assert boilerplate not in text
+    # Links come from the whole page, navigation included
+    assert "http://docs.test/wiki/Gravity" in links
+
+def test_fast_engines_keep_inline_markup_on_its_line():
+    for engine in set(installed_engines()) - {"bs4"}:
+        assert "Every cell has a membrane. Most have a nucleus." in html_text.html_to_text(PAGE, engine=engine).splitlines()
+
+def test_bs4_without_main_content_keeps_original_output():
+    text = html_text.html_to_text("<p>Hello <b>world</b></p><script>x()</script><p>Bye  now</p>", engine="bs4", main_content=False)
+    assert text == "Hello\nworld\nBye\nnow"
+
+def test_unknown_engine_rejected():
+    with pytest.raises(ValueError):
+        html_text.resolve_engine("regex")
+
+@pytest.mark.parametrize("engine", installed_engines())
+@pytest.mark.parametrize("depth", [255, 1200])
+def test_deeply_nested_page_keeps_its_text(engine, depth):
+    page = "<div>" * depth + "deep text" + "</div>" * depth + "<p>tail</p>"
+    assert html_text.html_to_text(page, engine=engine, main_content=False) == "deep text\ntail"
+
+def test_failing_fast_engine_falls_back_to_bs4(monkeypatch):
+    def broken(html, main_content, base_url):
+        raise RecursionError("maximum recursion depth exceeded")
+
+    for engine in set(installed_engines()) - {"bs4"}:
+        monkeypatch.setitem(html_text._ENGINES, engine, broken)
+        assert "Most have a nucleus." in html_text.html_to_text(PAGE, engine=engine)
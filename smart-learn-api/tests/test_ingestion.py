@@ -0,0 +1,75 @@
+import time
+import asyncio
+import httpx
+import pytest
+from unittest.mock import patch
+from fastapi import HTTPException
+from app.config import settings
+from app.core import ingestion
+from app.utils.tokens import estimate_tokens
+from app.api.routes import StoredUpload
+from benchmarks.corpus import make_document, make_pdf
+
+def test_pdf_extracted_in_process_pool_from_path(tmp_path):
+    path = tmp_path / "book.pdf"
+    path.write_bytes(make_pdf(3, lines_per_page=5))
+
+    try:
+        text = asyncio.run(ingestion.extract_text(StoredUpload(str(path), "book.pdf")))
+    finally:
+        ingestion.shutdown_extraction_pool()
+
+    assert text.count("\n") >= 15
+    assert "." in text
+
+def test_structured_chunker_keeps_sentences_whole_and_within_budget():
+    document = make_document("gravity", paragraphs=12)
+    chunker = ingestion.StructuredChunker(max_tokens=120)
+    chunks = chunker.feed(document) + chunker.finish()
+
+    sentences = " ".join(document.split()).split(". ")
+    assert all(estimate_tokens(chunk.text) <= 120 + len(chunk.text.split("\n\n")) for chunk in chunks)
+    assert all(chunk.text.endswith(".") for chunk in chunks)
+    # Headings open a new chunk instead of trailing the previous section
+    assert [c.text.split("\n")[0] for c in chunks if "##" in c.text] == ["## Gravity part 2", "## Gravity part 3"]
+    assert all(c.text.startswith("##") for c in chunks if "##" in c.text)
+    # No text is lost or duplicated without overlap
+    assert " ".join(" ".join(c.text.split()) for c in chunks) == " ".join(document.split())
+    assert len(sentences) > len(chunks)
+
+def test_structured_chunker_streams_pages_with_page_ranges():
+    # Page texts end with a newline, as produced by iter_pdf_pages
+    pages = ["First page sentence one. Sentence two continues\n", "onto the next page. Closing words.\n", "Last page.\n"]
+    chunker = ingestion.StructuredChunker(max_tokens=12)
+    chunks = []
+    for number, text in enumerate(pages, start=1):
+        chunks += chunker.feed(text, number)
+    chunks += chunker.finish()
+
+    assert [c.text for c in chunks] == ["First page sentence one.", "Sentence two continues onto the next page.", "Closing words. Last page."]
+    assert [(c.page_start, c.page_end) for c in chunks] == [(1, 1), (1, 2), (2, 3)]
+
+def test_text_and_csv_read_memory_mapped_from_path(tmp_path):
+    txt = tmp_path / "notes.txt"
+    txt.write_text("Mitochondria – the powerhouse of the cell.", encoding="utf-8")
+    csv = tmp_path / "table.csv"
+    csv.write_text("organelle,role\nnucleus,control\n")
+    empty = tmp_path / "empty.txt"
+    empty.write_bytes(b"")
+
+    assert ingestion._parse_txt(str(txt)) == "Mitochondria – the powerhouse of the cell."
+    assert "nucleus" in ingestion._parse_csv(str(csv))
+    assert ingestion._parse_txt(str(empty)) == ""
+
+def test_web_page_extraction_timeout_is_reported(monkeypatch):
+    monkeypatch.setattr(settings, "EXTRACT_WORKERS", 0)
+    monkeypatch.setattr(settings, "EXTRACT_TIMEOUT", 0.05)
+    site = httpx.MockTransport(lambda request: httpx.Response(200, text="<p>Slow page</p>"))
+
+    with patch("app.core.http_clients._build", side_effect=lambda name: httpx.AsyncClient(transport=site)), \
+         patch.object(ingestion, "html_to_text", side_effect=lambda html: time.sleep(0.5)):
+        with pytest.raises(HTTPException) as error:
+            asyncio.run(ingestion.fetch_web_page("http://docs.test/slow"))
+
+    assert error.value.status_code == 500
+    assert "timed out" in error.value.detail
@@ -0,0 +1,102 @@
+import asyncio
+import threading
+import pytest
+from app.core import jobs
+
+@pytest.fixture
+def queue(tmp_path):
+    return jobs.JobQueue(
+        path=str(tmp_path / "jobs.sqlite3"),
+        uploads_dir=str(tmp_path / "uploads"),
+        workers=1,
+        max_attempts=2,
+        retry_backoff=0.0,
+        lease=60.0,
+    )
+
+def test_failed_job_is_retried_then_succeeds(queue):
+    calls = []
+
+    async def flaky(kb_id, payload):
+        calls.append(payload["n"])
+        jobs.report_stage("extract")
+        if len(calls) == 1:
+            raise RuntimeError("temporary failure")
+        jobs.report_stage("store")
+
+    jobs.register_handler("test-flaky", flaky)
+    job_id = queue.enqueue("test-flaky", "kb1", {"n": 1})
+
+    asyncio.run(queue.run_one())
+    job = queue.get_job(job_id)
+    assert job["status"] == jobs.QUEUED
+    assert job["error"] == "temporary failure"
+
+    asyncio.run(queue.run_one())
+    job = queue.get_job(job_id)
+    assert job["status"] == jobs.SUCCEEDED
+    assert job["attempts"] == 2
+    assert job["progress"] == 1.0
+    assert set(job["stage_timings"]) == {"extract", "store"}
+
+def test_jobs_of_one_kb_run_in_order(queue):
+    order = []
+
+    async def record(kb_id, payload):
+        order.append((kb_id, payload["n"]))
+        await asyncio.sleep(0.01)
+
+    jobs.register_handler("test-record", record)
+    for n in range(3):
+        queue.enqueue("test-record", "kb1", {"n": n})
+    queue.enqueue("test-record", "kb2", {"n": 0})
+
+    async def run_workers():
+        await asyncio.gather(*(queue.run_one() for _ in range(4)))
+        while await queue.run_one():
+            pass
+
+    asyncio.run(run_workers())
+    assert [n for kb, n in order if kb == "kb1"] == [0, 1, 2]
+    # kb2 doesn't wait behind kb1's backlog
+    assert order.index(("kb2", 0)) < order.index(("kb1", 2))
+
+def test_job_whose_worker_dies_fails_after_max_attempts(queue):
+    jobs.register_handler("test-crash", lambda kb_id, payload: None)
+    job_id = queue.enqueue("test-crash", "kb1", {})
+
+    def claim_and_crash():
+        assert queue._claim()["id"] == job_id
+        # The worker process dies: no result is written and its lease runs out
+        with queue._conn:
+            queue._conn.execute("UPDATE jobs SET heartbeat_at = 0 WHERE id = ?", (job_id,))
+
+    claim_and_crash()
+    claim_and_crash()
+    assert queue._claim() is None
+    job = queue.get_job(job_id)
+    assert job["status"] == jobs.FAILED
+    assert job["attempts"] == 2
+    assert "lease expired" in job["error"]
+
+def test_queue_sqlite_access_runs_off_the_event_loop(queue, monkeypatch):
+    threads = []
+    for name in ("_claim", "_update"):
+        method = getattr(queue, name)
+        def record(*args, _method=method, **kwargs):
+            threads.append(threading.current_thread())
+            return _method(*args, **kwargs)
+        monkeypatch.setattr(queue, name, record)
+
+    async def staged(kb_id, payload):
+        jobs.report_stage("extract")
+        jobs.report_progress(1, 2)
+        await asyncio.sleep(0)
+
+    jobs.register_handler("test-staged", staged)
+    job_id = queue.enqueue("test-staged", "kb1", {})
+    asyncio.run(queue.run_one())
+
+    assert len(threads) >= 3  # claim, progress, final state
+    assert threading.main_thread() not in threads
+    assert queue.get_job(job_id)["status"] == jobs.SUCCEEDED
@@ -0,0 +1,26 @@
+import uuid
+from unittest.mock import patch
+from app.core import database, prompts
+
+def test_prompt_compiled_once_per_kb_profile():
+    kb_id = f"test_{uuid.uuid4().hex[:8]}"
+    database.set_kb_metadata(kb_id, "Biology", assistant_name="Ada", conversation_types=["Q&A"])
+    database.add_documents(kb_id, ids=["c1"], documents=["Cells"], embeddings=[[0.1, 0.2, 0.3]], metadatas=[{"source": "cell_biology.pdf", "chunk_index": 0}])
+
+    compiled = prompts.get_compiled_prompt(kb_id)
+    assert "You are Ada, the Biology assistant" in compiled.render(has_context=True)
+    assert "knowledge about: cell_biology." in compiled.render(has_context=True)
+    assert "direct, concise Q&A style" in compiled.render(has_context=False)
+
+    with patch.object(prompts, "compile_prompt") as mock_compile:
+        assert prompts.get_compiled_prompt(kb_id) is compiled
+        mock_compile.assert_not_called()
+
+    # Metadata changes recompile the prompt
+    database.set_kb_metadata(kb_id, "Biology", assistant_name="Ada", instruction="I am {assistant_name}.", custom_instruction=True)
+    compiled = prompts.get_compiled_prompt(kb_id)
+    assert compiled.render(has_context=True).startswith("I am Ada.")
+    assert "Use the provided context" in compiled.render(has_context=True)
+    assert "not found in the 'Biology' knowledge base" in compiled.render(has_context=False)
+
+    database.delete_knowledge_base(kb_id)
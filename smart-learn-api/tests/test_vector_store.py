@@ -0,0 +1,146 @@
+import sys
+import subprocess
+import numpy as np
+import pytest
+from app.core import vector_store
+from app.core.vector_store import LocalVectorStore
+
+def unit(i: int, dims: int = 8) -> list[float]:
+    vec = [0.0] * dims
+    vec[i % dims] = 1.0
+    return vec
+
+def add(store, kb_id, ids, source="doc.txt"):
+    store.add(
+        kb_id, ids=ids, documents=[f"text {i}" for i in ids],
+        embeddings=[unit(int(i)) for i in ids], metadatas=[{"source": source, "chunk_index": int(i)} for i in ids],
+    )
+
+@pytest.mark.parametrize("dtype", ["float32", "float16"])
+def test_local_store_queries_nearest_chunks(tmp_path, dtype):
+    store = LocalVectorStore(str(tmp_path), dtype=dtype)
+    add(store, "kb1", ["0", "1", "2"])
+    add(store, "kb2", ["3"])
+
+    result = store.query("kb1", [0.1, 0.9, 0.2, 0, 0, 0, 0, 0], n_results=2)
+    assert result["ids"] == [["1", "2"]]
+    assert result["documents"] == [["text 1", "text 2"]]
+    assert result["metadatas"][0][0] == {"source": "doc.txt", "chunk_index": 1}
+    assert store.count("kb1") == 3
+    assert store.query("missing", unit(0))["documents"] == [[]]
+
+def test_local_store_update_delete_and_reload(tmp_path):
+    store = LocalVectorStore(str(tmp_path))
+    add(store, "kb1", ["0", "1"], source="a.txt")
+    add(store, "kb1", ["2"], source="b.txt")
+
+    store.update_metadatas("kb1", ["0"], [{"source": "a.txt", "chunk_index": 5}])
+    store.delete("kb1", source="b.txt")
+    store.delete("kb1", ids=["1"])
+    store.close()
+
+    reopened = LocalVectorStore(str(tmp_path))
+    assert reopened.get("kb1")["metadatas"] == [{"source": "a.txt", "chunk_index": 5}]
+    assert reopened.query("kb1", unit(2), n_results=5)["ids"] == [["0"]]
+    assert reopened.get("kb1", source="b.txt")["ids"] == []
+
+    reopened.drop("kb1")
+    assert reopened.count("kb1") == 0
+
+def test_local_store_compacts_deleted_rows(tmp_path):
+    store = LocalVectorStore(str(tmp_path))
+    ids = [str(i) for i in range(3000)]
+    store.add("kb1", ids=ids, documents=ids, embeddings=np.random.default_rng(0).normal(size=(3000, 8)).tolist(),
+              metadatas=[{"source": "big.txt" if i < 2000 else "small.txt"} for i in range(3000)])
+
+    store.delete("kb1", source="big.txt")
+
+    assert store._kbs["kb1"].rows == 1000
+    assert store.get("kb1", limit=2)["ids"] == ["2000", "2001"]
+    vector = store._kbs["kb1"].compact.array[0]
+    assert store.query("kb1", vector.tolist(), n_results=1)["ids"] == [["2000"]]
+
+@pytest.mark.parametrize("dtype,dims", [("int8", None), ("float16", 32), ("int8", 32)])
+def test_quantized_store_reranks_at_full_precision(tmp_path, dtype, dims):
+    rng = np.random.default_rng(2)
+    # Matryoshka-style embeddings concentrate information in the leading dimensions
+    vectors = rng.normal(size=(2000, 64)) * np.exp(-np.arange(64) / 24)
+    ids = [str(i) for i in range(2000)]
+    store = LocalVectorStore(str(tmp_path), dtype=dtype, dims=dims, rerank_candidates=50)
+    store.add("kb1", ids=ids, documents=ids, embeddings=vectors.tolist(), metadatas=[{"source": "x"}] * 2000)
+
+    kb = store._kbs["kb1"]
+    assert kb.compact.array.dtype == np.dtype(dtype)
+    assert kb.compact.array.shape[1] == (dims or 64)
+    assert kb.full is not None
+    # Full precision decides the final ranking: a stored vector is its own nearest neighbour
+    assert store.query("kb1", vectors[7].tolist(), n_results=5)["ids"][0][0] == "7"
+
+    report = store.recall("kb1", queries=50, k=5)
+    assert report["recall@5"] >= 0.9
+    assert report["recall@5"] >= report["recall@5_without_rerank"]
+    assert report["bytes_per_vector"] < report["full_bytes_per_vector"]
+
+def test_float32_store_keeps_no_full_copy(tmp_path):
+    store = LocalVectorStore(str(tmp_path))
+    add(store, "kb1", ["0", "1"])
+    assert store._kbs["kb1"].full is None
+    assert store.recall("kb1", queries=2, k=1)["recall@1"] == 1.0
+
+def test_local_store_switches_to_hnsw_for_large_kbs(tmp_path):
+    pytest.importorskip("hnswlib")
+    store = LocalVectorStore(str(tmp_path), hnsw_threshold=100)
+    vectors = np.random.default_rng(1).normal(size=(500, 16))
+    ids = [str(i) for i in range(500)]
+    store.add("kb1", ids=ids, documents=ids, embeddings=vectors.tolist(), metadatas=[{"source": "x"}] * 500)
+
+    assert store.query("kb1", vectors[42].tolist(), n_results=3)["ids"][0][0] == "42"
+    store.wait_for_index("kb1")
+    assert store._kbs["kb1"].hnsw is not None
+    store.delete("kb1", ids=["42"])
+    assert "42" not in store.query("kb1", vectors[42].tolist(), n_results=3)["ids"][0]
+
+def test_writes_during_hnsw_build_are_caught_up(tmp_path):
+    pytest.importorskip("hnswlib")
+    store = LocalVectorStore(str(tmp_path), hnsw_threshold=100)
+    vectors = np.random.default_rng(2).normal(size=(600, 16))
+    ids = [str(i) for i in range(600)]
+    store.add("kb1", ids=ids[:500], documents=ids[:500], embeddings=vectors[:500].tolist(), metadatas=[{"source": "x"}] * 500)
+
+    store.query("kb1", vectors[0].tolist())  # starts the build in the background
+    store.add("kb1", ids=ids[500:], documents=ids[500:], embeddings=vectors[500:].tolist(), metadatas=[{"source": "x"}] * 100)
+    store.delete("kb1", ids=["7"])
+    store.wait_for_index("kb1")
+
+    assert store._kbs["kb1"].hnsw is not None
+    assert store.query("kb1", vectors[550].tolist(), n_results=1)["ids"][0] == ["550"]
+    assert "7" not in store.query("kb1", vectors[7].tolist(), n_results=3)["ids"][0]
+    store.close()
+
+@pytest.mark.skipif(vector_store.fcntl is None, reason="needs fcntl (POSIX)")
+def test_local_store_refuses_a_second_process(tmp_path):
+    store = LocalVectorStore(str(tmp_path))
+    other = subprocess.run(
+        [sys.executable, "-c", f"from app.core.vector_store import LocalVectorStore; LocalVectorStore({str(tmp_path)!r})"],
+        capture_output=True, text=True,
+    )
+    assert other.returncode != 0 and "already open in another process" in other.stderr
+
+    store.close()
+    reopened = subprocess.run(
+        [sys.executable, "-c", f"from app.core.vector_store import LocalVectorStore; LocalVectorStore({str(tmp_path)!r}).close()"],
+        capture_output=True, text=True,
+    )
+    assert reopened.returncode == 0, reopened.stderr
+
+def test_unknown_vector_store_rejected(monkeypatch):
+    monkeypatch.setattr(vector_store.settings, "VECTOR_STORE", "faiss")
+    with pytest.raises(ValueError):
+        vector_store.create_vector_store()
+
+def test_incomplete_backend_fails_at_construction():
+    class NoDrop(vector_store.VectorStore):
+        add = query = get = update_metadatas = delete = count = lambda self, *args, **kwargs: None
+
+    with pytest.raises(TypeError, match="drop"):
+        NoDrop()